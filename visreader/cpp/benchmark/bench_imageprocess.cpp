@@ -0,0 +1,158 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+/**
+ * function:
+ *  micro benchmark for the per-image overhead of 'ImageProcess',
+ *  ops are applied on a tiny image so the cost of dispatching them
+ *  dominates, and it's compared with the cost of parsing 'ops_conf'
+ *  which is paid only once in 'ImageProcess::init', mallocs for each
+ *  image are also counted with and without 'MatArena', build it with:
+ *    g++ -O2 -std=c++11 -fopenmp -I. -Iinclude \
+ *        benchmark/bench_imageprocess.cpp $(ls src/*.cpp | grep -v lua) \
+ *        -lopencv_imgcodecs -lopencv_imgproc -lopencv_core \
+ *        -o bench_imageprocess
+ *  and run it as './bench_imageprocess [iters] [image_size]'
+ **/
+
+#include <errno.h>
+#include <cstdlib>
+#include <iostream>
+#include <string>
+#include <vector>
+#include "include/imageprocess.h"
+#include "include/mat_arena.h"
+#include "include/util.h"
+#include "opencv2/opencv.hpp"
+
+using namespace vistool;
+
+// allocations not smaller than this are counted as large ones
+static const size_t kLargeSize = 4096;
+static uint64_t g_mallocs = 0;
+static uint64_t g_large_mallocs = 0;
+
+static void count_malloc(size_t size) {
+  g_mallocs++;
+  if (size >= kLargeSize) {
+    g_large_mallocs++;
+  }
+}
+
+#ifdef __GLIBC__
+// count allocations of this process by wrapping the ones in glibc
+extern "C" {
+void *__libc_malloc(size_t size);
+void *__libc_memalign(size_t alignment, size_t size);
+
+void *malloc(size_t size) {
+  count_malloc(size);
+  return __libc_malloc(size);
+}
+
+int posix_memalign(void **ptr, size_t alignment, size_t size) {
+  count_malloc(size);
+  *ptr = __libc_memalign(alignment, size);
+  return *ptr ? 0 : ENOMEM;
+}
+}
+#endif
+
+static ops_conf_t make_ops_conf(int size) {
+  ops_conf_t ops(6);
+  ops[0]["op_name"] = "decode";
+  ops[0]["mode"] = "1";
+  ops[1]["op_name"] = "resize";
+  ops[1]["short_size"] = formatString("%d", size / 2);
+  ops[2]["op_name"] = "random_crop";
+  ops[2]["final_size"] = formatString("%d,%d", size / 4, size / 4);
+  ops[2]["scale"] = "0.08,1.0";
+  ops[2]["ratio"] = "0.75,1.3333";
+  ops[3]["op_name"] = "flip";
+  ops[3]["flip_code"] = "1";
+  ops[3]["random"] = "1";
+  ops[4]["op_name"] = "distort_color";
+  ops[4]["brightness"] = "0.6,1.4";
+  ops[4]["contrast"] = "0.6,1.4";
+  ops[5]["op_name"] = "tochw";
+  ops[5]["value"] = "1";
+  return ops;
+}
+
+int main(int argc, char *argv[]) {
+  int iters = argc > 1 ? atoi(argv[1]) : 10000;
+  int size = argc > 2 ? atoi(argv[2]) : 16;
+
+  cv::Mat img(size, size, CV_8UC3);
+  cv::randu(img, cv::Scalar::all(0), cv::Scalar::all(255));
+  std::vector<uchar> buf;
+  cv::imencode(".png", img, buf);
+
+  transformer_input_data_t input;
+  input.data.assign(buf.begin(), buf.end());
+  ops_conf_t ops = make_ops_conf(size);
+
+  // what was paid for each image before ops are compiled in 'init'
+  int64_t start_ts = now_usec();
+  for (int i = 0; i < iters; i++) {
+    ImageProcess p;
+    if (p.init(ops)) {
+      std::cerr << "failed to init ImageProcess" << std::endl;
+      return 1;
+    }
+  }
+  double parse_us = static_cast<double>(now_usec() - start_ts) / iters;
+
+  std::cout << "ops:" << ops.size() << " image:" << size << "x" << size
+            << " iters:" << iters << std::endl;
+  std::cout << "parse ops_conf: " << parse_us
+            << " us/image (paid once in init)" << std::endl;
+
+  for (int use_arena = 0; use_arena < 2; use_arena++) {
+    ImageProcess proc;
+    proc.init(ops);
+    proc.set_arena(use_arena);
+    transformer_output_data_t output;
+    proc.process(input, output);  // warm up
+
+    MatArena::thread_arena()->reset_stats();
+    g_mallocs = 0;
+    g_large_mallocs = 0;
+    start_ts = now_usec();
+    for (int i = 0; i < iters; i++) {
+      input.seed = i;
+      output.shape.clear();
+      proc.process(input, output);
+      if (output.err_no) {
+        std::cerr << "failed to process with err_no:" << output.err_no
+                  << std::endl;
+        return 1;
+      }
+    }
+    double process_us = static_cast<double>(now_usec() - start_ts) / iters;
+    double mallocs = static_cast<double>(g_mallocs) / iters;
+    double large_mallocs = static_cast<double>(g_large_mallocs) / iters;
+
+    const arena_stats_t &st = MatArena::thread_arena()->stats();
+    std::cout << "process" << (use_arena ? " with" : " without")
+              << " arena: " << process_us << " us/image, mallocs:" << mallocs
+              << "/image, large mallocs:" << large_mallocs
+              << "/image, arena allocs:" << st.allocs
+              << " reused:" << st.reused << " mallocs:" << st.mallocs
+              << std::endl;
+  }
+  return 0;
+}
@@ -0,0 +1,115 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+/**
+ * function:
+ *  contention benchmark for 'ThreadPool' and output queues, a producer
+ *  appends tiny tasks whose results are put to an output queue by workers
+ *  and got by the main thread just like 'ImageTransformer', tasks/sec are
+ *  reported for each num of threads with a single 'BlockingQueue' or a
+ *  'ShardedQueue' as output, build it with:
+ *    g++ -O2 -std=c++11 -pthread -I. -Iinclude \
+ *        benchmark/bench_threadpool.cpp src/concurrent.cpp src/affinity.cpp \
+ *        src/util.cpp -o bench_threadpool
+ *  and run it as './bench_threadpool [tasks] [work] [max_threads]'
+ **/
+
+#include <cstdlib>
+#include <iostream>
+#include <string>
+#include <thread>
+#include "include/concurrent.h"
+#include "include/util.h"
+
+using namespace vistool;
+
+inline void put_output(BlockingQueue<void *> *output, void *ele) {
+  output->put(ele);
+}
+
+inline void put_output(ShardedQueue<void *> *output, void *ele) {
+  output->put(ele, ThreadPool::worker_index());
+}
+
+template <typename Q>
+class EchoTask : public ITask {
+public:
+  EchoTask(Q *output, intptr_t id, int work)
+      : _output(output), _id(id), _work(work) {}
+
+  void execute() {
+    // some cpu work to simulate a tiny op
+    volatile uint64_t sum = 0;
+    for (int i = 0; i < _work; i++) {
+      sum += i * _id;
+    }
+    put_output(_output, reinterpret_cast<void *>(_id + 1));
+    delete this;
+  }
+
+private:
+  Q *_output;
+  intptr_t _id;
+  int _work;
+};
+
+/**
+ * @brief tasks/sec of processing 'tasks' by 'threads' workers
+ */
+template <typename Q>
+double bench(Q *output, int threads, int tasks, int work) {
+  ThreadPool pool(threads, 1000);
+  pool.start();
+
+  int64_t start_ts = now_usec();
+  std::thread producer([&]() {
+    for (int i = 0; i < tasks; i++) {
+      pool.append_task(new EchoTask<Q>(output, i, work));
+    }
+  });
+
+  for (int i = 0; i < tasks; i++) {
+    if (output->get(1000) == NULL) {
+      std::cerr << "timeout to get output" << std::endl;
+    }
+  }
+  double cost = static_cast<double>(now_usec() - start_ts) / 1000000;
+
+  producer.join();
+  pool.notify_exit();
+  pool.join();
+  return tasks / cost;
+}
+
+int main(int argc, char *argv[]) {
+  int tasks = argc > 1 ? atoi(argv[1]) : 200000;
+  int work = argc > 2 ? atoi(argv[2]) : 100;
+  int max_threads = argc > 3 ? atoi(argv[3]) : 32;
+
+  std::cout << "tasks:" << tasks << " work:" << work
+            << " cpus:" << std::thread::hardware_concurrency() << std::endl;
+  std::cout << "threads\tblocking_queue\tsharded_queue (tasks/sec)"
+            << std::endl;
+  for (int threads = 1; threads <= max_threads; threads *= 2) {
+    BlockingQueue<void *> blocking(1000);
+    ShardedQueue<void *> sharded(1000, threads);
+    double blocking_speed = bench(&blocking, threads, tasks, work);
+    double sharded_speed = bench(&sharded, threads, tasks, work);
+    std::cout << threads << "\t" << blocking_speed << "\t" << sharded_speed
+              << std::endl;
+  }
+  return 0;
+}
@@ -0,0 +1,73 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+/**
+ * function:
+ *  plan which cpus each worker thread runs on and bind threads to them,
+ *  only supported on linux and ignored on other platforms
+ **/
+
+#pragma once
+
+#include <string>
+#include <vector>
+
+namespace vistool {
+
+typedef std::vector<int> cpu_list_t;
+
+/**
+ * @brief parse a list of cpus like '0-3,8,10-11'
+ *
+ * Return 0 if succeed, otherwise -1
+ */
+int parse_cpu_list(const std::string &s, cpu_list_t *cpus);
+
+/**
+ * @brief cpus this process is allowed to run on, eg: limited by 'taskset'
+ */
+cpu_list_t allowed_cpus();
+
+/**
+ * @brief cpus of each numa node, or only one node with all cpus if unknown
+ */
+std::vector<cpu_list_t> numa_nodes();
+
+/**
+ * @brief plan cpus for each of 'worker_num' workers, no cpus planned
+ *        means no binding
+ *
+ * Args:
+ *  @affinity: empty for no binding, 'spread' for binding workers to
+ *             numa nodes in turn, or a list of cpus like '0-3,8' which
+ *             workers are pinned to one by one in turn
+ *  @exclude: a list of cpus never used by workers, eg: cpus of a trainer
+ *
+ * Return 0 if succeed, otherwise -1 for invalid params or no cpus left
+ */
+int plan_cpu_affinity(const std::string &affinity,
+                      const std::string &exclude,
+                      int worker_num,
+                      std::vector<cpu_list_t> *cpusets);
+
+/**
+ * @brief bind current thread to 'cpus'
+ *
+ * Return 0 if succeed, otherwise -1
+ */
+int bind_current_thread(const cpu_list_t &cpus);
+
+};  // namespace vistool
@@ -15,9 +15,11 @@
  **/
 
 #pragma once
+#include <stdint.h>
 #include <map>
 #include <string>
 #include <vector>
+#include "op_stats.h"
 
 namespace vistool {
 
@@ -47,23 +49,39 @@ private:
 };
 
 struct transformer_input_data_t {
-  transformer_input_data_t() : id(0) {}
+  transformer_input_data_t() : id(0), seed(-1), ref(NULL), ref_len(0) {}
   ~transformer_input_data_t() {}
 
   transformer_input_data_t &operator=(const transformer_input_data_t &from) {
     this->id = from.id;
+    this->seed = from.seed;
     this->data = from.data;
     this->label = from.label;
+    this->ref = from.ref;
+    this->ref_len = from.ref_len;
     return *this;
   }
 
+  /**
+   * @brief the encoded image, which is 'ref' if not NULL, otherwise 'data'
+   */
+  const char *image() const { return ref ? ref : data.data(); }
+
+  size_t image_size() const { return ref ? ref_len : data.size(); }
+
   unsigned int id;
+  int64_t seed;  // seed for random ops on this sample, < 0 means not seeded
   std::string data;
   std::string label;
+
+  // memory of an image not copied, which is kept alive by the caller
+  const char *ref;
+  size_t ref_len;
 };
 
 struct transformer_output_data_t {
-  transformer_output_data_t() : id(0), err_no(0) {}
+  transformer_output_data_t()
+      : id(0), err_no(0), dtype("uint8"), dst(NULL), dst_size(0) {}
   ~transformer_output_data_t() {}
 
   transformer_output_data_t &operator=(const transformer_output_data_t &from) {
@@ -71,26 +89,48 @@ struct transformer_output_data_t {
     this->err_no = from.err_no;
     this->err_msg = from.err_msg;
     this->shape = from.shape;
+    this->dtype = from.dtype;
     this->label = from.label;
     this->data = from.data;
+    this->dst = from.dst;
+    this->dst_size = from.dst_size;
     return *this;
   }
 
+  /**
+   * @brief get a buffer to write a result of 'size' bytes, which is 'dst'
+   *        if its size matches, otherwise 'data' is resized for it
+   */
+  char *alloc(size_t size) {
+    if (dst != NULL && dst_size == size) {
+      data.clear();
+      return dst;
+    }
+    data.resize(size);
+    return &data[0];
+  }
+
   unsigned int id;
   int err_no;
   std::string err_msg;
   std::vector<int> shape;
+  std::string dtype;  // type of elements in 'data', eg: uint8 or float32
   std::string label;
   std::string data;
+
+  // buffer provided by the caller to write the result, eg: a slot in a batch
+  // array, 'data' is left empty if the result is written to it
+  char *dst;
+  size_t dst_size;
 };
 
 enum TRANSFORMER_ERR_CODE_TYPE {
   TRANS_ERR_OK = 0,
-  TRANS_ERR_NO_OUTPUT = 1,
   TRANS_ERR_LOGICERROR_EXCEPTION = 1,
   TRANS_ERR_LUA_EXCEPTION = 2,
   TRANS_ERR_LUA_KAGUYA_EXCEPTION = 3,
   TRANS_ERR_LUA_INVALID_OUTPUT = 4,
+  TRANS_ERR_NO_OUTPUT = 5,
   TRANS_ERR_STOPPED = 1000,
   TRANS_ERR_INVALID_OP_NAME = 1001,
   TRANS_ERR_RESIZE_NO_INPUT = 1002,
@@ -102,6 +142,8 @@ enum TRANSFORMER_ERR_CODE_TYPE {
   TRANS_ERR_ROTATE_INVALID_PARAM = 1008,
   TRANS_ERR_RAND_CROP_INVALID_PARAM = 1009,
   TRANS_ERR_FLIP_INVALID_PARAM = 1010,
+  TRANS_ERR_NORMALIZE_INVALID_PARAM = 1011,
+  TRANS_ERR_COLOR_INVALID_PARAM = 1012,
 };
 
 class IProcessor {
@@ -120,6 +162,18 @@ public:
 
   virtual int process(const transformer_input_data_t &input,
                       transformer_output_data_t &output) = 0;
+
+  /**
+   * @brief timing stats of ops applied by this processor
+   */
+  virtual void get_stats(std::vector<op_stat_t> *stats) const {
+    _stats.snapshot(stats);
+  }
+
+  virtual void reset_stats() { _stats.reset(); }
+
+protected:
+  OpStats _stats;
 };
 
 };  // namespace vistool
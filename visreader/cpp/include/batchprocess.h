@@ -0,0 +1,56 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+/**
+ * function:
+ *  process a batch of samples with an 'IProcessor' on a pool of threads,
+ *  which is used for inline preprocessing without 'ImageTransformer'
+ **/
+
+#pragma once
+
+#include <vector>
+#include "baseprocess.h"
+#include "concurrent.h"
+
+namespace vistool {
+
+class BatchProcessor {
+public:
+  /**
+   * @brief create a pool of 'thread_num' threads to run 'p',
+   *        which is not owned by this object
+   */
+  BatchProcessor(IProcessor *p, int thread_num);
+  virtual ~BatchProcessor();
+
+  /**
+   * @brief process 'inputs' concurrently and wait for all of them finished,
+   *        'outputs' should have the same size as 'inputs', and errors of
+   *        each sample are set in its output
+   */
+  int process(const std::vector<transformer_input_data_t> &inputs,
+              std::vector<transformer_output_data_t> *outputs);
+
+  int thread_num() const { return _thread_num; }
+
+private:
+  IProcessor *_processor;
+  int _thread_num;
+  ThreadPool _workers;
+};
+
+};  // namespace vistool
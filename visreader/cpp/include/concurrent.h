@@ -23,18 +23,22 @@
 
 #include <stdarg.h>
 #include <stdint.h>
+#include <algorithm>
+#include <atomic>
 #include <chrono>
 #include <condition_variable>
 #include <deque>
 #include <mutex>
 #include <thread>
 #include <vector>
+#include "include/affinity.h"
 
 namespace vistool {
 
 /**
  * @brief a thread-safe blocking queue which implements producer-consumer
- * pattern
+ * pattern, consumers and producers wait on different conditions and only
+ * one of them is waked up for each element put or got
  */
 template <typename T>
 class BlockingQueue {
@@ -42,7 +46,11 @@ public:
   explicit BlockingQueue(int queue_len = 100) : _queue_limit(queue_len) {}
 
   int set_queue_limit(int queue_len) {
-    this->_queue_limit = queue_len;
+    {
+      std::lock_guard<std::mutex> lock(_mutex);
+      this->_queue_limit = queue_len;
+    }
+    _not_full.notify_all();
     return 0;
   }
 
@@ -64,12 +72,12 @@ public:
     std::unique_lock<std::mutex> lock(_mutex);
     bool cond_meet = false;
     if (!wait_ms) {
-      _cond.wait(lock, [this]() { return !is_empty(); });
+      _not_empty.wait(lock, [this]() { return !is_empty(); });
       cond_meet = true;
     } else {
-      if (_cond.wait_for(lock, std::chrono::milliseconds(wait_ms), [this]() {
-            return !is_empty();
-          })) {
+      if (_not_empty.wait_for(lock,
+                              std::chrono::milliseconds(wait_ms),
+                              [this]() { return !is_empty(); })) {
         cond_meet = true;
       } else {
         cond_meet = false;
@@ -83,7 +91,9 @@ public:
     }
 
     lock.unlock();
-    _cond.notify_all();
+    if (cond_meet) {
+      _not_full.notify_one();
+    }
     return ele;
   }
 
@@ -94,37 +104,225 @@ public:
   void get(T *res) {
     std::unique_lock<std::mutex> lock(_mutex);
 
-    _cond.wait(lock, [this]() { return !is_empty(); });
+    _not_empty.wait(lock, [this]() { return !is_empty(); });
     *res = _queue.front();
     _queue.pop_front();
 
     lock.unlock();
-    _cond.notify_all();
+    _not_full.notify_one();
     return;
   }
 
+  /**
+   * @brief get an element without blocking
+   *
+   * Return false if this queue is empty
+   */
+  bool try_get(T *res) {
+    std::unique_lock<std::mutex> lock(_mutex);
+    if (is_empty()) {
+      return false;
+    }
+    *res = _queue.front();
+    _queue.pop_front();
+
+    lock.unlock();
+    _not_full.notify_one();
+    return true;
+  }
+
   /**
    * @brief put an element to this queue
    */
   void put(const T &ele) {
     std::unique_lock<std::mutex> lock(_mutex);
 
-    _cond.wait(lock, [this]() { return !is_full(); });
+    _not_full.wait(lock, [this]() { return !is_full(); });
     _queue.push_back(ele);
 
     lock.unlock();
-    _cond.notify_all();
+    _not_empty.notify_one();
   }
 
   ~BlockingQueue() {}
 
 private:
   std::mutex _mutex;
-  std::condition_variable _cond;
+  std::condition_variable _not_empty;
+  std::condition_variable _not_full;
   std::deque<T> _queue;
   int _queue_limit;
 };
 
+/**
+ * @brief a blocking queue made of shards, each producer puts elements to
+ *        the shard of its own index so producers seldom contend on one lock,
+ *        and consumers get elements from the shards in turn
+ */
+template <typename T>
+class ShardedQueue {
+public:
+  explicit ShardedQueue(int queue_len = 100, int shard_num = 1)
+      : _queue_limit(queue_len),
+        _ready(0),
+        _waiting(0),
+        _next(0),
+        _put_next(0),
+        _closed(false) {
+    set_shard_num(shard_num);
+  }
+
+  ~ShardedQueue() {
+    for (size_t i = 0; i < _shards.size(); i++) {
+      delete _shards[i];
+    }
+    _shards.clear();
+  }
+
+  /**
+   * @brief set the number of shards, which should be called before used
+   */
+  int set_shard_num(int shard_num) {
+    if (shard_num <= 0 || _ready != 0) {
+      return -1;
+    }
+    for (size_t i = 0; i < _shards.size(); i++) {
+      delete _shards[i];
+    }
+    _shards.clear();
+    for (int i = 0; i < shard_num; i++) {
+      _shards.push_back(new shard_t());
+    }
+    return set_queue_limit(_queue_limit);
+  }
+
+  /**
+   * @brief limit the total length, which is divided among shards
+   */
+  int set_queue_limit(int queue_len) {
+    _queue_limit = queue_len;
+    int n = _shards.size();
+    for (int i = 0; i < n; i++) {
+      _shards[i]->queue.set_queue_limit(std::max((queue_len + n - 1) / n, 1));
+    }
+    return 0;
+  }
+
+  inline bool is_empty() { return _ready <= 0; }
+
+  inline int length() const { return std::max(_ready.load(), 0); }
+
+  inline int capacity() const { return _queue_limit; }
+
+  inline int shard_num() const { return _shards.size(); }
+
+  inline bool is_closed() const { return _closed; }
+
+  /**
+   * @brief mark that no more elements will be put, and wake up consumers
+   *        waiting for them after all elements are got
+   */
+  void close() {
+    _closed = true;
+    std::lock_guard<std::mutex> lock(_mutex);
+    _cond.notify_all();
+  }
+
+  /**
+   * @brief put an element to the shard of producer 'index', such as
+   *        the index of a worker in 'ThreadPool', or to the shards
+   *        in turn if 'index' is negative
+   */
+  void put(const T &ele, int index = -1) {
+    unsigned int i = index >= 0 ? index : _put_next++;
+    shard_t *shard = _shards[i % _shards.size()];
+    shard->queue.put(ele);
+    shard->size++;
+    _ready++;
+    if (_waiting > 0) {
+      std::lock_guard<std::mutex> lock(_mutex);
+      _cond.notify_one();
+    }
+  }
+
+  /**
+   * @brief get an element without blocking
+   *
+   * Return false if all shards are empty
+   */
+  bool try_get(T *res) {
+    if (_ready <= 0) {
+      return false;
+    }
+
+    unsigned int n = _shards.size();
+    unsigned int start = _next;
+    for (unsigned int i = 0; i < n; i++) {
+      shard_t *shard = _shards[(start + i) % n];
+      if (shard->size > 0 && shard->queue.try_get(res)) {
+        shard->size--;
+        _next = start + i + 1;
+        _ready--;
+        return true;
+      }
+    }
+    return false;
+  }
+
+  /**
+   * @brief get an element from this queue, which will be timed out
+   *        if 'wait_ms' is greater than 0
+   *
+   * Return the element if succeed, otherwise NULL which also means
+   * all elements have been got if closed
+   */
+  T get(uint32_t wait_ms = 0) {
+    std::chrono::steady_clock::time_point deadline =
+        std::chrono::steady_clock::now() + std::chrono::milliseconds(wait_ms);
+    T ele = NULL;
+    while (!try_get(&ele)) {
+      if (_closed && _ready <= 0) {
+        return NULL;
+      }
+
+      std::unique_lock<std::mutex> lock(_mutex);
+      _waiting++;
+      bool ready = true;
+      if (!wait_ms) {
+        _cond.wait(lock, [this]() { return _ready > 0 || _closed; });
+      } else {
+        ready = _cond.wait_until(
+            lock, deadline, [this]() { return _ready > 0 || _closed; });
+      }
+      _waiting--;
+      if (!ready) {
+        return NULL;
+      }
+    }
+    return ele;
+  }
+
+private:
+  struct shard_t {
+    shard_t() : size(0) {}
+
+    BlockingQueue<T> queue;
+    std::atomic<int> size;  // to skip empty shards without locking
+  };
+
+  std::vector<shard_t *> _shards;
+  int _queue_limit;
+
+  // elements put but not got, and consumers waiting for them
+  std::atomic<int> _ready;
+  std::atomic<int> _waiting;
+  std::atomic<unsigned int> _next;      // shard to get from first
+  std::atomic<unsigned int> _put_next;  // shard to put to without index
+  std::atomic<bool> _closed;
+  std::mutex _mutex;
+  std::condition_variable _cond;
+};
+
 typedef void (*task_cb_t)(void *arg);
 
 /**
@@ -163,43 +361,45 @@ private:
 
 /**
  * @brief a class used to concurrently process multiple tasks,
- *        it contains one input-queue and mutiple workers which run in function
- * 'this->run'
+ *        each worker running in function 'this->run' has its own task queue
+ *        fed in turn by 'append_task', and steals tasks from others when
+ *        its queue is empty, only one sleeping worker is waked up for a task
  */
 class ThreadPool {
 public:
-  explicit ThreadPool(int worker_num = 1, int queue_limit = 1000)
-      : _worker_num(worker_num),
-        _exit_mark(false),
-        _task_queue(queue_limit),
-        _threads_info(0) {}
-
-  virtual ~ThreadPool() {
-    while (!_task_queue.is_empty()) {
-      ITask *t = _task_queue.get(1);
-      if (t) {
-        t->execute();
-      }
-    }
-  }
+  explicit ThreadPool(int worker_num = 1, int queue_limit = 1000);
+
+  virtual ~ThreadPool();
 
   virtual int init(int workers = 1) {
-    _worker_num = workers;
+    set_worker_num(workers);
     return 0;
   }
 
-  void set_worker_num(int num) { _worker_num = num; }
+  /**
+   * @brief set the number of workers, which should be called before 'start'
+   */
+  void set_worker_num(int num);
+
+  /**
+   * @brief limit the number of tasks waiting in this pool
+   */
+  void set_queue_limit(int limit);
 
-  void set_queue_limit(int limit) { _task_queue.set_queue_limit(limit); }
+  /**
+   * @brief bind worker 'i' to cpus in 'cpusets[i]' when it starts,
+   *        which should be called before 'start'
+   */
+  void set_cpu_affinity(const std::vector<cpu_list_t> &cpusets);
 
-  virtual std::thread *_start() {
-    std::thread *t = new std::thread(thread_routine, static_cast<void *>(this));
+  virtual std::thread *_start(int index) {
+    std::thread *t = new std::thread(thread_routine, this, index);
     return t;
   }
 
   virtual int start() {
     for (int i = 0; i < _worker_num; i++) {
-      std::thread *t = _start();
+      std::thread *t = _start(i);
       if (t) {
         _threads_info.push_back(t);
       } else {
@@ -209,57 +409,102 @@ public:
     return 0;
   }
 
-  int append_task(ITask *task) {
-    if (!_exit_mark) {
-      _task_queue.put(task);
-      return 0;
-    } else {
-      return -1;
-    }
-  }
+  int append_task(ITask *task);
+
+  /**
+   * @brief append 'tasks' in bulk, which blocks until there is room
+   *        for all of them, or until the pool is empty if 'tasks' is
+   *        larger than the limit of queue
+   */
+  int append_tasks(const std::vector<ITask *> &tasks);
 
   int append_and_wait(ITask *task) {
-    if (!_exit_mark) {
-      _task_queue.put(task);
+    int ret = append_task(task);
+    if (!ret) {
       task->wait();
-      return 0;
-    } else {
-      return -1;
     }
+    return ret;
   }
 
-  void notify_exit() { _exit_mark = true; }
+  void notify_exit();
 
-  virtual void join() {
-    for (size_t i = 0; i < _threads_info.size(); i++) {
-      _threads_info[i]->join();
-      delete _threads_info[i];
-    }
-    _threads_info.clear();
-    while (!_task_queue.is_empty()) {
-      ITask *t = _task_queue.get(100);
-      if (t) {
-        delete t;
-      }
-    }
-  }
+  virtual void join();
+
+  /**
+   * @brief number of tasks waiting in this pool
+   */
+  int pending() const { return _pending; }
+
+  /**
+   * @brief index of the worker running current thread in its pool,
+   *        or -1 if current thread is not a worker
+   */
+  static int worker_index() { return s_worker_index; }
 
 protected:
-  static void *thread_routine(void *args) {
-    ThreadPool *pthr = static_cast<ThreadPool *>(args);
-    pthr->run();
-    return NULL;
+  static void thread_routine(ThreadPool *pool, int index) {
+    s_worker_index = index;
+    pool->bind_cpus(index);
+    pool->run(index);
   }
 
-  virtual void run();
+  /**
+   * @brief bind current thread to the cpus planned for worker 'index'
+   */
+  void bind_cpus(int index);
+
+  /**
+   * @brief wait until there is room for 'n' more pending tasks,
+   *        return false if this pool is exiting
+   */
+  bool wait_not_full(int n = 1);
+
+  virtual void run(int index);
+
+  /**
+   * @brief get a task for worker 'index', which will be timed out
+   *        if 'wait_ms' is greater than 0
+   */
+  ITask *fetch_task(int index, uint32_t wait_ms = 0);
+
+  /**
+   * @brief pop a task from the queue of worker 'index' or steal one
+   *        from others without blocking
+   */
+  ITask *pop_task(int index);
 
-  ITask *fetch_task(uint32_t wait_ms = 0) { return _task_queue.get(wait_ms); }
+  /**
+   * @brief pop all tasks left in this pool
+   */
+  void pop_all(std::vector<ITask *> *tasks);
 
 protected:
+  struct task_queue_t {
+    task_queue_t() : size(0) {}
+
+    std::mutex mutex;
+    std::deque<ITask *> tasks;
+    std::atomic<int> size;  // to skip empty queues without locking
+  };
+
   int _worker_num;
   volatile bool _exit_mark;
-  BlockingQueue<ITask *> _task_queue;
+  std::vector<task_queue_t *> _queues;
   std::vector<std::thread *> _threads_info;
+  std::vector<cpu_list_t> _cpusets;
+
+  std::atomic<int> _queue_limit;
+  std::atomic<int> _pending;   // tasks appended but not fetched
+  std::atomic<int> _sleeping;  // workers waiting for tasks
+  std::atomic<int> _blocked;   // producers waiting for free space
+  std::atomic<unsigned int> _next;  // queue to put the next task
+
+  // guards waiting on the conditions below
+  std::mutex _mutex;
+  std::condition_variable _not_empty;
+  std::condition_variable _not_full;
+
+  static thread_local int s_worker_index;
 };
 
 };  // namespace vistool
@@ -74,13 +74,62 @@ public:
                   const char *image,
                   int img_len,
                   const char *label = "",
-                  int label_len = 0);
+                  int label_len = 0,
+                  int64_t seed = -1);
+
+  /**
+   * @brief put a new request without copying 'image', which should
+   *        be kept alive until its result is got
+   */
+  virtual int put_ref(int id,
+                      const char *image,
+                      size_t img_len,
+                      const char *label = "",
+                      int label_len = 0,
+                      int64_t seed = -1);
+
+  /**
+   * @brief put new requests in bulk, which are appended to the
+   *        workers with a single wait for free room
+   */
+  virtual int put_many(const std::vector<transformer_input_data_t> &inputs);
 
   /**
    * @brief get a transformed result
    */
   virtual int get(transformer_output_data_t *output);
 
+  /**
+   * @brief get a transformed result without copying it,
+   *        '*output' should be released to 'pool()' after use
+   */
+  virtual int get(transformer_output_data_t **output);
+
+  /**
+   * @brief get a transformed result without blocking, return
+   *        TRANS_GET_NOT_READY if none is ready for now
+   */
+  virtual int try_get(transformer_output_data_t **output);
+
+  /**
+   * @brief get at most 'num' transformed results, which blocks
+   *        until one is ready and then takes others ready without blocking
+   */
+  virtual int get_many(int num,
+                       std::vector<transformer_output_data_t *> *outputs);
+
+  /**
+   * @brief timing stats of ops collected by the processor
+   */
+  virtual void get_stats(std::vector<op_stat_t> *stats);
+
+  virtual void reset_stats();
+
+  /**
+   * @brief pool of outputs shared with the consumers of results
+   */
+  virtual output_pool_ptr_t pool() { return _pool; }
+
   /**
    * @brief apply image ops defined in 'this->_ops' to this 'input'
    */
@@ -96,14 +145,25 @@ public:
 private:
   int _put_task(ITask *t);
 
+  int _put_tasks(const std::vector<ITask *> &tasks);
+
+  /**
+   * @brief close the output queue if stopped and all inputs are processed,
+   *        so consumers waiting for results return at once
+   */
+  void _check_finished();
+
 private:
   IProcessor *_imgprocess;
   int _id;
   std::atomic<std::uint64_t> _in_num;
   std::atomic<std::uint64_t> _out_num;
+  std::atomic<std::uint64_t> _done_num;  // num of processed inputs
+  std::atomic<bool> _stopped;
   std::string _state;
   ThreadPool _workers;
-  BlockingQueue<transformer_output_data_t *> _output_queue;
+  ShardedQueue<transformer_output_data_t *> _output_queue;
+  output_pool_ptr_t _pool;
 };
 
 };  // namespace vistool
@@ -43,10 +43,32 @@ std::string encodeImage(const std::string &format,
 
 cv::Mat decodeImage(const cv::Mat &buf, int mode);
 
+/*
+ * get width and height of a jpeg image from its header,
+ * return false if 'buf' is not a valid jpeg
+ */
+bool jpegSize(const char *buf, size_t bufsize, int *width, int *height);
+
+/*
+ * decode an image, and jpeg images will be decoded with a reduced size
+ * which is not smaller than 'min_size' and 'min_short'(short edge)
+ */
 IMPROC_ERR_CODE_TYPE decode(const char *buf,
                             size_t bufsize,
                             cv::Mat *result,
-                            int mode = cv::IMREAD_UNCHANGED);
+                            int mode = cv::IMREAD_UNCHANGED,
+                            const cv::Size &min_size = cv::Size(0, 0),
+                            int min_short = 0);
+
+/*
+ * decode area 'rect' of an image, and for jpeg images, rows and MCU columns
+ * out of 'rect' will be skipped without decoding when turbojpeg enabled
+ */
+IMPROC_ERR_CODE_TYPE decodeCrop(const char *buf,
+                                size_t bufsize,
+                                const cv::Rect &rect,
+                                cv::Mat *result,
+                                int mode = cv::IMREAD_UNCHANGED);
 
 IMPROC_ERR_CODE_TYPE resize(const cv::Mat &img,
                             const cv::Size &size,
@@ -66,9 +88,58 @@ IMPROC_ERR_CODE_TYPE rotate(const cv::Mat &img,
 
 IMPROC_ERR_CODE_TYPE flip(const cv::Mat &img, int flip_code, cv::Mat *result);
 
+/*
+ * adjust brightness, contrast and saturation of a RGB image like
+ * PIL.ImageEnhance, 'factor' 1.0 keeps the original image, and 0.0 gives
+ * a black, solid gray and gray image respectively
+ */
+IMPROC_ERR_CODE_TYPE adjustBrightness(const cv::Mat &img,
+                                      float factor,
+                                      cv::Mat *result);
+
+IMPROC_ERR_CODE_TYPE adjustContrast(const cv::Mat &img,
+                                    float factor,
+                                    cv::Mat *result);
+
+IMPROC_ERR_CODE_TYPE adjustSaturation(const cv::Mat &img,
+                                      float factor,
+                                      cv::Mat *result);
+
+/*
+ * rotate the hue of a RGB image by 'delta' turns, eg: 0.5 for 180 degrees
+ */
+IMPROC_ERR_CODE_TYPE adjustHue(const cv::Mat &img,
+                               float delta,
+                               cv::Mat *result);
+
+/*
+ * normalize an image to float32 with 'dst[c] = src[c] * alpha[c] + beta[c]'
+ */
+IMPROC_ERR_CODE_TYPE normalize(const cv::Mat &img,
+                               const std::vector<float> &alpha,
+                               const std::vector<float> &beta,
+                               cv::Mat *result);
+
 std::string mat2str(const cv::Mat &mat);
 
 cv::Mat str2mat(const std::string &str);
 
 int tochw(const cv::Mat &mat, std::string *outstr);
+
+/*
+ * transpose an image in HWC to CHW and write it to 'dst',
+ * which should have 'mat.total() * mat.elemSize()' bytes
+ */
+int tochw(const cv::Mat &mat, void *dst);
+
+/*
+ * convert an uint8 image in HWC to float32 or float16 in CHW
+ * with 'dst[c] = src[c] * alpha[c] + beta[c]' in a single pass,
+ * 'dst' should have room for 'mat.total() * mat.channels()' elements
+ */
+int normalizeToCHW(const cv::Mat &mat,
+                   const std::vector<float> &alpha,
+                   const std::vector<float> &beta,
+                   bool to_half,
+                   void *dst);
 };  // namespace vistool
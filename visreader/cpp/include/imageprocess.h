@@ -1,39 +1,146 @@
-/**
- * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
- *
- * Licensed under the Apache License, Version 2.0 (the "License");
- * you may not use this file except in compliance with the License.
- * You may obtain a copy of the License at
- *
- * http://www.apache.org/licenses/LICENSE-2.0
- *
- * Unless required by applicable law or agreed to in writing, software
- * distributed under the License is distributed on an "AS IS" BASIS,
- * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
- * See the License for the specific language governing permissions and
- * limitations under the License.
- **/
-
-#pragma once
-#include "baseprocess.h"
-namespace vistool {
-
-class ImageProcess : public IProcessor {
-public:
-  ImageProcess() : IProcessor(), _swapaxis(0) {}
-  virtual ~ImageProcess() {}
-
-  virtual int init(const ops_conf_t &ops);
-
-  virtual int process(const transformer_input_data_t &input,
-                      transformer_output_data_t &output);
-
-private:
-  int add_op(const std::string &op_name, const kv_conf_t &conf);
-
-private:
-  std::vector<kv_conf_t> _ops;
-  int _swapaxis;
-};
-
-};  // namespace vistool
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+#pragma once
+#include <memory>
+#include <string>
+#include <vector>
+#include "baseprocess.h"
+#include "opencv2/opencv.hpp"
+#include "util.h"
+namespace vistool {
+
+struct image_op_t;
+class LuaStateMgr;
+
+// apply an operator on encoded image 'data'
+typedef int decode_func_t(const image_op_t &op,
+                          const char *data,
+                          size_t len,
+                          cv::Mat *result,
+                          std::string *errmsg,
+                          BufLogger *logger);
+
+// apply an operator on a decoded image
+typedef int process_func_t(const image_op_t &op,
+                           const cv::Mat &input,
+                           cv::Mat *result,
+                           std::string *errmsg,
+                           BufLogger *logger);
+
+/**
+ * @brief an operator compiled from its conf in 'ImageProcess::init',
+ *        so images are processed without parsing any string
+ */
+struct image_op_t {
+  image_op_t()
+      : decode(NULL),
+        process(NULL),
+        mode(cv::IMREAD_UNCHANGED),
+        min_short(0),
+        interpolation(cv::INTER_LINEAR),
+        short_size(0),
+        crop_center(-1),
+        angle(0),
+        random_range(-1),
+        random(0),
+        flip_code(0) {}
+
+  std::string name;
+  decode_func_t *decode;    // set for ops on encoded images
+  process_func_t *process;  // set for ops on decoded images
+
+  // decode and decode_random_crop
+  int mode;
+  cv::Size min_size;
+  int min_short;
+
+  // interpolation of resize, random_crop and rotate
+  int interpolation;
+
+  // resize to 'size', or keep the ratio if 'short_size' > 0
+  int short_size;
+  cv::Size size;
+
+  // crop at 'rect' if 'crop_center' < 0, otherwise crop a window
+  // in the size of 'rect' at the center or randomly
+  int crop_center;
+  cv::Rect rect;
+
+  // random_crop and decode_random_crop
+  std::vector<float> scale;
+  std::vector<float> ratio;
+  cv::Size final_size;
+
+  // rotate with a random angle in [-random_range, random_range],
+  // or 'angle' if 'random_range' < 0
+  int angle;
+  int random_range;
+
+  // flip
+  int random;
+  int flip_code;
+
+  // normalize
+  std::vector<float> alpha;
+  std::vector<float> beta;
+
+  // index of color jitters and their ranges
+  std::vector<int> jitters;
+  std::vector<std::vector<float> > ranges;
+
+  // lua states running the script of 'lua_op'
+  std::shared_ptr<LuaStateMgr> lua;
+};
+
+class ImageProcess : public IProcessor {
+public:
+  ImageProcess()
+      : IProcessor(),
+        _swapaxis(0),
+        _normalize(false),
+        _to_half(false),
+        _use_arena(true) {}
+  virtual ~ImageProcess() {}
+
+  virtual int init(const ops_conf_t &ops);
+
+  virtual int process(const transformer_input_data_t &input,
+                      transformer_output_data_t &output);
+
+  /**
+   * @brief whether to write results of ops to buffers in 'MatArena'
+   *        of current thread, enabled by default
+   */
+  void set_arena(bool enabled) { _use_arena = enabled; }
+
+private:
+  int add_op(const std::string &op_name, const kv_conf_t &conf);
+
+private:
+  std::vector<image_op_t> _ops;
+  int _swapaxis;
+
+  // convert the output to float in CHW with 'alpha * x + beta'
+  bool _normalize;
+  bool _to_half;
+  std::vector<float> _alpha;
+  std::vector<float> _beta;
+
+  bool _use_arena;
+};
+
+};  // namespace vistool
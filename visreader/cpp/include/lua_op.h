@@ -0,0 +1,56 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+/**
+ * function:
+ *  'lua_op' as an operator of 'ImageProcess', which calls 'lua_main' in
+ *  a lua script with the current image between other native operators,
+ *  only available when built with lua
+ **/
+
+#pragma once
+
+#include <string>
+#include "imageprocess.h"
+
+namespace vistool {
+
+/**
+ * @brief compile the script in 'lua_fname' or 'lua_code' and create
+ *        a pool of lua states with 'state_num' for 'op'
+ */
+int parse_lua_op(const KVConfHelper &conf, image_op_t *op);
+
+/**
+ * @brief call 'lua_main' with an encoded image, when 'lua_op' is the first
+ */
+int decode_lua_op(const image_op_t &op,
+                  const char *data,
+                  size_t len,
+                  cv::Mat *result,
+                  std::string *errmsg,
+                  BufLogger *logger);
+
+/**
+ * @brief call 'lua_main' with the image output by the previous op
+ */
+int process_lua_op(const image_op_t &op,
+                   const cv::Mat &input,
+                   cv::Mat *result,
+                   std::string *errmsg,
+                   BufLogger *logger);
+
+};  // namespace vistool
@@ -37,9 +37,14 @@ public:
   LuaStateMgr(){};
   virtual ~LuaStateMgr(){};
 
+  /*
+   * create a pool of lua states running 'lua_script' which is compiled
+   * only once, 'state_num' of 0 means creating one for each thread
+   * running lua concurrently
+   */
   static LuaStateMgr *create(const std::string &lua_script,
                              bool isfile,
-                             int state_num = 1);
+                             int state_num = 0);
 
   static void destroy(LuaStateMgr *mgr) { delete mgr; }
 
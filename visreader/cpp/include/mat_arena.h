@@ -0,0 +1,94 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+/**
+ * function:
+ *  a per-thread arena for the data of cv::Mat, results of ops are written
+ *  to two buffers in turn instead of being malloced for each image
+ **/
+
+#pragma once
+
+#include <stdint.h>
+#include "opencv2/opencv.hpp"
+
+namespace vistool {
+
+struct arena_stats_t {
+  arena_stats_t() : allocs(0), reused(0), mallocs(0) {}
+
+  uint64_t allocs;   // num of allocations requested
+  uint64_t reused;   // num of allocations served by existing buffers
+  uint64_t mallocs;  // num of buffers malloced for growing or overflow
+};
+
+/**
+ * @brief an allocator for cv::Mat with two buffers ping-ponged between the
+ *        input and output of ops, buffers grow to the largest size requested
+ *        recently and are shrinked if much larger than that for a while,
+ *        allocations are malloced as usual when both buffers are in use,
+ *        note that mats allocated by it should be freed in the same thread
+ */
+class MatArena : public cv::MatAllocator {
+public:
+  MatArena();
+  virtual ~MatArena();
+
+  /*
+   * arena of current thread
+   */
+  static MatArena *thread_arena();
+
+  virtual cv::UMatData *allocate(int dims,
+                                 const int *sizes,
+                                 int type,
+                                 void *data,
+                                 size_t *step,
+                                 int flags,
+                                 cv::UMatUsageFlags usage) const;
+
+  virtual bool allocate(cv::UMatData *data,
+                        int accessflags,
+                        cv::UMatUsageFlags usage) const;
+
+  virtual void deallocate(cv::UMatData *data) const;
+
+  const arena_stats_t &stats() const { return _stats; }
+
+  void reset_stats() { _stats = arena_stats_t(); }
+
+private:
+  struct slot_t {
+    slot_t() : data(NULL), capacity(0), used(false) {}
+
+    uchar *data;
+    size_t capacity;
+    bool used;
+  };
+
+  static const int kSlotNum = 2;
+
+  // num of allocations to find the largest recent size
+  static const int kWindow = 256;
+
+  mutable slot_t _slots[kSlotNum];
+  mutable arena_stats_t _stats;
+  mutable size_t _peak;  // largest size requested in current window
+  mutable size_t _recent_peak;  // largest size requested in last window
+  mutable int _count;  // num of allocations in current window
+};
+
+};  // namespace vistool
@@ -0,0 +1,93 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+/**
+ * function:
+ *  timing stats of ops applied by processors, which are updated by
+ *  worker threads concurrently without locking unless ops failed
+ **/
+
+#pragma once
+
+#include <stdint.h>
+#include <atomic>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <vector>
+
+namespace vistool {
+
+// num of buckets in latency histograms, the last one is [2^22us, +inf)
+static const int kStatBuckets = 24;
+
+/**
+ * @brief stats of an op, bucket 'i' of 'hist' counts calls costing
+ *        [2^(i-1), 2^i) us, and bucket 0 counts those under 1us
+ */
+struct op_stat_t {
+  op_stat_t() : count(0), total_us(0), max_us(0) {}
+
+  std::string name;
+  uint64_t count;
+  uint64_t total_us;
+  uint64_t max_us;
+  std::vector<uint64_t> hist;
+  std::map<int, uint64_t> errors;  // num of failures for each err_no
+};
+
+class OpStats {
+public:
+  OpStats() {}
+
+  /**
+   * @brief set names of ops to collect stats, which clears all stats
+   */
+  void init(const std::vector<std::string> &names);
+
+  /**
+   * @brief record a call of op 'index' which costs 'cost_us' and
+   *        fails if 'err_no' is not 0
+   */
+  void add(int index, int64_t cost_us, int err_no = 0);
+
+  void snapshot(std::vector<op_stat_t> *stats) const;
+
+  void reset();
+
+private:
+  struct counter_t {
+    counter_t() : count(0), total_us(0), max_us(0) {
+      for (int i = 0; i < kStatBuckets; i++) {
+        hist[i] = 0;
+      }
+    }
+
+    std::string name;
+    std::atomic<uint64_t> count;
+    std::atomic<uint64_t> total_us;
+    std::atomic<uint64_t> max_us;
+    std::atomic<uint64_t> hist[kStatBuckets];
+
+    std::mutex mutex;  // guards 'errors'
+    std::map<int, uint64_t> errors;
+  };
+
+  std::vector<std::unique_ptr<counter_t> > _counters;
+};
+
+};  // namespace vistool
@@ -16,11 +16,58 @@
 
 #pragma once
 #include <map>
+#include <memory>
+#include <mutex>
 #include <string>
 #include <vector>
 #include "baseprocess.h"
 namespace vistool {
 
+// return code of getting results from a transformer
+enum TRANSFORMER_GET_RET_TYPE {
+  TRANS_GET_OK = 0,
+  TRANS_GET_FINISHED = 1,   // stopped and all results have been got
+  TRANS_GET_NOT_READY = 2,  // no result is ready for now
+};
+
+/**
+ * @brief a pool of output data whose buffers are reused by later results,
+ *        outputs handed to python are released back to it when the arrays
+ *        wrapping them are freed, so it is shared by the transformer and them
+ */
+class OutputPool {
+public:
+  explicit OutputPool(size_t capacity = 1000) : _capacity(capacity) {}
+  ~OutputPool();
+
+  /*
+   * set max number of free outputs kept in this pool
+   */
+  void set_capacity(size_t capacity);
+
+  /*
+   * get a cleared output whose 'data' may keep memory of a released one
+   */
+  transformer_output_data_t *alloc();
+
+  /*
+   * give back an output got from 'alloc', it's deleted if this pool is full
+   */
+  void release(transformer_output_data_t *output);
+
+  /*
+   * number of free outputs in this pool
+   */
+  size_t size();
+
+private:
+  size_t _capacity;
+  std::mutex _mutex;
+  std::vector<transformer_output_data_t *> _free;
+};
+
+typedef std::shared_ptr<OutputPool> output_pool_ptr_t;
+
 /**
  * @brief base class to abstract the transformation on multiple type of data
  * sample,
@@ -81,6 +128,28 @@ public:
    */
   virtual int get(transformer_output_data_t *output) = 0;
 
+  /*
+   * get a transformed image without copying it, the caller owns '*output'
+   * and should give it back to 'pool()' after use
+   */
+  virtual int get(transformer_output_data_t **output) = 0;
+
+  /*
+   * get a transformed image like above without blocking
+   */
+  virtual int try_get(transformer_output_data_t **output) = 0;
+
+  /*
+   * get at most 'num' transformed images, which blocks until one is ready
+   */
+  virtual int get_many(int num,
+                       std::vector<transformer_output_data_t *> *outputs) = 0;
+
+  /*
+   * pool of outputs returned by the 'get' functions above
+   */
+  virtual output_pool_ptr_t pool() = 0;
+
   /*
    * put a new image processing task to this transformer
    */
@@ -88,7 +157,32 @@ public:
                   const char *image,
                   int image_len,
                   const char *label = "",
-                  int label_len = 0) = 0;
+                  int label_len = 0,
+                  int64_t seed = -1) = 0;
+
+  /*
+   * put a new image like above without copying it, the caller should
+   * keep 'image' alive until the result of this image is got
+   */
+  virtual int put_ref(int id,
+                      const char *image,
+                      size_t image_len,
+                      const char *label = "",
+                      int label_len = 0,
+                      int64_t seed = -1) = 0;
+
+  /*
+   * timing stats of ops applied by this transformer
+   */
+  virtual void get_stats(std::vector<op_stat_t> *stats) = 0;
+
+  virtual void reset_stats() = 0;
+
+  /*
+   * put new images in bulk, see 'put_ref' for those with 'ref' set
+   */
+  virtual int put_many(
+      const std::vector<transformer_input_data_t> &inputs) = 0;
 };
 
 };  // namespace vistool
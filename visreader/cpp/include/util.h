@@ -21,6 +21,12 @@
 
 namespace vistool {
 
+/*
+ * seed the random generator of current thread which is used by
+ * 'randInt' and 'randFloat', each thread has its own generator
+ */
+void seedRand(uint64_t seed);
+
 int randInt(int min, int max);
 
 float randFloat(float min, float max);
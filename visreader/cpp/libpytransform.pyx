@@ -20,9 +20,12 @@ from libcpp.string cimport string
 from libcpp.vector cimport vector as vector
 from libcpp.map cimport map
 from libcpp.pair cimport pair as pair
+from libcpp.memory cimport shared_ptr
 from libcpp cimport bool
 from libc.string cimport memcpy
 from libc.stdint cimport uintptr_t
+from libc.stdint cimport int64_t
+from libc.stdint cimport uint64_t
 import time
 import numpy as np
 from cython.operator cimport dereference as deref, preincrement as inc
@@ -36,17 +39,35 @@ logger = logging.getLogger(__name__)
 cdef extern from "transformer.h" namespace "vistool":
     cdef struct transformer_input_data_t:
         unsigned int id
+        int64_t seed
         string data
         string label
+        const char *ref
+        size_t ref_len
         
     cdef struct transformer_output_data_t:
         unsigned int id
         int err_no
         string err_msg
         vector[int] shape
+        string dtype
         string label
         string data
+        char *dst
+        size_t dst_size
         
+cdef extern from "op_stats.h" namespace "vistool":
+    cdef int kStatBuckets
+
+    cdef struct op_stat_t:
+        string name
+        uint64_t count
+        uint64_t total_us
+        uint64_t max_us
+        vector[uint64_t] hist
+        map[int, uint64_t] errors
+
+
 cdef extern from "baseprocess.h" namespace "vistool":
     cdef cppclass IProcessor:
         int process(const transformer_input_data_t &input,\
@@ -57,12 +78,21 @@ cdef extern from "baseprocess.h" namespace "vistool":
     void destroy_processor "vistool::IProcessor::destroy" (IProcessor *p) nogil
 
 
+cdef extern from "batchprocess.h" namespace "vistool":
+    cdef cppclass BatchProcessor:
+        BatchProcessor(IProcessor *p, int thread_num)
+        int process(const vector[transformer_input_data_t] &inputs,
+            vector[transformer_output_data_t] *outputs) nogil
+        int thread_num()
+
+
 class TransformerException(Exception):
     pass
  
 
 cdef class CyProcessor:
     cdef IProcessor *_cprocessor
+    cdef BatchProcessor *_batch
     cdef string classname
     cdef map[string, string] conf
     cdef vector[map[string, string]] ops_conf
@@ -83,7 +113,7 @@ cdef class CyProcessor:
     def get_conf(self):
         return self.classname, self.ops_conf
 
-    def process(self, data, label, id=None):
+    def process(self, data, label, id=None, seed=None):
         cdef transformer_input_data_t input
         cdef transformer_output_data_t output
 
@@ -95,6 +125,11 @@ cdef class CyProcessor:
         else:
             input.id = 0
 
+        if seed is not None:
+            input.seed = seed
+        else:
+            input.seed = -1
+
         cdef int ret = 0
         with nogil:
             ret = self._cprocessor.process(input, output)
@@ -103,10 +138,99 @@ cdef class CyProcessor:
             raise TransformerException('failed to process with ret[%d]' % (ret))
 
         shape = list(output.shape)
-        out_data = np.fromstring(output.data, np.uint8).reshape(shape)
+        out_data = np.fromstring(output.data, np.dtype(output.dtype)).reshape(shape)
         out_label = output.label
         return out_data, out_label
 
+    def process_batch(self, images, labels=None, seeds=None, out=None, thread_num=1):
+        """ process a batch of images by 'thread_num' native threads with
+            the GIL released, and write results to an array in shape (N, ...)
+
+        Args:
+            @images (list): encoded images in objects supporting the buffer
+                protocol, which are not copied
+            @labels (list): labels of images, None means empty labels
+            @seeds (list of int): seeds for random ops on each image
+            @out (np.ndarray): array to write the results, a new one is
+                created in the shape and dtype of the first result if None
+
+        Returns:
+            (out, labels)
+        """
+        cdef int n = len(images)
+        if n == 0:
+            raise TransformerException('no images to process')
+        if labels is not None and len(labels) != n:
+            raise TransformerException('labels not match with images')
+        if seeds is not None and len(seeds) != n:
+            raise TransformerException('seeds not match with images')
+
+        cdef vector[transformer_input_data_t] inputs
+        cdef vector[transformer_output_data_t] outputs
+        inputs.resize(n)
+        outputs.resize(n)
+        # images are not copied but referred, and kept alive by 'datas'
+        datas = []
+        cdef int i = 0
+        for i in range(n):
+            data = as_byte_array(images[i])
+            datas.append(data)
+            inputs[i].id = i
+            inputs[i].ref = <const char *><uintptr_t>data.ctypes.data
+            inputs[i].ref_len = data.nbytes
+            inputs[i].label = str(labels[i]) if labels is not None else ''
+            if seeds is not None and seeds[i] is not None:
+                inputs[i].seed = seeds[i]
+
+        cdef char *base = NULL
+        cdef size_t item_size = 0
+        if out is not None:
+            if out.shape[0] != n or not out.flags['C_CONTIGUOUS'] \
+                    or not out.flags['WRITEABLE']:
+                raise TransformerException('invalid array to write results, '\
+                    'which should be writeable and C-contiguous with %d rows' % (n))
+            base = <char *><uintptr_t>out.ctypes.data
+            item_size = out.nbytes // n
+            for i in range(n):
+                outputs[i].dst = base + i * item_size
+                outputs[i].dst_size = item_size
+
+        if self._batch != NULL and self._batch.thread_num() != thread_num:
+            with nogil:
+                del self._batch
+            self._batch = NULL
+        if self._batch == NULL:
+            self._batch = new BatchProcessor(self._cprocessor, thread_num)
+
+        # results are written to 'out' directly if given, otherwise kept
+        # in 'outputs' and copied to an array in the shape of the first one
+        with nogil:
+            self._batch.process(inputs, &outputs)
+
+        for i in range(n):
+            if outputs[i].err_no != 0:
+                raise TransformerException('failed to process image[%d] with '\
+                    'err_no[%d] err_msg[%s]' % (i, outputs[i].err_no, outputs[i].err_msg))
+
+        if out is None:
+            out = np.empty([n] + list(outputs[0].shape), np.dtype(outputs[0].dtype))
+            base = <char *><uintptr_t>out.ctypes.data
+            item_size = out.nbytes // n
+
+        out_labels = []
+        for i in range(n):
+            if list(outputs[i].shape) != list(out.shape[1:]) or \
+                    np.dtype(outputs[i].dtype) != out.dtype:
+                raise TransformerException('result of image[%d] in shape%s '\
+                    'and dtype[%s] not match with %s' % (i, str(list(outputs[i].shape)),
+                    outputs[i].dtype, str(out[0].shape)))
+            if outputs[i].data.size() > 0:
+                # not written to 'dst' by the processor
+                memcpy(base + i * item_size, outputs[i].data.data(), item_size)
+            out_labels.append(outputs[i].label)
+
+        return out, out_labels
+
     def __str__(self):
         """ representation for this object
         """
@@ -117,6 +241,11 @@ cdef class CyProcessor:
         return 'CyProcessor(0x%x)' % (addr)
 
     def __dealloc__(self):
+        if self._batch != NULL:
+            with nogil:
+                del self._batch
+            self._batch = NULL
+
         if self._cprocessor != NULL:
             logger.debug('destroy %s' % (str(self)))
             with nogil:
@@ -134,8 +263,23 @@ cdef extern from "transformer.h" namespace "vistool":
         bool is_stopped()
         int put(const transformer_input_data_t &input) nogil
         int put(int id, const char *image, int image_len,
-            const char *label, int label_len) nogil
+            const char *label, int label_len, int64_t seed) nogil
+        int put_ref(int id, const char *image, size_t image_len,
+            const char *label, int label_len, int64_t seed) nogil
+        int put_many(const vector[transformer_input_data_t] &inputs) nogil
+        void get_stats(vector[op_stat_t] *stats) nogil
+        void reset_stats() nogil
         int get(transformer_output_data_t *output) nogil
+        int get_output "get" (transformer_output_data_t **output) nogil
+        int try_get(transformer_output_data_t **output) nogil
+        int get_many(int num,
+            vector[transformer_output_data_t *] *outputs) nogil
+        shared_ptr[OutputPool] pool()
+
+    cdef cppclass OutputPool:
+        transformer_output_data_t *alloc() nogil
+        void release(transformer_output_data_t *output) nogil
+        size_t size()
 
        
 cdef extern from "transformer.h" namespace "vistool":
@@ -143,9 +287,56 @@ cdef extern from "transformer.h" namespace "vistool":
     void destroy_transform "vistool::Transformer::destroy" (Transformer *t) nogil
 
 
+def as_byte_array(obj):
+    """ a flat array of uint8 sharing memory with 'obj' which supports the
+        buffer protocol, eg: str, bytearray, memoryview, numpy arrays
+        or mmap objects, it's copied only if not contiguous
+    """
+    if isinstance(obj, memoryview):
+        obj = np.asarray(obj)
+
+    if isinstance(obj, np.ndarray):
+        return np.ascontiguousarray(obj).reshape(-1).view(np.uint8)
+    return np.frombuffer(obj, dtype=np.uint8)
+
+
+cdef class OutputBuffer:
+    """ memory of a result from the native transformer which is wrapped
+        by numpy without copying, it goes back to the pool of the transformer
+        when the arrays using it are freed
+    """
+    cdef transformer_output_data_t *_output
+    cdef shared_ptr[OutputPool] _pool
+
+    @staticmethod
+    cdef OutputBuffer wrap(transformer_output_data_t *output,
+            shared_ptr[OutputPool] pool):
+        cdef OutputBuffer buf = OutputBuffer.__new__(OutputBuffer)
+        buf._output = output
+        buf._pool = pool
+        return buf
+
+    property __array_interface__:
+        def __get__(self):
+            return {
+                'version': 3,
+                'shape': tuple(self._output.shape),
+                'typestr': np.dtype(self._output.dtype).str,
+                'data': (<uintptr_t>self._output.data.data(), False),
+            }
+
+    def __dealloc__(self):
+        if self._output != NULL:
+            self._pool.get().release(self._output)
+            self._output = NULL
+
+
 cdef class CyTransformer:
     cdef Transformer *_ctransformer
+    cdef shared_ptr[OutputPool] _pool
     cdef unsigned int id
+    cdef int _seq
+    cdef dict _inflight
     def __cinit__(self, trans_conf, ops_conf):
         for op in ops_conf:
             for k, v in op.items():
@@ -154,6 +345,10 @@ cdef class CyTransformer:
             trans_conf[str(k)] = str(v)
 
         self.id = 0
+        self._seq = 0
+        # {native id: (id, label, image)} of images not got yet, which
+        # keeps the images alive as they are not copied
+        self._inflight = {}
         ctransformtype = 'ImageTransformer'
         self._ctransformer = create_transform(ctransformtype)
         if self._ctransformer is NULL:
@@ -168,7 +363,10 @@ cdef class CyTransformer:
 
         cdef vector[map[string, string]] c_ops_conf = ops_conf
         cdef IProcessor *proc_ptr = create_processor(c_name, c_ops_conf)
+        if proc_ptr is NULL:
+            raise TransformerException('fail to create a IProcessor(%s)' % (c_name))
         self._ctransformer.set_processor(proc_ptr)
+        self._pool = self._ctransformer.pool()
         logger.debug('create %s' % (str(self)))
         
     def __init__(self, trans_conf, ops_conf):
@@ -202,52 +400,258 @@ cdef class CyTransformer:
         return r
     
     def put(self, image, label, context):
+        """ put an image which can be any object supporting the buffer
+            protocol, it's not copied but kept alive until its result
+            is got, and 'label' is passed through as it is
+        """
         self.id += 1
-        cdef const char * imagedata = <const char*>image
-        cdef int image_len = len(image)
-        cdef const char * labeldata = <const char*>label
-        cdef int label_len = len(label)
-
-        cdef int id = self.id
+        id = self.id
         if context is not None and 'id' in context:
             id = context['id']
 
+        cdef int64_t seed = -1
+        if context is not None and context.get('seed') is not None:
+            seed = context['seed']
+
+        cdef int seq = 0
+        seq, data = self._pin(image, label, id)
+        cdef const char *imagedata = <const char *><uintptr_t>data.ctypes.data
+        cdef size_t image_len = data.nbytes
+
+        # only str labels are seen by native ops, eg: 'lua_op' may modify it
+        cdef const char *labeldata = NULL
+        cdef int label_len = 0
+        if isinstance(label, bytes):
+            labeldata = <const char *>label
+            label_len = len(label)
+
         cdef int r = 0
         cdef Transformer *ctransformer = self._ctransformer
         with nogil:
-            r = ctransformer.put(id, imagedata, image_len, labeldata, label_len)
-    
+            r = ctransformer.put_ref(seq, imagedata, image_len,
+                labeldata, label_len, seed)
+
         if r < 0:
+            del self._inflight[seq]
             raise TransformerException('fail to put data to transformer with ret[%d]' % (r))
+
+    def put_many(self, images, labels, ids=None, seeds=None):
+        """ put images in bulk like 'put', which are appended to native
+            workers in one call with the GIL released
+
+        Args:
+            @images (list): images supporting the buffer protocol
+            @labels (list): labels of 'images' passed through as they are
+            @ids (list): ids of 'images' got back in contexts of results,
+                default to increasing ones like 'put'
+            @seeds (list): seeds for random ops on each image,
+                None means not seeded
+        """
+        cdef int n = len(images)
+        if len(labels) != n:
+            raise TransformerException('num of labels[%d] not equal to '\
+                'num of images[%d]' % (len(labels), n))
+
+        cdef vector[transformer_input_data_t] inputs
+        inputs.resize(n)
+        seqs = []
+        cdef int i = 0
+        for i in range(n):
+            if ids is None:
+                self.id += 1
+                id = self.id
+            else:
+                id = ids[i]
+            seq, data = self._pin(images[i], labels[i], id)
+            seqs.append(seq)
+            inputs[i].id = seq
+            inputs[i].ref = <const char *><uintptr_t>data.ctypes.data
+            inputs[i].ref_len = data.nbytes
+            if isinstance(labels[i], bytes):
+                inputs[i].label = labels[i]
+            if seeds is not None and seeds[i] is not None:
+                inputs[i].seed = seeds[i]
+
+        cdef int r = 0
+        cdef Transformer *ctransformer = self._ctransformer
+        with nogil:
+            r = ctransformer.put_many(inputs)
+
+        if r < 0:
+            for seq in seqs:
+                del self._inflight[seq]
+            raise TransformerException('fail to put data to transformer with ret[%d]' % (r))
+
+    cdef _pin(self, image, label, id):
+        """ keep 'image' alive until its result is got, as it's not copied
+
+        Returns:
+            (native id, image as an array of bytes)
+        """
+        data = as_byte_array(image)
+        # ids given by users may be reused, so use our own ones in native
+        self._seq = (self._seq + 1) & 0x7fffffff
+        self._inflight[self._seq] = (id, label, data)
+        return self._seq, data
             
     def get(self, context):
-        cdef transformer_output_data_t data
+        """ get a transformed image as an array which wraps the memory
+            written by native workers without copying it
+        """
+        cdef transformer_output_data_t *data = NULL
         cdef int r = 0
 
         cdef Transformer *ctransformer = self._ctransformer
         with nogil:
-            r = ctransformer.get(&data)
+            r = ctransformer.get_output(&data)
 
         if r != 0:
             return None, None
 
+        return self._wrap_output(data, context)
+
+    def try_get(self, context):
+        """ get a transformed image like 'get' without blocking,
+            (None, None) is returned if no one is ready for now or
+            all have been got after stopped, which are told apart
+            by 'context['retcode']' of 2 and 1
+        """
+        cdef transformer_output_data_t *data = NULL
+        cdef int r = 0
+
+        cdef Transformer *ctransformer = self._ctransformer
+        with nogil:
+            r = ctransformer.try_get(&data)
+
+        if r != 0:
+            if context is not None:
+                context['retcode'] = r
+            return None, None
+
+        return self._wrap_output(data, context)
+
+    def get_many(self, num, context):
+        """ get at most 'num' transformed images, which blocks until one
+            is ready and then takes the others ready without blocking,
+            an empty list is returned only after all have been got
+
+        Args:
+            @num (int): max num of images to get
+            @context (dict): 'ids' of returned images are put into it,
+                and also 'errors' as a list of contexts of failed ones
+
+        Returns:
+            list of (image, label), where 'image' is None for failed ones
+        """
+        cdef vector[transformer_output_data_t *] outputs
+        cdef int n = num
+        cdef int r = 0
+
+        cdef Transformer *ctransformer = self._ctransformer
+        with nogil:
+            r = ctransformer.get_many(n, &outputs)
+
+        results = []
+        ids = []
+        errors = []
+        cdef size_t i = 0
+        for i in range(outputs.size()):
+            ctx = {}
+            try:
+                results.append(self._wrap_output(outputs[i], ctx))
+                ids.append(ctx['id'])
+            except TransformerException as e:
+                # keep failed ones in place, so that an empty list
+                # always means the end of stream
+                results.append((None, ctx['req_label']))
+                ids.append(ctx['id'])
+                errors.append(ctx)
+
         if context is not None:
             context['retcode'] = r
-            context['id'] = data.id
+            context['ids'] = ids
+            context['errors'] = errors
+        return results
+
+    cdef _wrap_output(self, transformer_output_data_t *data, context):
+        """ wrap a result got from the native transformer into an array
+        """
+        # owns 'data' from now on, and releases it to the pool when freed
+        buf = OutputBuffer.wrap(data, self._pool)
+        id, label, _ = self._inflight.pop(data.id)
+        if isinstance(label, bytes):
+            label = str(data.label)
+
+        if context is not None:
+            context['retcode'] = 0
+            context['id'] = id
             context['err_no'] = data.err_no
             context['err_msg'] = data.err_msg
+            context['shape'] = list(data.shape)
+            context['dtype'] = data.dtype
 
-        outputarray = data.data
         if data.err_no == 0:
-            shape = list(data.shape)
-            outputarray = np.frombuffer(data.data, np.uint8).reshape(shape)
-            return outputarray, str(data.label)
+            return np.asarray(buf), label
         else:
             if context is not None:
                 context['req_data'] = data.data
-                context['req_label'] = str(data.label)
+                context['req_label'] = label
             raise TransformerException('failed to transform image with')
 
+    def stats(self, reset=False):
+        """ timing stats of native ops on images processed so far,
+            or since last reset
+
+        Args:
+            @reset (bool): whether to reset stats after got
+
+        Returns:
+            list of dict for each op in order, with 'name', 'count',
+            'total_ms', 'avg_ms', 'max_ms', 'errors' as {err_no: count}
+            and 'hist' as [(upper bound of latency in ms, count)], the
+            last two are writing output, eg: 'tochw', and 'total'
+        """
+        cdef vector[op_stat_t] stats
+        cdef bool c_reset = reset
+        cdef Transformer *ctransformer = self._ctransformer
+        with nogil:
+            ctransformer.get_stats(&stats)
+            if c_reset:
+                ctransformer.reset_stats()
+
+        results = []
+        cdef op_stat_t st
+        cdef size_t i = 0
+        for i in range(stats.size()):
+            st = stats[i]
+            hist = []
+            for b, n in enumerate(st.hist):
+                if n > 0:
+                    upper = float('inf') if b == kStatBuckets - 1 \
+                        else (1 << b) / 1000.0
+                    hist.append((upper, n))
+            results.append({
+                'name': str(st.name),
+                'count': st.count,
+                'total_ms': st.total_us / 1000.0,
+                'avg_ms': st.total_us / 1000.0 / max(st.count, 1),
+                'max_ms': st.max_us / 1000.0,
+                'errors': dict(st.errors),
+                'hist': hist,
+            })
+        return results
+
+    def reset_stats(self):
+        """ clear timing stats of native ops
+        """
+        with nogil:
+            self._ctransformer.reset_stats()
+
+    def pool_size(self):
+        """ number of free output buffers kept for reusing
+        """
+        return self._pool.get().size()
+
     def __str__(self):
         """ representation for this object
         """
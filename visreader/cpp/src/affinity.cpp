@@ -0,0 +1,242 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+#include "include/affinity.h"
+
+#include <ctype.h>
+#include <dirent.h>
+#include <stdlib.h>
+
+#include <algorithm>
+#include <fstream>
+#include <set>
+#include <thread>
+#include <utility>
+
+#ifdef __linux__
+#include <pthread.h>
+#include <sched.h>
+#endif
+
+#include "include/logger.h"
+#include "include/util.h"
+
+namespace vistool {
+
+static const char *kNodeDir = "/sys/devices/system/node";
+
+static bool parse_cpu_id(const std::string &s, int *id) {
+  if (s.empty() || s.size() > 6) {
+    return false;
+  }
+  for (size_t i = 0; i < s.size(); i++) {
+    if (!isdigit(s[i])) {
+      return false;
+    }
+  }
+  *id = atoi(s.c_str());
+  return true;
+}
+
+int parse_cpu_list(const std::string &s, cpu_list_t *cpus) {
+  std::string list;
+  for (size_t i = 0; i < s.size(); i++) {
+    if (!isspace(s[i])) {
+      list += s[i];
+    }
+  }
+
+  cpus->clear();
+  std::set<int> seen;
+  std::vector<std::string> items = splitString(list, ",");
+  for (size_t i = 0; i < items.size(); i++) {
+    std::vector<std::string> range = splitString(items[i], "-");
+    int first = 0;
+    int last = 0;
+    if (range.size() == 1 && parse_cpu_id(range[0], &first)) {
+      last = first;
+    } else if (range.size() != 2 || !parse_cpu_id(range[0], &first) ||
+               !parse_cpu_id(range[1], &last) || first > last) {
+      LOG(WARNING) << "invalid cpu list[" << s << "]";
+      return -1;
+    }
+
+    // keep the order given by users, eg: '0,8,1,9' to alternate sockets
+    for (int id = first; id <= last; id++) {
+      if (seen.insert(id).second) {
+        cpus->push_back(id);
+      }
+    }
+  }
+
+  if (cpus->empty()) {
+    LOG(WARNING) << "empty cpu list[" << s << "]";
+    return -1;
+  }
+  return 0;
+}
+
+cpu_list_t allowed_cpus() {
+  cpu_list_t cpus;
+#ifdef __linux__
+  cpu_set_t set;
+  CPU_ZERO(&set);
+  if (sched_getaffinity(0, sizeof(set), &set) == 0) {
+    for (int i = 0; i < CPU_SETSIZE; i++) {
+      if (CPU_ISSET(i, &set)) {
+        cpus.push_back(i);
+      }
+    }
+  }
+#endif
+  if (cpus.empty()) {
+    int n = std::max(static_cast<int>(std::thread::hardware_concurrency()), 1);
+    for (int i = 0; i < n; i++) {
+      cpus.push_back(i);
+    }
+  }
+  return cpus;
+}
+
+std::vector<cpu_list_t> numa_nodes() {
+  std::vector<std::pair<int, cpu_list_t>> nodes;
+  DIR *dir = opendir(kNodeDir);
+  if (dir) {
+    struct dirent *ent = NULL;
+    while ((ent = readdir(dir)) != NULL) {
+      std::string name(ent->d_name);
+      int id = 0;
+      if (name.compare(0, 4, "node") != 0 ||
+          !parse_cpu_id(name.substr(4), &id)) {
+        continue;
+      }
+
+      std::ifstream f(std::string(kNodeDir) + "/" + name + "/cpulist");
+      std::string line;
+      cpu_list_t cpus;
+      if (std::getline(f, line) && parse_cpu_list(line, &cpus) == 0) {
+        nodes.push_back(std::make_pair(id, cpus));
+      }
+    }
+    closedir(dir);
+  }
+
+  std::sort(nodes.begin(), nodes.end());
+  std::vector<cpu_list_t> ret;
+  for (size_t i = 0; i < nodes.size(); i++) {
+    ret.push_back(nodes[i].second);
+  }
+  if (ret.empty()) {
+    ret.push_back(allowed_cpus());
+  }
+  return ret;
+}
+
+int plan_cpu_affinity(const std::string &affinity,
+                      const std::string &exclude,
+                      int worker_num,
+                      std::vector<cpu_list_t> *cpusets) {
+  cpusets->clear();
+  if (affinity.empty() && exclude.empty()) {
+    return 0;
+  }
+
+  cpu_list_t excluded;
+  if (!exclude.empty() && parse_cpu_list(exclude, &excluded)) {
+    return -1;
+  }
+
+  cpu_list_t allowed = allowed_cpus();
+  std::set<int> usable(allowed.begin(), allowed.end());
+  for (size_t i = 0; i < excluded.size(); i++) {
+    usable.erase(excluded[i]);
+  }
+
+  // cpus in 'cpus' which can be used by workers
+  auto filter = [&usable](const cpu_list_t &cpus) {
+    cpu_list_t ret;
+    for (size_t i = 0; i < cpus.size(); i++) {
+      if (usable.count(cpus[i])) {
+        ret.push_back(cpus[i]);
+      }
+    }
+    return ret;
+  };
+
+  if (affinity.empty()) {
+    cpu_list_t cpus = filter(allowed);
+    if (cpus.empty()) {
+      LOG(WARNING) << "no cpus left after excluding[" << exclude << "]";
+      return -1;
+    }
+    cpusets->assign(worker_num, cpus);
+  } else if (affinity == "spread") {
+    std::vector<cpu_list_t> nodes;
+    std::vector<cpu_list_t> all_nodes = numa_nodes();
+    for (size_t i = 0; i < all_nodes.size(); i++) {
+      cpu_list_t cpus = filter(all_nodes[i]);
+      if (!cpus.empty()) {
+        nodes.push_back(cpus);
+      }
+    }
+    if (nodes.empty()) {
+      LOG(WARNING) << "no cpus left in numa nodes after excluding["
+                   << exclude << "]";
+      return -1;
+    }
+    for (int i = 0; i < worker_num; i++) {
+      cpusets->push_back(nodes[i % nodes.size()]);
+    }
+  } else {
+    cpu_list_t cpus;
+    if (parse_cpu_list(affinity, &cpus)) {
+      return -1;
+    }
+    cpus = filter(cpus);
+    if (cpus.empty()) {
+      LOG(WARNING) << "no cpus allowed in cpu_affinity[" << affinity << "]";
+      return -1;
+    }
+    for (int i = 0; i < worker_num; i++) {
+      cpusets->push_back(cpu_list_t(1, cpus[i % cpus.size()]));
+    }
+  }
+  return 0;
+}
+
+int bind_current_thread(const cpu_list_t &cpus) {
+#ifdef __linux__
+  cpu_set_t set;
+  CPU_ZERO(&set);
+  for (size_t i = 0; i < cpus.size(); i++) {
+    if (cpus[i] >= 0 && cpus[i] < CPU_SETSIZE) {
+      CPU_SET(cpus[i], &set);
+    }
+  }
+
+  int ret = pthread_setaffinity_np(pthread_self(), sizeof(set), &set);
+  if (ret != 0) {
+    LOG(WARNING) << "failed to bind thread to cpus with ret[" << ret << "]";
+    return -1;
+  }
+  return 0;
+#else
+  LOG(WARNING) << "binding threads to cpus is not supported on this platform";
+  return -1;
+#endif
+}
+
+};  // namespace vistool
@@ -0,0 +1,109 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+#include "include/batchprocess.h"
+#include <exception>
+#include "include/logger.h"
+#include "include/util.h"
+
+namespace vistool {
+
+/**
+ * @brief count down the unfinished tasks of a batch
+ */
+class BatchCounter {
+public:
+  explicit BatchCounter(int num) : _left(num) {}
+
+  void done() {
+    std::lock_guard<std::mutex> lock(_mutex);
+    if (--_left == 0) {
+      _cond.notify_one();
+    }
+  }
+
+  void wait() {
+    std::unique_lock<std::mutex> lock(_mutex);
+    _cond.wait(lock, [this]() { return _left == 0; });
+  }
+
+private:
+  std::mutex _mutex;
+  std::condition_variable _cond;
+  int _left;
+};
+
+class BatchTask : public ITask {
+public:
+  BatchTask(IProcessor *p,
+            const transformer_input_data_t *input,
+            transformer_output_data_t *output,
+            BatchCounter *counter)
+      : _processor(p), _input(input), _output(output), _counter(counter) {}
+
+  void execute() {
+    try {
+      _processor->process(*_input, *_output);
+    } catch (const std::exception &e) {
+      _output->err_no = TRANS_ERR_LOGICERROR_EXCEPTION;
+      _output->err_msg = formatString("fatal logic error:[%s]", e.what());
+    }
+
+    BatchCounter *counter = _counter;
+    delete this;
+    counter->done();
+  }
+
+private:
+  IProcessor *_processor;
+  const transformer_input_data_t *_input;
+  transformer_output_data_t *_output;
+  BatchCounter *_counter;
+};
+
+BatchProcessor::BatchProcessor(IProcessor *p, int thread_num)
+    : _processor(p), _thread_num(thread_num), _workers(thread_num) {
+  LOG(INFO) << "BatchProcessor::BatchProcessor(thread_num:" << thread_num
+            << ")";
+  _workers.start();
+}
+
+BatchProcessor::~BatchProcessor() {
+  _workers.notify_exit();
+  _workers.join();
+}
+
+int BatchProcessor::process(const std::vector<transformer_input_data_t> &inputs,
+                            std::vector<transformer_output_data_t> *outputs) {
+  if (outputs->size() != inputs.size()) {
+    LOG(WARNING) << "invalid size[" << outputs->size() << "] of outputs for "
+                 << inputs.size() << " inputs";
+    return -1;
+  }
+
+  BatchCounter counter(inputs.size());
+  for (size_t i = 0; i < inputs.size(); i++) {
+    BatchTask *t =
+        new BatchTask(_processor, &inputs[i], &(*outputs)[i], &counter);
+    if (_workers.append_task(t) != 0) {
+      // not expected as the pool only exits in destructor
+      t->execute();
+    }
+  }
+  counter.wait();
+  return 0;
+}
+
+};  // namespace vistool
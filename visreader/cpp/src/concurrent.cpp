@@ -53,14 +53,243 @@ void ITask::finish() {
   }
 }
 
-void ThreadPool::run() {
-  static int id = 0;
-  id++;
-  int order = id;
-  LOG(INFO) << "run worker_" << order << " thread";
+ThreadPool::ThreadPool(int worker_num, int queue_limit)
+    : _worker_num(0),
+      _exit_mark(false),
+      _queue_limit(queue_limit),
+      _pending(0),
+      _sleeping(0),
+      _blocked(0),
+      _next(0) {
+  set_worker_num(worker_num);
+}
+
+ThreadPool::~ThreadPool() {
+  std::vector<ITask *> tasks;
+  pop_all(&tasks);
+  for (size_t i = 0; i < tasks.size(); i++) {
+    tasks[i]->execute();
+  }
+
+  for (size_t i = 0; i < _queues.size(); i++) {
+    delete _queues[i];
+  }
+  _queues.clear();
+}
+
+void ThreadPool::set_worker_num(int num) {
+  if (!_threads_info.empty()) {
+    LOG(WARNING) << "not allowed to set worker num of a started pool";
+    return;
+  }
+
+  // tasks appended before are moved to the new queues
+  std::vector<ITask *> tasks;
+  pop_all(&tasks);
+  for (size_t i = 0; i < _queues.size(); i++) {
+    delete _queues[i];
+  }
+  _queues.clear();
+
+  _worker_num = num;
+  for (int i = 0; i < std::max(num, 1); i++) {
+    _queues.push_back(new task_queue_t());
+  }
+  for (size_t i = 0; i < tasks.size(); i++) {
+    task_queue_t *q = _queues[i % _queues.size()];
+    q->tasks.push_back(tasks[i]);
+    q->size++;
+    _pending++;
+  }
+}
+
+thread_local int ThreadPool::s_worker_index = -1;
+
+void ThreadPool::set_queue_limit(int limit) {
+  _queue_limit = limit;
+  std::lock_guard<std::mutex> lock(_mutex);
+  _not_full.notify_all();
+}
+
+void ThreadPool::set_cpu_affinity(const std::vector<cpu_list_t> &cpusets) {
+  if (!_threads_info.empty()) {
+    LOG(WARNING) << "not allowed to set cpu affinity of a started pool";
+    return;
+  }
+  _cpusets = cpusets;
+}
+
+void ThreadPool::bind_cpus(int index) {
+  if (index < 0 || index >= static_cast<int>(_cpusets.size())) {
+    return;
+  }
+  if (bind_current_thread(_cpusets[index]) == 0) {
+    LOG(INFO) << "bind worker[" << index << "] to "
+              << _cpusets[index].size() << " cpus";
+  }
+}
+
+bool ThreadPool::wait_not_full(int n) {
+  if (_exit_mark) {
+    return false;
+  }
+
+  // a batch larger than the limit is let in only when the pool is empty
+  auto has_room = [this, n]() {
+    int pending = _pending;
+    return pending + n <= _queue_limit || pending <= 0;
+  };
+  if (!has_room()) {
+    std::unique_lock<std::mutex> lock(_mutex);
+    _blocked++;
+    _not_full.wait(lock, [this, &has_room]() {
+      return has_room() || _exit_mark;
+    });
+    _blocked--;
+  }
+  return !_exit_mark;
+}
+
+int ThreadPool::append_task(ITask *task) {
+  if (!wait_not_full()) {
+    return -1;
+  }
+
+  task_queue_t *q = _queues[_next++ % _queues.size()];
+  {
+    std::lock_guard<std::mutex> lock(q->mutex);
+    q->tasks.push_back(task);
+    q->size++;
+  }
+
+  // wake up one worker only if some are sleeping
+  _pending++;
+  if (_sleeping > 0) {
+    std::lock_guard<std::mutex> lock(_mutex);
+    _not_empty.notify_one();
+  }
+  return 0;
+}
+
+int ThreadPool::append_tasks(const std::vector<ITask *> &tasks) {
+  int n = tasks.size();
+  if (n == 0) {
+    return 0;
+  }
+  if (!wait_not_full(n)) {
+    return -1;
+  }
+
+  // spread tasks over the queues, each of which is locked only once
+  int qn = _queues.size();
+  unsigned int first = _next.fetch_add(n);
+  for (int j = 0; j < std::min(n, qn); j++) {
+    task_queue_t *q = _queues[(first + j) % qn];
+    std::lock_guard<std::mutex> lock(q->mutex);
+    for (int i = j; i < n; i += qn) {
+      q->tasks.push_back(tasks[i]);
+      q->size++;
+    }
+  }
+
+  _pending += n;
+  if (_sleeping > 0) {
+    std::lock_guard<std::mutex> lock(_mutex);
+    if (n > 1) {
+      _not_empty.notify_all();
+    } else {
+      _not_empty.notify_one();
+    }
+  }
+  return 0;
+}
+
+void ThreadPool::notify_exit() {
+  _exit_mark = true;
+  std::lock_guard<std::mutex> lock(_mutex);
+  _not_empty.notify_all();
+  _not_full.notify_all();
+}
+
+void ThreadPool::join() {
+  for (size_t i = 0; i < _threads_info.size(); i++) {
+    _threads_info[i]->join();
+    delete _threads_info[i];
+  }
+  _threads_info.clear();
+
+  std::vector<ITask *> tasks;
+  pop_all(&tasks);
+  for (size_t i = 0; i < tasks.size(); i++) {
+    delete tasks[i];
+  }
+}
+
+ITask *ThreadPool::pop_task(int index) {
+  int n = _queues.size();
+  for (int i = 0; i < n; i++) {
+    task_queue_t *q = _queues[(index + i) % n];
+    if (q->size <= 0) {
+      continue;
+    }
+
+    std::lock_guard<std::mutex> lock(q->mutex);
+    if (!q->tasks.empty()) {
+      ITask *t = q->tasks.front();
+      q->tasks.pop_front();
+      q->size--;
+      return t;
+    }
+  }
+  return NULL;
+}
+
+void ThreadPool::pop_all(std::vector<ITask *> *tasks) {
+  for (size_t i = 0; i < _queues.size(); i++) {
+    task_queue_t *q = _queues[i];
+    std::lock_guard<std::mutex> lock(q->mutex);
+    tasks->insert(tasks->end(), q->tasks.begin(), q->tasks.end());
+    _pending -= q->tasks.size();
+    q->tasks.clear();
+    q->size = 0;
+  }
+}
+
+ITask *ThreadPool::fetch_task(int index, uint32_t wait_ms) {
+  ITask *t = pop_task(index);
+  if (!t) {
+    std::unique_lock<std::mutex> lock(_mutex);
+    _sleeping++;
+    if (!wait_ms) {
+      _not_empty.wait(lock, [this]() { return _pending > 0 || _exit_mark; });
+    } else {
+      _not_empty.wait_for(lock, std::chrono::milliseconds(wait_ms), [this]() {
+        return _pending > 0 || _exit_mark;
+      });
+    }
+    _sleeping--;
+    lock.unlock();
+    t = pop_task(index);
+  }
+
+  if (t) {
+    // wake up producers only if some are blocked, all of them because
+    // a batch waiting for more room may not be able to use this one
+    int left = --_pending;
+    if (_blocked > 0 && left < _queue_limit) {
+      std::lock_guard<std::mutex> lock(_mutex);
+      _not_full.notify_all();
+    }
+  }
+  return t;
+}
+
+void ThreadPool::run(int index) {
+  LOG(INFO) << "run worker_" << index << " thread";
 
   while (!_exit_mark) {
-    ITask *t = fetch_task(10);
+    // sleep until a task is appended or 'notify_exit' is called
+    ITask *t = fetch_task(index);
     if (t) {
       t->execute();
     } else if (_exit_mark) {
@@ -68,7 +297,7 @@ void ThreadPool::run() {
     }
   }
 
-  LOG(INFO) << "exit thread with id:" << order << " right now";
+  LOG(INFO) << "exit thread with id:" << index << " right now";
 }
 
 };  // namespace vistool
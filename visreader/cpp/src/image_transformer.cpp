@@ -67,9 +67,12 @@ ImageTransformer::ImageTransformer()
       _id(0),
       _in_num(0),
       _out_num(0),
+      _done_num(0),
+      _stopped(false),
       _state(""),
       _workers(),
-      _output_queue(1000) {
+      _output_queue(1000),
+      _pool(new OutputPool()) {
   static std::atomic_int s_id_generator(0);
   _id = ++s_id_generator;
   LOG(INFO) << "ImageTransformer::ImageTransformer(id:" << _id << ")";
@@ -88,7 +91,7 @@ ImageTransformer::~ImageTransformer() {
     transformer_output_data_t *d = this->_output_queue.get(100);
     if (d) {
       LOG(INFO) << "delete unconsumed data[" << d->id << "] in output queue";
-      delete d;
+      _pool->release(d);
     } else {
       LOG(INFO) << "no more data need to delete now";
     }
@@ -118,6 +121,7 @@ int ImageTransformer::init(const kv_conf_t &conf) {
     return -3;
   }
   this->_workers.set_worker_num(thread_num);
+  _output_queue.set_shard_num(thread_num);
 
   int worker_queue_limit = 0;
   if (!confhelper.get("worker_queue_limit", &worker_queue_limit, 0)) {
@@ -131,8 +135,20 @@ int ImageTransformer::init(const kv_conf_t &conf) {
     return -5;
   }
   _output_queue.set_queue_limit(worker_queue_limit);
+  _pool->set_capacity(worker_queue_limit);
   this->_workers.set_queue_limit(worker_queue_limit);
 
+  // cpus to run workers on, see 'plan_cpu_affinity' for the format
+  std::string cpu_affinity = confhelper.get("cpu_affinity", "");
+  std::string cpu_exclude = confhelper.get("cpu_affinity_exclude", "");
+  std::vector<cpu_list_t> cpusets;
+  if (plan_cpu_affinity(cpu_affinity, cpu_exclude, thread_num, &cpusets)) {
+    LOG(WARNING) << "invalid cpu_affinity param[" << cpu_affinity
+                 << "] or cpu_affinity_exclude param[" << cpu_exclude << "]";
+    return -6;
+  }
+  this->_workers.set_cpu_affinity(cpusets);
+
   this->_state = "inited";
   return 0;
 }
@@ -180,6 +196,8 @@ int ImageTransformer::stop() {
 
   // do not exit the worker here for unfinished tasks
   this->_state = "stopped";
+  _stopped = true;
+  _check_finished();
   return 0;
 }
 
@@ -198,10 +216,12 @@ int ImageTransformer::put(int id,
                           const char *image,
                           int image_len,
                           const char *label,
-                          int label_len) {
+                          int label_len,
+                          int64_t seed) {
   MyTask *t = MyTask::create(this);
   transformer_input_data_t *input = t->get_input();
   input->id = id;
+  input->seed = seed;
   input->data.resize(image_len);
   std::memcpy(&input->data[0], image, image_len);
   input->label.resize(label_len);
@@ -214,6 +234,61 @@ int ImageTransformer::put(int id,
   return ret;
 }
 
+int ImageTransformer::put_ref(int id,
+                              const char *image,
+                              size_t image_len,
+                              const char *label,
+                              int label_len,
+                              int64_t seed) {
+  MyTask *t = MyTask::create(this);
+  transformer_input_data_t *input = t->get_input();
+  input->id = id;
+  input->seed = seed;
+  input->ref = image;
+  input->ref_len = image_len;
+  input->label.assign(label, label_len);
+
+  int ret = this->_put_task(t);
+  if (ret) {
+    MyTask::destroy(t);
+  }
+  return ret;
+}
+
+int ImageTransformer::put_many(
+    const std::vector<transformer_input_data_t> &inputs) {
+  std::vector<ITask *> tasks;
+  tasks.reserve(inputs.size());
+  for (size_t i = 0; i < inputs.size(); i++) {
+    tasks.push_back(MyTask::create(inputs[i], this));
+  }
+
+  int ret = this->_put_tasks(tasks);
+  if (ret) {
+    for (size_t i = 0; i < tasks.size(); i++) {
+      MyTask::destroy(static_cast<MyTask *>(tasks[i]));
+    }
+  }
+  return ret;
+}
+
+int ImageTransformer::_put_tasks(const std::vector<ITask *> &tasks) {
+  if (this->_state != "started") {
+    LOG(WARNING) << "not allowed to put input in this state[" << this->_state
+                 << "]";
+    return -1;
+  }
+
+  int ret = this->_workers.append_tasks(tasks);
+  if (ret) {
+    LOG(FATAL) << "failed to append tasks to transformer";
+    ret = -2;
+  } else {
+    _in_num += tasks.size();
+  }
+  return ret;
+}
+
 int ImageTransformer::_put_task(ITask *t) {
   if (this->_state != "started") {
     LOG(WARNING) << "not allowed to put input in this state[" << this->_state
@@ -232,37 +307,89 @@ int ImageTransformer::_put_task(ITask *t) {
   return ret;
 }
 
+void ImageTransformer::get_stats(std::vector<op_stat_t> *stats) {
+  stats->clear();
+  if (_imgprocess) {
+    _imgprocess->get_stats(stats);
+  }
+}
+
+void ImageTransformer::reset_stats() {
+  if (_imgprocess) {
+    _imgprocess->reset_stats();
+  }
+}
+
+void ImageTransformer::_check_finished() {
+  // both stop() and the worker processing the last input call this
+  // after updating their own state, so one of them must see both
+  if (_stopped && _done_num == _in_num) {
+    _output_queue.close();
+  }
+}
+
 /*
  * get data from transformed queue utill no data and stopped
  */
 int ImageTransformer::get(transformer_output_data_t *output) {
   transformer_output_data_t *out = NULL;
-  while (1) {
-    out = this->_output_queue.get(100);
-    if (out) {
-      break;
-    }
-    if (is_stopped() && _unconsumed_num() == 0) {
-      break;
-    }
+  int ret = this->get(&out);
+  if (ret == 0) {
+    *output = *out;
+    _pool->release(out);
   }
+  return ret;
+}
 
+int ImageTransformer::get(transformer_output_data_t **output) {
+  // only returns NULL after closed in '_check_finished'
+  transformer_output_data_t *out = this->_output_queue.get();
   if (out) {
     _out_num++;
-    *output = *out;
-    delete out;
-    out = NULL;
-    return 0;
+    *output = out;
+    return TRANS_GET_OK;
   } else {
     LOG(INFO) << "tranformer has stoped and got nothing";
-    return 1;
+    return TRANS_GET_FINISHED;
+  }
+}
+
+int ImageTransformer::try_get(transformer_output_data_t **output) {
+  transformer_output_data_t *out = NULL;
+  if (this->_output_queue.try_get(&out)) {
+    _out_num++;
+    *output = out;
+    return TRANS_GET_OK;
+  }
+
+  if (this->_output_queue.is_closed() && this->_output_queue.is_empty()) {
+    return TRANS_GET_FINISHED;
+  }
+  return TRANS_GET_NOT_READY;
+}
+
+int ImageTransformer::get_many(
+    int num, std::vector<transformer_output_data_t *> *outputs) {
+  transformer_output_data_t *out = NULL;
+  int ret = this->get(&out);
+  if (ret != TRANS_GET_OK) {
+    return ret;
+  }
+
+  outputs->push_back(out);
+  while (static_cast<int>(outputs->size()) < num &&
+         this->try_get(&out) == TRANS_GET_OK) {
+    outputs->push_back(out);
   }
+  return TRANS_GET_OK;
 }
 
 void ImageTransformer::process(const transformer_input_data_t &input) {
-  transformer_output_data_t *output = new transformer_output_data_t;
+  transformer_output_data_t *output = _pool->alloc();
   _imgprocess->process(input, *output);
-  this->_output_queue.put(output);
+  this->_output_queue.put(output, ThreadPool::worker_index());
+  _done_num++;
+  _check_finished();
   return;
 }
 
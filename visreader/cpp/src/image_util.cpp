@@ -14,6 +14,7 @@
  * limitations under the License.
  */
 
+#include <math.h>
 #include <stdio.h>
 #include <string>
 #include <vector>
@@ -21,6 +22,8 @@
 #include "include/image_util.h"
 #include "logger.h"
 #ifdef WITH_TURBOJPEG
+#include <setjmp.h>
+#include "jpeglib.h"
 #include "turbojpeg.h"
 #endif
 
@@ -109,8 +112,56 @@ cv::Mat decodeImage(const cv::Mat &buf, int mode) {
   return decoded;
 }
 
+/**
+ * @brief whether the scaled size 'w' and 'h' satisfies the size hint
+ */
+static bool isLargeEnough(int w,
+                          int h,
+                          const cv::Size &min_size,
+                          int min_short) {
+  return w >= min_size.width && h >= min_size.height &&
+         std::min(w, h) >= min_short;
+}
+
+bool jpegSize(const char *buf, size_t bufsize, int *width, int *height) {
+  const unsigned char *p = (const unsigned char *)buf;
+  if (bufsize < 4 || p[0] != 0xFF || p[1] != 0xD8) {
+    return false;
+  }
+
+  // walk through segments until a 'start of frame' marker found
+  size_t pos = 2;
+  while (pos + 4 <= bufsize) {
+    if (p[pos] != 0xFF) {
+      return false;
+    }
+    unsigned char marker = p[pos + 1];
+    if (marker == 0xFF) {  // padding
+      pos++;
+      continue;
+    }
+    size_t seglen = (p[pos + 2] << 8) | p[pos + 3];
+    bool is_sof = marker >= 0xC0 && marker <= 0xCF && marker != 0xC4 &&
+                  marker != 0xC8 && marker != 0xCC;
+    if (is_sof) {
+      if (pos + 9 > bufsize) {
+        return false;
+      }
+      *height = (p[pos + 5] << 8) | p[pos + 6];
+      *width = (p[pos + 7] << 8) | p[pos + 8];
+      return *width > 0 && *height > 0;
+    }
+    pos += 2 + seglen;
+  }
+  return false;
+}
+
 #ifdef WITH_TURBOJPEG
-static cv::Mat decodeJpeg(const char *buffer, int bufferlen, int iscolor) {
+static cv::Mat decodeJpeg(const char *buffer,
+                          int bufferlen,
+                          int iscolor,
+                          const cv::Size &min_size,
+                          int min_short) {
   tjhandle handle = tjInitDecompress();
 
   int width = 0;
@@ -118,6 +169,25 @@ static cv::Mat decodeJpeg(const char *buffer, int bufferlen, int iscolor) {
   int subsample = 0;
   tjDecompressHeader2(
       handle, (uint8_t *)(buffer), bufferlen, &width, &height, &subsample);
+
+  // choose the smallest scaling factor which satisfies the size hint,
+  // and decode with the original size if no hint
+  int factor_num = 0;
+  tjscalingfactor *factors = NULL;
+  if (min_size.area() > 0 || min_short > 0) {
+    factors = tjGetScalingFactors(&factor_num);
+  }
+  int jpeg_w = width;
+  int jpeg_h = height;
+  for (int i = 0; factors && i < factor_num; i++) {
+    int w = TJSCALED(jpeg_w, factors[i]);
+    int h = TJSCALED(jpeg_h, factors[i]);
+    if (w < width && isLargeEnough(w, h, min_size, min_short)) {
+      width = w;
+      height = h;
+    }
+  }
+
   cv::Mat img;
   if (iscolor) {
     img = cv::Mat(height, width, CV_8UC3);
@@ -138,6 +208,75 @@ static cv::Mat decodeJpeg(const char *buffer, int bufferlen, int iscolor) {
   return img;
 }
 
+struct JpegErrorMgr {
+  struct jpeg_error_mgr pub;
+  jmp_buf setjmp_buffer;
+};
+
+static void jpegErrorExit(j_common_ptr cinfo) {
+  JpegErrorMgr *err = reinterpret_cast<JpegErrorMgr *>(cinfo->err);
+  longjmp(err->setjmp_buffer, 1);
+}
+
+/**
+ * @brief decode area 'rect' of a jpeg image to a RGB or gray image,
+ *        rows out of 'rect' are skipped, and columns are cropped to MCU
+ *        boundaries by libjpeg before decoding
+ *
+ * Returns:
+ *  true if succeed
+ */
+static bool decodeJpegCrop(const char *buffer,
+                           int bufferlen,
+                           int iscolor,
+                           const cv::Rect &rect,
+                           cv::Mat *result) {
+  struct jpeg_decompress_struct cinfo;
+  JpegErrorMgr jerr;
+  cinfo.err = jpeg_std_error(&jerr.pub);
+  jerr.pub.error_exit = jpegErrorExit;
+  if (setjmp(jerr.setjmp_buffer)) {
+    jpeg_destroy_decompress(&cinfo);
+    result->release();
+    return false;
+  }
+
+  jpeg_create_decompress(&cinfo);
+  jpeg_mem_src(&cinfo, (unsigned char *)buffer, bufferlen);
+  jpeg_read_header(&cinfo, TRUE);
+  cinfo.out_color_space = iscolor ? JCS_RGB : JCS_GRAYSCALE;
+  if (rect.x < 0 || rect.y < 0 || rect.width <= 0 || rect.height <= 0 ||
+      rect.x + rect.width > static_cast<int>(cinfo.image_width) ||
+      rect.y + rect.height > static_cast<int>(cinfo.image_height)) {
+    jpeg_destroy_decompress(&cinfo);
+    return false;
+  }
+  jpeg_start_decompress(&cinfo);
+
+  // xoffset and width will be aligned to MCU boundaries
+  JDIMENSION xoffset = rect.x;
+  JDIMENSION width = rect.width;
+  jpeg_crop_scanline(&cinfo, &xoffset, &width);
+  if (rect.y > 0) {
+    jpeg_skip_scanlines(&cinfo, rect.y);
+  }
+
+  int type = cinfo.output_components == 1 ? CV_8UC1 : CV_8UC3;
+  result->create(rect.height, cinfo.output_width, type);
+  JDIMENSION end = rect.y + rect.height;
+  while (cinfo.output_scanline < end) {
+    JSAMPROW row = result->ptr(cinfo.output_scanline - rect.y);
+    jpeg_read_scanlines(&cinfo, &row, 1);
+  }
+
+  // abort to skip the rows left
+  jpeg_abort_decompress(&cinfo);
+  jpeg_destroy_decompress(&cinfo);
+
+  *result = (*result)(cv::Rect(rect.x - xoffset, 0, rect.width, rect.height));
+  return true;
+}
+
 static bool checkformat(const char *buffer,
                         int bufferlen,
                         const char *format,
@@ -154,22 +293,65 @@ static bool is_jpeg_format(const char *buffer, int bufferlen) {
 }
 #endif
 
+#ifndef WITH_TURBOJPEG
+/**
+ * @brief get the flag of reduced decoding in opencv which satisfies
+ *        the size hint, or 'mode' if not reducible
+ */
+static int reducedMode(const char *buf,
+                       size_t bufsize,
+                       int mode,
+                       const cv::Size &min_size,
+                       int min_short) {
+  int width = 0;
+  int height = 0;
+  if ((min_size.area() <= 0 && min_short <= 0) ||
+      !jpegSize(buf, bufsize, &width, &height)) {
+    return mode;
+  }
+
+  const int scales[] = {8, 4, 2};
+  for (int scale : scales) {
+    int w = (width + scale - 1) / scale;
+    int h = (height + scale - 1) / scale;
+    if (isLargeEnough(w, h, min_size, min_short)) {
+      bool gray = mode == cv::IMREAD_GRAYSCALE;
+      if (scale == 8) {
+        return gray ? cv::IMREAD_REDUCED_GRAYSCALE_8
+                    : cv::IMREAD_REDUCED_COLOR_8;
+      } else if (scale == 4) {
+        return gray ? cv::IMREAD_REDUCED_GRAYSCALE_4
+                    : cv::IMREAD_REDUCED_COLOR_4;
+      } else {
+        return gray ? cv::IMREAD_REDUCED_GRAYSCALE_2
+                    : cv::IMREAD_REDUCED_COLOR_2;
+      }
+    }
+  }
+  return mode;
+}
+#endif
+
 IMPROC_ERR_CODE_TYPE decode(const char *buf,
                             size_t bufsize,
                             cv::Mat *result,
-                            int mode) {
+                            int mode,
+                            const cv::Size &min_size,
+                            int min_short) {
   IMPROC_ERR_CODE_TYPE ret = IMPROC_OK;
   cv::Mat dec;
+  dec.allocator = result->allocator;
 #ifdef WITH_TURBOJPEG
   bool isjpeg = is_jpeg_format(buf, bufsize);
   if (isjpeg) {
-    dec = decodeJpeg(buf, bufsize, mode);
+    dec = decodeJpeg(buf, bufsize, mode, min_size, min_short);
   } else {
     dec = cv::imdecode(std::vector<char>(buf, buf + bufsize), mode);
   }
 #else
   cv::Mat bufmat(1, bufsize, CV_8U, (void *)buf);
-  dec = cv::imdecode(bufmat, mode);
+  mode = reducedMode(buf, bufsize, mode, min_size, min_short);
+  cv::imdecode(bufmat, mode, &dec);
 #endif
 
   if (dec.channels() == 3) {
@@ -184,6 +366,31 @@ IMPROC_ERR_CODE_TYPE decode(const char *buf,
   return ret;
 }
 
+IMPROC_ERR_CODE_TYPE decodeCrop(const char *buf,
+                                size_t bufsize,
+                                const cv::Rect &rect,
+                                cv::Mat *result,
+                                int mode) {
+#ifdef WITH_TURBOJPEG
+  if (is_jpeg_format(buf, bufsize) &&
+      decodeJpegCrop(
+          buf, bufsize, mode != cv::IMREAD_GRAYSCALE, rect, result)) {
+    return IMPROC_OK;
+  }
+#endif
+  // decode the whole image if not supported
+  cv::Mat decoded;
+  IMPROC_ERR_CODE_TYPE ret = decode(buf, bufsize, &decoded, mode);
+  if (IMPROC_OK != ret) {
+    return ret;
+  }
+  // the size decoded may differ from the header by exif orientation
+  if ((rect & cv::Rect(0, 0, decoded.cols, decoded.rows)) != rect) {
+    return IMPROC_INVALID_PARAM;
+  }
+  return crop(decoded, rect, result);
+}
+
 IMPROC_ERR_CODE_TYPE resize(const cv::Mat &img,
                             const cv::Size &size,
                             cv::Mat *result,
@@ -235,6 +442,86 @@ IMPROC_ERR_CODE_TYPE flip(const cv::Mat &img, int flip_code, cv::Mat *result) {
   return ret;
 }
 
+IMPROC_ERR_CODE_TYPE adjustBrightness(const cv::Mat &img,
+                                      float factor,
+                                      cv::Mat *result) {
+  img.convertTo(*result, -1, factor, 0);
+  return result->empty() ? IMPROC_INVALID_PARAM : IMPROC_OK;
+}
+
+/**
+ * @brief mean of the gray image converted from 'img'
+ */
+static double grayMean(const cv::Mat &img) {
+  cv::Scalar m = cv::mean(img);
+  double gray = m[0];
+  if (img.channels() >= 3) {
+    gray = m[0] * 0.299 + m[1] * 0.587 + m[2] * 0.114;
+  }
+  return img.depth() == CV_8U ? floor(gray + 0.5) : gray;
+}
+
+IMPROC_ERR_CODE_TYPE adjustContrast(const cv::Mat &img,
+                                    float factor,
+                                    cv::Mat *result) {
+  // blend with a solid gray image of the mean
+  img.convertTo(*result, -1, factor, grayMean(img) * (1.0 - factor));
+  return result->empty() ? IMPROC_INVALID_PARAM : IMPROC_OK;
+}
+
+IMPROC_ERR_CODE_TYPE adjustSaturation(const cv::Mat &img,
+                                      float factor,
+                                      cv::Mat *result) {
+  if (img.channels() != 3) {  // no color
+    *result = img;
+    return IMPROC_OK;
+  }
+
+  cv::Mat gray;
+  cv::cvtColor(img, gray, cv::COLOR_RGB2GRAY);
+  cv::cvtColor(gray, gray, cv::COLOR_GRAY2RGB);
+  cv::addWeighted(img, factor, gray, 1.0 - factor, 0, *result);
+  return result->empty() ? IMPROC_INVALID_PARAM : IMPROC_OK;
+}
+
+IMPROC_ERR_CODE_TYPE adjustHue(const cv::Mat &img,
+                               float delta,
+                               cv::Mat *result) {
+  if (img.channels() != 3 ||
+      (img.depth() != CV_8U && img.depth() != CV_32F)) {
+    return IMPROC_INVALID_PARAM;
+  }
+
+  delta -= floor(delta);
+  int shift = static_cast<int>(delta * 180 + 0.5) % 180;
+  if (img.depth() == CV_8U && shift == 0) {
+    // converting to 8-bit HSV and back is lossy, so skip it
+    *result = img;
+    return IMPROC_OK;
+  }
+
+  cv::Mat hsv;
+  std::vector<cv::Mat> channels;
+  cv::cvtColor(img, hsv, cv::COLOR_RGB2HSV);
+  cv::split(hsv, channels);
+  if (img.depth() == CV_8U) {
+    // hue of uint8 images is in [0, 180)
+    cv::Mat lut(1, 256, CV_8U);
+    for (int i = 0; i < 256; i++) {
+      lut.at<uchar>(i) = static_cast<uchar>((i + shift) % 180);
+    }
+    cv::LUT(channels[0], lut, channels[0]);
+  } else {
+    // hue of float images is in [0, 360)
+    channels[0] += delta * 360;
+    cv::Mat wrapped = channels[0] >= 360;
+    cv::subtract(channels[0], 360, channels[0], wrapped);
+  }
+  cv::merge(channels, hsv);
+  cv::cvtColor(hsv, *result, cv::COLOR_HSV2RGB);
+  return result->empty() ? IMPROC_INVALID_PARAM : IMPROC_OK;
+}
+
 std::string mat2str(const cv::Mat &mat) {
   std::string result;
   size_t size = mat.total() * mat.elemSize();
@@ -249,29 +536,159 @@ cv::Mat str2mat(const std::string &str) {
 }
 
 int tochw(const cv::Mat &mat, std::string *outstr) {
+  outstr->resize(mat.total() * mat.elemSize());
+  return tochw(mat, &(*outstr)[0]);
+}
+
+int tochw(const cv::Mat &mat, void *dst) {
   if (mat.channels() == 1) {
-    int size = mat.total() * mat.elemSize();
-    outstr->resize(size);
-    std::memcpy((void *)outstr->data(), mat.data, size);
-  } else {
-    std::vector<cv::Mat> channels(mat.channels());
-    int imgsz = mat.rows * mat.cols;
-    cv::split(mat, channels);
-    size_t coppied = 0;
-    for (size_t i = 0; i < channels.size(); i++) {
-      const char *out = outstr->data() + i * imgsz;
-      size_t sz = channels[i].total() * channels[i].elemSize();
-      coppied += sz;
-      if (sz * channels.size() != outstr->size()) {
-        LOG(FATAL) << "invalid size[" << sz << "] of splits in tochw";
-        return -1;
-      } else if (coppied > outstr->size()) {
-        LOG(FATAL) << "invalid copy size[" << coppied << "] of splits in tochw";
-        return -2;
+    std::memcpy(dst, mat.data, mat.total() * mat.elemSize());
+    return 0;
+  }
+
+  // split the channels to planes in 'dst' without extra copies
+  size_t plane = mat.total() * mat.elemSize1();
+  std::vector<cv::Mat> channels;
+  for (int i = 0; i < mat.channels(); i++) {
+    channels.push_back(cv::Mat(
+        mat.rows, mat.cols, mat.depth(), static_cast<char *>(dst) + i * plane));
+  }
+  cv::split(mat, channels);
+  for (size_t i = 0; i < channels.size(); i++) {
+    if (channels[i].data != static_cast<uchar *>(dst) + i * plane) {
+      LOG(FATAL) << "invalid split[" << i << "] in tochw";
+      return -1;
+    }
+  }
+  return 0;
+}
+
+/**
+ * @brief convert a float to the bits of a half float with round-to-nearest-even
+ */
+static uint16_t floatToHalf(float f) {
+  uint32_t x = 0;
+  std::memcpy(&x, &f, sizeof(x));
+  uint16_t sign = (x >> 16) & 0x8000;
+  x &= 0x7fffffff;
+  if (x >= 0x7f800000) {  // inf or nan
+    return sign | 0x7c00 | (x > 0x7f800000 ? 0x200 : 0);
+  } else if (x >= 0x477ff000) {  // overflow to inf
+    return sign | 0x7c00;
+  } else if (x < 0x38800000) {  // subnormal or zero
+    float a = 0;
+    std::memcpy(&a, &x, sizeof(a));
+    return sign | static_cast<uint16_t>(nearbyintf(a * 16777216.0f));
+  }
+  // rebias the exponent and round the mantissa
+  x += 0xc8000fff + ((x >> 13) & 1);
+  return sign | static_cast<uint16_t>(x >> 13);
+}
+
+/**
+ * @brief make tables to map uint8 pixels of each channel
+ *        to 'v * alpha[c] + beta[c]'
+ */
+static bool makeNormLuts(int cn,
+                         const std::vector<float> &alpha,
+                         const std::vector<float> &beta,
+                         std::vector<std::vector<float> > *luts) {
+  if (alpha.size() != beta.size() ||
+      (alpha.size() != 1 && static_cast<int>(alpha.size()) != cn)) {
+    return false;
+  }
+
+  luts->assign(cn, std::vector<float>(256));
+  for (int c = 0; c < cn; c++) {
+    size_t k = alpha.size() == 1 ? 0 : c;
+    for (int v = 0; v < 256; v++) {
+      (*luts)[c][v] = v * alpha[k] + beta[k];
+    }
+  }
+  return true;
+}
+
+IMPROC_ERR_CODE_TYPE normalize(const cv::Mat &img,
+                               const std::vector<float> &alpha,
+                               const std::vector<float> &beta,
+                               cv::Mat *result) {
+  int cn = img.channels();
+  std::vector<std::vector<float> > luts;
+  if (!makeNormLuts(cn, alpha, beta, &luts) || cn > 4) {
+    return IMPROC_INVALID_PARAM;
+  }
+
+  if (img.depth() != CV_8U) {
+    cv::Scalar a;
+    cv::Scalar b;
+    for (int c = 0; c < cn; c++) {
+      a[c] = alpha.size() == 1 ? alpha[0] : alpha[c];
+      b[c] = beta.size() == 1 ? beta[0] : beta[c];
+    }
+    img.convertTo(*result, CV_32F);
+    cv::multiply(*result, a, *result);
+    cv::add(*result, b, *result);
+    return IMPROC_OK;
+  }
+
+  result->create(img.rows, img.cols, CV_32FC(cn));
+  for (int y = 0; y < img.rows; y++) {
+    const uchar *src = img.ptr<uchar>(y);
+    float *dst = result->ptr<float>(y);
+    for (int x = 0; x < img.cols; x++) {
+      for (int c = 0; c < cn; c++) {
+        dst[x * cn + c] = luts[c][src[x * cn + c]];
+      }
+    }
+  }
+  return IMPROC_OK;
+}
+
+template <typename T>
+static void lutToCHW(const cv::Mat &mat,
+                     const std::vector<std::vector<T> > &luts,
+                     T *dst) {
+  int cn = mat.channels();
+  size_t plane = mat.total();
+  for (int y = 0; y < mat.rows; y++) {
+    const uchar *src = mat.ptr<uchar>(y);
+    for (int c = 0; c < cn; c++) {
+      const T *lut = &luts[c][0];
+      T *out = dst + c * plane + static_cast<size_t>(y) * mat.cols;
+      for (int x = 0; x < mat.cols; x++) {
+        out[x] = lut[src[x * cn + c]];
       }
-      std::memcpy((void *)out, channels[i].data, sz);
     }
   }
+}
+
+int normalizeToCHW(const cv::Mat &mat,
+                   const std::vector<float> &alpha,
+                   const std::vector<float> &beta,
+                   bool to_half,
+                   void *dst) {
+  int cn = mat.channels();
+  // all pixels are uint8, so map them with a table for each channel
+  std::vector<std::vector<float> > luts;
+  if (mat.depth() != CV_8U || !makeNormLuts(cn, alpha, beta, &luts)) {
+    LOG(WARNING) << "invalid params for normalizeToCHW with depth["
+                 << mat.depth() << "] channels[" << cn << "] alpha["
+                 << alpha.size() << "] beta[" << beta.size() << "]";
+    return -1;
+  }
+
+  if (to_half) {
+    std::vector<std::vector<uint16_t> > half_luts(cn,
+                                                  std::vector<uint16_t>(256));
+    for (int c = 0; c < cn; c++) {
+      for (int v = 0; v < 256; v++) {
+        half_luts[c][v] = floatToHalf(luts[c][v]);
+      }
+    }
+    lutToCHW(mat, half_luts, static_cast<uint16_t *>(dst));
+  } else {
+    lutToCHW(mat, luts, static_cast<float *>(dst));
+  }
   return 0;
 }
 
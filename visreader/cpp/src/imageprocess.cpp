@@ -2,42 +2,45 @@
 #include "image_transformer.h"
 #include "image_util.h"
 #include "logger.h"
+#include "mat_arena.h"
 #include "util.h"
+#ifdef WITH_LUA
+#include "lua_op.h"
+#endif
 
 namespace vistool {
 
-static int process_resize(const KVConfHelper &conf,
+static int parse_resize(const KVConfHelper &conf, image_op_t *op) {
+  int resize_w = 0;
+  int resize_h = 0;
+  conf.get("interpolation", &op->interpolation, cv::INTER_LINEAR);
+  if (!conf.get("short_size", &op->short_size) &&
+      (!conf.get("resize_w", &resize_w) || !conf.get("resize_h", &resize_h))) {
+    LOG(WARNING) << "not found valid 'resize_w' or 'resize_h'";
+    return TRANS_ERR_RESIZE_INVALID_PARAM;
+  }
+  op->size = cv::Size(resize_w, resize_h);
+  return 0;
+}
+
+static int process_resize(const image_op_t &op,
                           const cv::Mat &input,
                           cv::Mat *result,
                           std::string *errmsg,
                           BufLogger *logger) {
   int ret = 0;
-  int img_w = input.cols;
-  int img_h = input.rows;
-
-  int resize_w = 0;
-  int resize_h = 0;
-  int short_size = 0;
-  int interpo = -1;
-
-  conf.get("interpolation", &interpo, cv::INTER_LINEAR);
-
-  logger->append("[interpo:%d]", &interpo);
-  if (conf.get("short_size", &short_size)) {
-    float percent = static_cast<float>(short_size) / std::min(img_w, img_h);
-    resize_w = static_cast<int>(round(img_w * percent));
-    resize_h = static_cast<int>(round(img_h * percent));
-    logger->append("[short_size:%d]", &short_size);
-  } else if (!conf.get("resize_w", &resize_w) ||
-             !conf.get("resize_h", &resize_h)) {
-    ret = TRANS_ERR_RESIZE_INVALID_PARAM;
-    *errmsg = formatString("not found valid 'resize_w' or 'resize_h'");
-    return ret;
+  cv::Size size = op.size;
+  logger->append("[interpo:%d]", op.interpolation);
+  if (op.short_size > 0) {
+    float percent =
+        static_cast<float>(op.short_size) / std::min(input.cols, input.rows);
+    size.width = static_cast<int>(round(input.cols * percent));
+    size.height = static_cast<int>(round(input.rows * percent));
+    logger->append("[short_size:%d]", op.short_size);
   }
-  logger->append("[resize:{w:%d,h:%d}]", resize_w, resize_h);
+  logger->append("[resize:{w:%d,h:%d}]", size.width, size.height);
 
-  cv::Size size(resize_w, resize_h);
-  ret = resize(input, size, result, interpo);
+  ret = resize(input, size, result, op.interpolation);
   if (ret || result->empty()) {
     *errmsg = formatString("failed to resize image with ret[%d]", ret);
     ret = TRANS_ERR_RESIZE_INVALID_PARAM;
@@ -46,41 +49,47 @@ static int process_resize(const KVConfHelper &conf,
   return ret;
 }
 
-static int process_crop(const KVConfHelper &conf,
-                        const cv::Mat &input,
-                        cv::Mat *result,
-                        std::string *errmsg,
-                        BufLogger *logger) {
-  int ret = 0;
+static int parse_crop(const KVConfHelper &conf, image_op_t *op) {
   int crop_x = 0;
   int crop_y = 0;
   int crop_w = 0;
   int crop_h = 0;
-
   int crop_center = 0;
-
-  int img_h = input.rows;
-  int img_w = input.cols;
   if (conf.get("crop_center", &crop_center) && conf.get("crop_w", &crop_w) &&
       conf.get("crop_h", &crop_h)) {
-    logger->append("[w:%d,h:%d,crop_center:%d]", crop_w, crop_h, crop_center);
-    if (crop_center) {
-      crop_x = (img_w - crop_w) / 2;
-      crop_y = (img_h - crop_h) / 2;
-    } else {
-      crop_x = randInt(0, img_w - crop_w);
-      crop_y = randInt(0, img_h - crop_h);
-    }
+    op->crop_center = crop_center ? 1 : 0;
   } else if (!conf.get("crop_x", &crop_x) || !conf.get("crop_y", &crop_y) ||
              !conf.get("crop_w", &crop_w) || !conf.get("crop_h", &crop_h)) {
-    *errmsg = formatString("not found valid 'crop_[x|y|w|h]' params");
-    ret = TRANS_ERR_CROP_INVALID_PARAM;
-    return ret;
+    LOG(WARNING) << "not found valid 'crop_[x|y|w|h]' params";
+    return TRANS_ERR_CROP_INVALID_PARAM;
+  }
+  op->rect = cv::Rect(crop_x, crop_y, crop_w, crop_h);
+  return 0;
+}
+
+static int process_crop(const image_op_t &op,
+                        const cv::Mat &input,
+                        cv::Mat *result,
+                        std::string *errmsg,
+                        BufLogger *logger) {
+  int ret = 0;
+  cv::Rect rect = op.rect;
+  if (op.crop_center >= 0) {
+    logger->append("[w:%d,h:%d,crop_center:%d]",
+                   rect.width,
+                   rect.height,
+                   op.crop_center);
+    if (op.crop_center) {
+      rect.x = (input.cols - rect.width) / 2;
+      rect.y = (input.rows - rect.height) / 2;
+    } else {
+      rect.x = randInt(0, input.cols - rect.width);
+      rect.y = randInt(0, input.rows - rect.height);
+    }
   }
 
   logger->append(
-      "[crop:{x:%d,y:%d,w:%d,h:%d}]", crop_x, crop_y, crop_w, crop_h);
-  cv::Rect rect(crop_x, crop_y, crop_w, crop_h);
+      "[crop:{x:%d,y:%d,w:%d,h:%d}]", rect.x, rect.y, rect.width, rect.height);
   ret = crop(input, rect, result);
   if (ret || result->empty()) {
     *errmsg = formatString("failed to crop image with ret[%d]", ret);
@@ -89,43 +98,39 @@ static int process_crop(const KVConfHelper &conf,
   return ret;
 }
 
-static int process_random_crop(const KVConfHelper &conf,
-                               const cv::Mat &input,
-                               cv::Mat *result,
-                               std::string *errmsg,
-                               BufLogger *logger) {
-  int img_h = input.rows;
-  int img_w = input.cols;
-  int ret = 0;
-
-  std::vector<int> final_size;  // final size for the cropped image
-  std::vector<float> scale;
-  std::vector<float> ratio;
-
-  if (!conf.get("scale", &scale) || scale.size() != 2) {
-    ret = TRANS_ERR_RAND_CROP_INVALID_PARAM;
-    *errmsg = "not found 'scale' param";
-    return ret;
+/**
+ * @brief parse params of random crop from 'conf'
+ */
+static int parse_rand_crop(const KVConfHelper &conf, image_op_t *op) {
+  std::vector<int> size;  // final size for the cropped image
+  if (!conf.get("scale", &op->scale) || op->scale.size() != 2) {
+    LOG(WARNING) << "not found 'scale' param";
+    return TRANS_ERR_RAND_CROP_INVALID_PARAM;
   }
-  logger->append("[scale:%.2f,%.2f]", scale[0], scale[1]);
 
-  if (!conf.get("ratio", &ratio) || ratio.size() != 2) {
-    *errmsg = "not found valid 'ratio' param";
-    ret = TRANS_ERR_RAND_CROP_INVALID_PARAM;
-    return ret;
+  if (!conf.get("ratio", &op->ratio) || op->ratio.size() != 2) {
+    LOG(WARNING) << "not found valid 'ratio' param";
+    return TRANS_ERR_RAND_CROP_INVALID_PARAM;
   }
-  logger->append("[ratio:%.2f,%.2f]", ratio[0], ratio[1]);
 
-  if (!conf.get("final_size", &final_size) || final_size.size() != 2 ||
-      final_size[0] * final_size[1] <= 0) {
-    *errmsg = "not found valid 'final_size'";
-    ret = TRANS_ERR_RAND_CROP_INVALID_PARAM;
-    return ret;
+  if (!conf.get("final_size", &size) || size.size() != 2 ||
+      size[0] * size[1] <= 0) {
+    LOG(WARNING) << "not found valid 'final_size'";
+    return TRANS_ERR_RAND_CROP_INVALID_PARAM;
   }
-  int final_w = final_size[0];
-  int final_h = final_size[1];
-  logger->append("[final_size:%d,%d]", final_w, final_h);
+  op->final_size = cv::Size(size[0], size[1]);
+  conf.get("interpolation", &op->interpolation, cv::INTER_LANCZOS4);
+  conf.get("mode", &op->mode, cv::IMREAD_UNCHANGED);
+  return 0;
+}
 
+/**
+ * @brief pick a random crop window in an image with size 'img_w x img_h'
+ */
+static cv::Rect rand_crop_rect(int img_w,
+                               int img_h,
+                               const std::vector<float> &scale,
+                               const std::vector<float> &ratio) {
   float aspect_ratio = sqrt(randFloat(ratio[0], ratio[1]));
   float w = 1.0 * aspect_ratio;
   float h = 1.0 / aspect_ratio;
@@ -143,55 +148,148 @@ static int process_random_crop(const KVConfHelper &conf,
 
   int i = randInt(0, img_w - int_w);
   int j = randInt(0, img_h - int_h);
+  return cv::Rect(i, j, int_w, int_h);
+}
 
-  logger->append("[crop_rect:{x:%d,y:%d,w:%d,h:%d}", i, j, int_w, int_h);
-  cv::Rect rect(i, j, int_w, int_h);
-  cv::Mat cropped;
-  ret = crop(input, rect, &cropped);
-  if (ret || cropped.empty()) {
-    *errmsg = formatString("rand_crop.crop failed with ret[%d]", ret);
+/**
+ * @brief resize the cropped image to 'final_size'
+ */
+static int rand_crop_resize(const image_op_t &op,
+                            const cv::Mat &cropped,
+                            cv::Mat *result,
+                            std::string *errmsg,
+                            BufLogger *logger) {
+  logger->append("[resize:w:%d,h:%d,interpo:%d]",
+                 op.final_size.width,
+                 op.final_size.height,
+                 op.interpolation);
+  int ret = resize(cropped, op.final_size, result, op.interpolation);
+  if (ret || result->empty()) {
+    *errmsg = formatString("rand_crop.resize failed with ret[%d]", ret);
     ret = TRANS_ERR_RAND_CROP_INVALID_PARAM;
-    return ret;
   }
+  return ret;
+}
 
-  cv::Size size(final_w, final_h);
-  int interpo = -1;
-  conf.get("interpolation", &interpo, cv::INTER_LANCZOS4);
-  logger->append("[resize:w:%d,h:%d,interpo:%d]", final_w, final_h, interpo);
-  ret = resize(cropped, size, result, interpo);
-  if (ret || result->empty()) {
-    *errmsg = formatString("rand_crop.resize failed with ret[%d]", ret);
+static int process_random_crop(const image_op_t &op,
+                               const cv::Mat &input,
+                               cv::Mat *result,
+                               std::string *errmsg,
+                               BufLogger *logger) {
+  cv::Rect rect = rand_crop_rect(input.cols, input.rows, op.scale, op.ratio);
+  logger->append("[crop_rect:{x:%d,y:%d,w:%d,h:%d}",
+                 rect.x,
+                 rect.y,
+                 rect.width,
+                 rect.height);
+  // resized from a view of the window, so no need to copy it
+  cv::Mat cropped = input(rect);
+  return rand_crop_resize(op, cropped, result, errmsg, logger);
+}
+
+static int parse_decode(const KVConfHelper &conf, image_op_t *op) {
+  int min_w = 0;
+  int min_h = 0;
+  conf.get("mode", &op->mode, cv::IMREAD_UNCHANGED);
+  conf.get("min_w", &min_w, 0);
+  conf.get("min_h", &min_h, 0);
+  conf.get("min_short", &op->min_short, 0);
+  op->min_size = cv::Size(min_w, min_h);
+  return 0;
+}
+
+static int process_decode(const image_op_t &op,
+                          const char *data,
+                          size_t len,
+                          cv::Mat *result,
+                          std::string *errmsg,
+                          BufLogger *logger) {
+  logger->append("[mode:%d,min_size:{w:%d,h:%d,short:%d}]",
+                 op.mode,
+                 op.min_size.width,
+                 op.min_size.height,
+                 op.min_short);
+  return decode(data, len, result, op.mode, op.min_size, op.min_short);
+}
+
+/**
+ * @brief decode and random crop an image, the crop window is picked
+ *        with the size in jpeg header when turbojpeg enabled, so only
+ *        this window is decoded, otherwise with the size decoded
+ */
+static int process_decode_random_crop(const image_op_t &op,
+                                      const char *data,
+                                      size_t len,
+                                      cv::Mat *result,
+                                      std::string *errmsg,
+                                      BufLogger *logger) {
+  int ret = 0;
+  logger->append("[mode:%d]", op.mode);
+
+  cv::Rect rect;
+  cv::Mat cropped;
+  bool picked = false;
+#ifdef WITH_TURBOJPEG
+  // jpeg is decoded by turbojpeg without exif orientation like 'decode',
+  // so the size in header is the size decoded
+  int img_w = 0;
+  int img_h = 0;
+  if (jpegSize(data, len, &img_w, &img_h)) {
+    rect = rand_crop_rect(img_w, img_h, op.scale, op.ratio);
+    ret = decodeCrop(data, len, rect, &cropped, op.mode);
+    picked = true;
+  }
+#endif
+  if (!picked) {
+    // opencv may rotate jpeg by exif orientation, so decode the whole
+    // image and pick the window with its decoded size
+    cv::Mat decoded;
+    decoded.allocator = result->allocator;
+    ret = decode(data, len, &decoded, op.mode);
+    if (!ret && !decoded.empty()) {
+      rect = rand_crop_rect(decoded.cols, decoded.rows, op.scale, op.ratio);
+      cropped = decoded(rect);
+    }
+  }
+  logger->append("[crop_rect:{x:%d,y:%d,w:%d,h:%d}",
+                 rect.x,
+                 rect.y,
+                 rect.width,
+                 rect.height);
+  if (ret || cropped.empty()) {
+    *errmsg = formatString("decode_random_crop failed with ret[%d]", ret);
     ret = TRANS_ERR_RAND_CROP_INVALID_PARAM;
     return ret;
   }
 
-  return ret;
+  return rand_crop_resize(op, cropped, result, errmsg, logger);
+}
+
+static int parse_rotate(const KVConfHelper &conf, image_op_t *op) {
+  if (!conf.get("random_range", &op->random_range) &&
+      !conf.get("angle", &op->angle)) {
+    LOG(WARNING) << "rotate op not found valid 'random_range' param";
+    return TRANS_ERR_ROTATE_INVALID_PARAM;
+  }
+  conf.get("resample", &op->interpolation, cv::INTER_NEAREST);
+  return 0;
 }
 
-static int process_rotate(const KVConfHelper &conf,
+static int process_rotate(const image_op_t &op,
                           const cv::Mat &input,
                           cv::Mat *result,
                           std::string *errmsg,
                           BufLogger *logger) {
   int ret = 0;
-  int angle = 0;
-  int random_range = 0;
-  int resample = -1;
-  if (conf.get("random_range", &random_range)) {
-    angle = randInt(-random_range, random_range);
-    logger->append("[random_range:%d]", random_range);
-  } else if (!conf.get("angle", &angle)) {
-    *errmsg = formatString(
-        "rotate op not found valid "
-        "'random_range' param");
-    ret = TRANS_ERR_ROTATE_INVALID_PARAM;
-    return ret;
+  int angle = op.angle;
+  if (op.random_range >= 0) {
+    angle = randInt(-op.random_range, op.random_range);
+    logger->append("[random_range:%d]", op.random_range);
   }
   logger->append("[angle:%d]", angle);
 
-  conf.get("resample", &resample, cv::INTER_NEAREST);
-  logger->append("[resample:%d]", resample);
-  ret = rotate(input, static_cast<float>(angle), result, resample);
+  logger->append("[resample:%d]", op.interpolation);
+  ret = rotate(input, static_cast<float>(angle), result, op.interpolation);
   if (ret || result->empty()) {
     *errmsg = formatString("failed to rotate image with ret[%d]", ret);
     ret = TRANS_ERR_RAND_CROP_INVALID_PARAM;
@@ -199,28 +297,28 @@ static int process_rotate(const KVConfHelper &conf,
   return ret;
 }
 
-static int process_flip(const KVConfHelper &conf,
+static int parse_flip(const KVConfHelper &conf, image_op_t *op) {
+  conf.get("random", &op->random, 0);
+  if (!conf.get("flip_code", &op->flip_code)) {
+    LOG(WARNING) << "not found valid 'flip_code'";
+    return TRANS_ERR_FLIP_INVALID_PARAM;
+  }
+  return 0;
+}
+
+static int process_flip(const image_op_t &op,
                         const cv::Mat &input,
                         cv::Mat *result,
                         std::string *errmsg,
                         BufLogger *logger) {
   int ret = 0;
-  int flip_code = 0;
-  int random = 0;
-
-  conf.get("random", &random, 0);
-  if (!conf.get("flip_code", &flip_code)) {
-    ret = TRANS_ERR_FLIP_INVALID_PARAM;
-    *errmsg = formatString("not found valid 'flip_code'");
-    return ret;
-  }
-  if (random && !randInt(0, 1)) {  // no need to flip
+  if (op.random && !randInt(0, 1)) {  // no need to flip
     *result = input;
     return ret;
   }
 
-  logger->append("[random:%d, flip_code:%d]", random, flip_code);
-  ret = flip(input, flip_code, result);
+  logger->append("[random:%d, flip_code:%d]", op.random, op.flip_code);
+  ret = flip(input, op.flip_code, result);
   if (ret || result->empty()) {
     *errmsg = formatString("failed to resize image with ret[%d]", ret);
     ret = TRANS_ERR_FLIP_INVALID_PARAM;
@@ -229,39 +327,214 @@ static int process_flip(const KVConfHelper &conf,
   return ret;
 }
 
-typedef int processor_t(const KVConfHelper &conf,
+static int parse_normalize(const KVConfHelper &conf, image_op_t *op) {
+  if (!conf.get("alpha", &op->alpha) || !conf.get("beta", &op->beta)) {
+    LOG(WARNING) << "not found valid 'alpha' or 'beta'";
+    return TRANS_ERR_NORMALIZE_INVALID_PARAM;
+  }
+  return 0;
+}
+
+static int process_normalize(const image_op_t &op,
+                             const cv::Mat &input,
+                             cv::Mat *result,
+                             std::string *errmsg,
+                             BufLogger *logger) {
+  logger->append(
+      "[alpha_num:%d,beta_num:%d]", op.alpha.size(), op.beta.size());
+  int ret = normalize(input, op.alpha, op.beta, result);
+  if (ret || result->empty()) {
+    *errmsg = formatString("failed to normalize image with ret[%d]", ret);
+    ret = TRANS_ERR_NORMALIZE_INVALID_PARAM;
+  }
+  return ret;
+}
+
+typedef IMPROC_ERR_CODE_TYPE(adjust_func_t)(const cv::Mat &img,
+                                            float factor,
+                                            cv::Mat *result);
+
+/**
+ * @brief color jitters which can be applied in random order
+ */
+struct color_jitter_t {
+  const char *name;
+  adjust_func_t *adjust;
+};
+
+static const int g_color_jitter_num = 4;
+
+static const color_jitter_t g_color_jitters[g_color_jitter_num] = {
+    {"brightness", &adjustBrightness},
+    {"contrast", &adjustContrast},
+    {"saturation", &adjustSaturation},
+    {"hue", &adjustHue},
+};
+
+/**
+ * @brief adjust 'input' by 'jitter' with a factor drawn from 'range'
+ */
+static int color_jitter(const color_jitter_t &jitter,
+                        const std::vector<float> &range,
                         const cv::Mat &input,
                         cv::Mat *result,
                         std::string *errmsg,
-                        BufLogger *logger);
-
-class ProcessorMgr {
-public:
-  ProcessorMgr() {
-    _processors["resize"] = &process_resize;
-    _processors["crop"] = &process_crop;
-    _processors["random_crop"] = &process_random_crop;
-    _processors["rotate"] = &process_rotate;
-    _processors["flip"] = &process_flip;
-  }
-  ~ProcessorMgr() { _processors.clear(); }
-
-  processor_t *get(const std::string &op_name) {
-    for (auto &v : _processors) {
-      if (v.first == op_name) {
-        return v.second;
+                        BufLogger *logger) {
+  float factor = randFloat(range[0], range[1]);
+  logger->append("[%s:%.3f]", jitter.name, factor);
+  int ret = jitter.adjust(input, factor, result);
+  if (ret || result->empty()) {
+    *errmsg = formatString(
+        "failed to adjust %s of image with ret[%d]", jitter.name, ret);
+    ret = TRANS_ERR_COLOR_INVALID_PARAM;
+  }
+  return ret;
+}
+
+/**
+ * @brief parse the range of a single color jitter which is 'op->name'
+ */
+static int parse_color(const KVConfHelper &conf, image_op_t *op) {
+  std::vector<float> range;
+  for (int i = 0; i < g_color_jitter_num; i++) {
+    if (op->name == g_color_jitters[i].name) {
+      if (!conf.get("range", &range) || range.size() != 2) {
+        LOG(WARNING) << "not found valid 'range' for " << op->name;
+        return TRANS_ERR_COLOR_INVALID_PARAM;
       }
+      op->jitters.push_back(i);
+      op->ranges.push_back(range);
     }
-    return NULL;
   }
+  return 0;
+}
 
-private:
-  std::map<std::string, processor_t *> _processors;
+/**
+ * @brief parse ranges of color jitters found in 'conf'
+ */
+static int parse_distort_color(const KVConfHelper &conf, image_op_t *op) {
+  for (int i = 0; i < g_color_jitter_num; i++) {
+    std::vector<float> range;
+    if (conf.get(g_color_jitters[i].name, &range)) {
+      if (range.size() != 2) {
+        LOG(WARNING) << "invalid range for " << g_color_jitters[i].name;
+        return TRANS_ERR_COLOR_INVALID_PARAM;
+      }
+      op->jitters.push_back(i);
+      op->ranges.push_back(range);
+    }
+  }
+  return 0;
+}
+
+/**
+ * @brief apply color jitters of 'op' in a random order,
+ *        a single jitter draws no random number for the order
+ */
+static int process_distort_color(const image_op_t &op,
+                                 const cv::Mat &input,
+                                 cv::Mat *result,
+                                 std::string *errmsg,
+                                 BufLogger *logger) {
+  int order[g_color_jitter_num];
+  int num = static_cast<int>(op.jitters.size());
+  for (int i = 0; i < num; i++) {
+    order[i] = i;
+  }
+
+  // shuffle the jitters
+  for (int i = num - 1; i > 0; i--) {
+    int j = randInt(0, i);
+    std::swap(order[i], order[j]);
+  }
+
+  *result = input;
+  for (int i = 0; i < num; i++) {
+    cv::Mat in = *result;
+    int k = order[i];
+    int ret = color_jitter(g_color_jitters[op.jitters[k]],
+                           op.ranges[k],
+                           in,
+                           result,
+                           errmsg,
+                           logger);
+    if (ret) {
+      return ret;
+    }
+  }
+  return 0;
+}
+
+/**
+ * @brief name of numpy dtype for elements of cv::Mat with 'depth'
+ */
+static const char *depth2dtype(int depth) {
+  switch (depth) {
+    case CV_8U:
+      return "uint8";
+    case CV_8S:
+      return "int8";
+    case CV_16U:
+      return "uint16";
+    case CV_16S:
+      return "int16";
+    case CV_32S:
+      return "int32";
+    case CV_32F:
+      return "float32";
+    default:
+      return "float64";
+  }
+}
+
+typedef int parse_func_t(const KVConfHelper &conf, image_op_t *op);
+
+/**
+ * @brief definition of an operator which is compiled by 'parse',
+ *        ops with both 'decode' and 'process' take encoded images
+ *        only when they are the first op
+ */
+struct op_def_t {
+  const char *name;
+  parse_func_t *parse;
+  decode_func_t *decode;
+  process_func_t *process;
 };
-static ProcessorMgr g_processor_mgr;
+
+static const op_def_t g_op_defs[] = {
+    {"decode", &parse_decode, &process_decode, NULL},
+    {"decode_random_crop",
+     &parse_rand_crop,
+     &process_decode_random_crop,
+     NULL},
+    {"resize", &parse_resize, NULL, &process_resize},
+    {"crop", &parse_crop, NULL, &process_crop},
+    {"random_crop", &parse_rand_crop, NULL, &process_random_crop},
+    {"rotate", &parse_rotate, NULL, &process_rotate},
+    {"flip", &parse_flip, NULL, &process_flip},
+    {"normalize", &parse_normalize, NULL, &process_normalize},
+    {"brightness", &parse_color, NULL, &process_distort_color},
+    {"contrast", &parse_color, NULL, &process_distort_color},
+    {"saturation", &parse_color, NULL, &process_distort_color},
+    {"hue", &parse_color, NULL, &process_distort_color},
+    {"distort_color", &parse_distort_color, NULL, &process_distort_color},
+#ifdef WITH_LUA
+    {"lua_op", &parse_lua_op, &decode_lua_op, &process_lua_op},
+#endif
+};
+
+static const op_def_t *find_op_def(const std::string &op_name) {
+  for (size_t i = 0; i < sizeof(g_op_defs) / sizeof(g_op_defs[0]); i++) {
+    if (op_name == g_op_defs[i].name) {
+      return &g_op_defs[i];
+    }
+  }
+  return NULL;
+}
 
 int ImageProcess::init(const ops_conf_t &ops) {
   _swapaxis = 0;
+  _normalize = false;
   int op_num = 0;
   for (auto &op_conf : ops) {
     KVConfHelper confhelper(op_conf);
@@ -273,6 +546,18 @@ int ImageProcess::init(const ops_conf_t &ops) {
     op_num++;
     if (opname == "tochw") {
       confhelper.get("value", &_swapaxis, 0);
+    } else if (opname == "normalize_to_chw") {
+      // applied to the output after all other ops
+      std::string dtype = confhelper.get("dtype");
+      if (!confhelper.get("alpha", &_alpha) ||
+          !confhelper.get("beta", &_beta) || _alpha.empty() ||
+          _alpha.size() != _beta.size() ||
+          (dtype != "float32" && dtype != "float16")) {
+        LOG(FATAL) << "invalid conf for operator:" << opname;
+        return -2;
+      }
+      _normalize = true;
+      _to_half = dtype == "float16";
     } else {
       if (0 != this->add_op(opname, op_conf)) {
         LOG(FATAL) << "failed to add operator:" << opname;
@@ -284,6 +569,21 @@ int ImageProcess::init(const ops_conf_t &ops) {
     LOG(FATAL) << "no valid operator setted";
     return -3;
   }
+
+  // stats of each op, writing the output and the whole process
+  std::vector<std::string> names;
+  for (size_t i = 0; i < _ops.size(); i++) {
+    names.push_back(_ops[i].name);
+  }
+  if (_normalize) {
+    names.push_back("normalize_to_chw");
+  } else if (_swapaxis) {
+    names.push_back("tochw");
+  } else {
+    names.push_back("output");
+  }
+  names.push_back("total");
+  _stats.init(names);
   return 0;
 }
 
@@ -292,44 +592,52 @@ int ImageProcess::process(const transformer_input_data_t &input,
   int err_no = TRANS_ERR_OK;
   std::string err_msg = "";
   cv::Mat result;
+  cv::MatAllocator *arena = _use_arena ? MatArena::thread_arena() : NULL;
 
-  const char *input_img = &input.data[0];
-  size_t input_len = input.data.size();
+  const char *input_img = input.image();
+  size_t input_len = input.image_size();
+  int64_t process_ts = now_usec();
   BufLogger logger;
   logger.append("[process][input:{id:%d,size:%d}]", input.id, input_len);
   output.id = input.id;
   output.label = input.label;
+  if (input.seed >= 0) {
+    // make random ops on this sample not depend on the thread scheduling
+    seedRand(static_cast<uint64_t>(input.seed));
+  }
 
+  size_t op_index = 0;
+  int64_t start_ts = 0;
   try {
     for (size_t i = 0; i < _ops.size(); i++) {
-      KVConfHelper conf(_ops[i]);
-      const std::string op_name = conf.get("op_name");
-      logger.append("{[op:%s]", op_name.c_str());
-      int64_t start_ts = now_usec();
-      if (op_name == "decode") {
-        int mode = 0;
-        conf.get("mode", &mode, cv::IMREAD_UNCHANGED);
-        logger.append("[mode:%d]", mode);
-        err_no = decode(input_img, input_len, &result, mode);
+      const image_op_t &op = _ops[i];
+      logger.append("{[op:%s]", op.name.c_str());
+      op_index = i;
+      start_ts = now_usec();
+      if (op.decode) {
+        result.allocator = arena;
+        err_no =
+            op.decode(op, input_img, input_len, &result, &err_msg, &logger);
       } else {
         cv::Mat in = result;
         result = cv::Mat();
-        processor_t *processor = g_processor_mgr.get(op_name);
-        if (processor) {
-          err_no = processor(conf, in, &result, &err_msg, &logger);
-        } else {
-          err_no = TRANS_ERR_INVALID_OP_NAME;
-        }
+        result.allocator = arena;
+        err_no = op.process(op, in, &result, &err_msg, &logger);
       }
 
-      int64_t op_cost = (now_usec() - start_ts) / 1000;
-      logger.append(
-          "ret:%d,elenum:%d,cost:%lums]}", err_no, result.total(), op_cost);
+      int64_t op_cost = now_usec() - start_ts;
+      _stats.add(i,
+                 op_cost,
+                 err_no || !result.empty() ? err_no : TRANS_ERR_NO_OUTPUT);
+      logger.append("ret:%d,elenum:%d,cost:%lums]}",
+                    err_no,
+                    result.total(),
+                    op_cost / 1000);
       if (err_no || result.empty()) {
         LOG(WARNING) << formatString(
             "failed to execute op[%s] "
             "with err_no[%d]",
-            op_name.c_str(),
+            op.name.c_str(),
             err_no);
         if (!err_no) {
           err_no = TRANS_ERR_NO_OUTPUT;
@@ -341,27 +649,48 @@ int ImageProcess::process(const transformer_input_data_t &input,
     err_no = TRANS_ERR_LOGICERROR_EXCEPTION;
     err_msg = formatString("fatal logic error:[%s]", e.what());
     LOG(WARNING) << err_msg;
+    _stats.add(op_index, now_usec() - start_ts, err_no);
   }
 
   output.err_no = err_no;
   output.err_msg = err_msg;
   if (!err_no) {
+    start_ts = now_usec();
     size_t size = result.total() * result.elemSize();
-    output.data.resize(size);
-    if (_swapaxis) {
+    if (_normalize) {
+      output.dtype = _to_half ? "float16" : "float32";
+      size *= _to_half ? sizeof(uint16_t) : sizeof(float);
+    }
+    char *buf = output.alloc(size);
+    if (_normalize) {
       output.shape.push_back(result.channels());
       output.shape.push_back(result.rows);
       output.shape.push_back(result.cols);
-      tochw(result, &output.data);
+      if (normalizeToCHW(result, _alpha, _beta, _to_half, buf) != 0) {
+        output.err_no = TRANS_ERR_NORMALIZE_INVALID_PARAM;
+        output.err_msg = "failed to normalize the output";
+        output.dtype = "uint8";
+        output.shape.clear();
+        output.data.assign(input_img, input_len);
+      }
+    } else if (_swapaxis) {
+      output.dtype = depth2dtype(result.depth());
+      output.shape.push_back(result.channels());
+      output.shape.push_back(result.rows);
+      output.shape.push_back(result.cols);
+      tochw(result, buf);
     } else {
+      output.dtype = depth2dtype(result.depth());
       output.shape.push_back(result.rows);
       output.shape.push_back(result.cols);
       output.shape.push_back(result.channels());
-      std::memcpy(&output.data[0], result.data, size);
+      std::memcpy(buf, result.data, size);
     }
+    _stats.add(_ops.size(), now_usec() - start_ts, output.err_no);
   } else {
     output.data.assign(input_img, input_len);
   }
+  _stats.add(_ops.size() + 1, now_usec() - process_ts, output.err_no);
 
   logger.append("[output:{size:%d,err_no:%d,err_msg:[%s]}]",
                 output.data.size(),
@@ -373,19 +702,36 @@ int ImageProcess::process(const transformer_input_data_t &input,
 
 int ImageProcess::add_op(const std::string &op_name, const kv_conf_t &conf) {
   LOG(INFO) << "ImageTransformer::add_op(" << op_name << ")";
-  if (op_name != "decode" && !g_processor_mgr.get(op_name)) {
+  const op_def_t *def = find_op_def(op_name);
+  if (!def) {
     LOG(WARNING) << "not support this op_name[" << op_name << "]";
     return -2;
   }
 
   kv_conf_const_iter_t it = conf.begin();
-  kv_conf_t op_conf;
-  op_conf["op_name"] = op_name;
   for (; it != conf.end(); ++it) {
     LOG(INFO) << "\"" << it->first << "\": \"" << it->second << "\"";
-    op_conf[it->first] = it->second;
   }
-  _ops.push_back(op_conf);
+
+  // parse params only once here instead of for each image
+  image_op_t op;
+  op.name = op_name;
+  op.decode = def->decode;
+  op.process = def->process;
+  if (op.decode && op.process) {
+    if (_ops.empty()) {
+      op.process = NULL;
+    } else {
+      op.decode = NULL;
+    }
+  }
+  int ret = def->parse(KVConfHelper(conf), &op);
+  if (ret) {
+    LOG(WARNING) << "invalid params for op[" << op_name << "] with ret["
+                 << ret << "]";
+    return -3;
+  }
+  _ops.push_back(op);
   LOG(INFO) << "succeed to add " << _ops.size() << " ops into this transformer";
   return 0;
 }
@@ -0,0 +1,118 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+#include "include/lua_op.h"
+
+#include <string>
+#include <vector>
+
+#include "include/logger.h"
+#include "include/lua_util.h"
+#include "include/util.h"
+
+namespace vistool {
+
+typedef std::vector<cv::Mat> lua_param_type_t;
+
+int parse_lua_op(const KVConfHelper &conf, image_op_t *op) {
+  std::string lua_script = conf.get("lua_fname");
+  bool isfile = true;
+  if (lua_script == "") {
+    lua_script = conf.get("lua_code");
+    isfile = false;
+  }
+  if (lua_script == "") {
+    LOG(WARNING) << "not found any 'lua_fname' or 'lua_code' in 'lua_op'";
+    return -1;
+  }
+
+  int tochw = 0;
+  conf.get("tochw", &tochw, 0);
+  if (tochw) {
+    LOG(WARNING) << "'tochw' of 'lua_op' is ignored in a chain of ops, "
+                 << "use 'tochw' op instead";
+  }
+
+  // one state for each thread by default
+  int state_num = 0;
+  conf.get("state_num", &state_num, state_num);
+  LuaStateMgr *mgr = LuaStateMgr::create(lua_script, isfile, state_num);
+  if (!mgr) {
+    return -2;
+  }
+  op->lua.reset(mgr, LuaStateMgr::destroy);
+  return 0;
+}
+
+/*
+ * call 'lua_main' with '{input, label}' like 'LuacvProcess', the label
+ * is empty as ops in 'ImageProcess' only see images
+ */
+static int call_lua_main(const image_op_t &op,
+                         const cv::Mat &input,
+                         cv::Mat *result,
+                         std::string *errmsg,
+                         BufLogger *logger) {
+  ScopedState scopped_state(op.lua.get());
+  kaguya::State state(scopped_state.value());
+
+  lua_param_type_t lua_inputs;
+  lua_inputs.push_back(input);
+  lua_inputs.push_back(cv::Mat());
+
+  int err_no = TRANS_ERR_OK;
+  try {
+    lua_param_type_t lua_outputs =
+        state["lua_main"].call<lua_param_type_t>(lua_inputs);
+    if (lua_outputs.empty()) {
+      err_no = TRANS_ERR_LUA_INVALID_OUTPUT;
+      *errmsg = "invalid lua output[0]";
+    } else {
+      *result = lua_outputs[0];
+    }
+  } catch (kaguya::LuaException &e) {
+    err_no = TRANS_ERR_LUA_EXCEPTION;
+    *errmsg = formatString("lua exception:[%s]", e.what());
+  } catch (kaguya::KaguyaException &e) {
+    err_no = TRANS_ERR_LUA_KAGUYA_EXCEPTION;
+    *errmsg = formatString("kaguya exception:[%s]", e.what());
+  }
+
+  // mats referred by lua are freed only after collected
+  state.garbageCollect();
+  logger->append("used_mem:%dKB,", state.useKBytes());
+  return err_no;
+}
+
+int decode_lua_op(const image_op_t &op,
+                  const char *data,
+                  size_t len,
+                  cv::Mat *result,
+                  std::string *errmsg,
+                  BufLogger *logger) {
+  cv::Mat input(1, len, CV_8U, const_cast<char *>(data));
+  return call_lua_main(op, input, result, errmsg, logger);
+}
+
+int process_lua_op(const image_op_t &op,
+                   const cv::Mat &input,
+                   cv::Mat *result,
+                   std::string *errmsg,
+                   BufLogger *logger) {
+  return call_lua_main(op, input, result, errmsg, logger);
+}
+
+};  // namespace vistool
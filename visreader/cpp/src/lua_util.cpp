@@ -15,6 +15,8 @@
  */
 
 #include "lua_util.h"
+#include <algorithm>
+#include <atomic>
 #include <string>
 #include <vector>
 #include "logger.h"
@@ -33,24 +35,65 @@ KAGUYA_BINDINGS(luac_basic) {
   kaguya::function("str2mat", str2mat);
 }
 
-static int initLuaEnv(lua_State *lua_s,
-                      const std::string &lua_script,
-                      bool isfile) {
-  kaguya::State state(lua_s);
-  state.openlibs();
-  state.openlib("luac_cv", luaopen_cv);
-  state.openlib("luac_basic", vistool::luaopen_luac_basic);
+// upper limit of states created on demand, same as that of thread_num
+static const int kMaxStates = 100;
 
-  bool succeed = false;
+static int writeBytecode(lua_State *lua_s,
+                         const void *p,
+                         size_t size,
+                         void *ud) {
+  static_cast<std::string *>(ud)->append(static_cast<const char *>(p), size);
+  return 0;
+}
+
+/*
+ * compile 'lua_script' to bytecode which is loaded by every state,
+ * so the script is parsed only once however many states are created
+ */
+static int compileLua(const std::string &lua_script,
+                      bool isfile,
+                      std::string *bytecode) {
+  lua_State *lua_s = luaL_newstate();
+  int ret = LUA_OK;
   if (isfile) {
     LOG(INFO) << "load 'lua_main' from file:" << lua_script;
-    succeed = state.dofile(lua_script.c_str());
+    ret = luaL_loadfile(lua_s, lua_script.c_str());
   } else {
     LOG(INFO) << "load 'lua_main' from script code with size: "
               << lua_script.size();
-    succeed = state.dostring(lua_script.c_str());
+    ret = luaL_loadbuffer(
+        lua_s, lua_script.data(), lua_script.size(), "lua_main");
   }
-  if (!succeed) {
+
+  if (ret != LUA_OK) {
+    LOG(FATAL) << "compile 'lua_main' failed with error:"
+               << lua_tostring(lua_s, -1);
+    lua_close(lua_s);
+    return -1;
+  }
+
+  bytecode->clear();
+  ret = lua_dump(lua_s, writeBytecode, bytecode, 0);
+  lua_close(lua_s);
+  if (ret != 0 || bytecode->empty()) {
+    LOG(FATAL) << "failed to dump bytecode of 'lua_main' with ret:" << ret;
+    return -2;
+  }
+  return 0;
+}
+
+static int initLuaEnv(lua_State *lua_s, const std::string &bytecode) {
+  kaguya::State state(lua_s);
+  state.openlibs();
+  state.openlib("luac_cv", luaopen_cv);
+  state.openlib("luac_basic", vistool::luaopen_luac_basic);
+
+  if (luaL_loadbufferx(lua_s,
+                       bytecode.data(),
+                       bytecode.size(),
+                       "lua_main",
+                       "b") != LUA_OK ||
+      lua_pcall(lua_s, 0, 0, 0) != LUA_OK) {
     LOG(FATAL) << "load 'lua_main' failed with error:"
                << lua_tostring(lua_s, -1);
     return -1;
@@ -59,45 +102,83 @@ static int initLuaEnv(lua_State *lua_s,
   }
 }
 
+/**
+ * @brief a pool of lua states, which are created when no one is free
+ *        until 'state_num' ones are created, or without limit if it's 0,
+ *        so there will be one for each thread running lua concurrently
+ */
 class LuaStateMgrImpl : public LuaStateMgr {
 public:
-  LuaStateMgrImpl(int state_num = 1) : _lua_script(""), _states(state_num) {}
+  LuaStateMgrImpl(int state_num = 0)
+      : _max_num(state_num),
+        _created(0),
+        _states(state_num > 0 ? state_num : kMaxStates) {}
 
   int init(const std::string &lua_script, bool isfile) {
-    int state_num = _states.capacity();
-    _lua_script = lua_script;
-    if (state_num <= 0) {
-      LOG(FATAL) << "invalid state_num:" << state_num;
+    if (_max_num < 0 || _max_num > kMaxStates) {
+      LOG(FATAL) << "invalid state_num:" << _max_num;
       return -1;
     }
 
+    if (compileLua(lua_script, isfile, &_bytecode)) {
+      return -2;
+    }
+
+    // create the states required at once, or just one to check the script
+    int state_num = std::max(_max_num, 1);
     for (int i = 0; i < state_num; i++) {
-      lua_State *s = luaL_newstate();
-      if (0 != initLuaEnv(s, _lua_script, isfile)) {
-        lua_close(s);
-        s = NULL;
+      lua_State *s = create_state();
+      if (!s) {
         LOG(FATAL) << "failed to create lua states:" << i;
-        return -2;
-      } else {
-        _states.put(s);
+        return -3;
       }
+      _states.put(s);
     }
     return 0;
   }
 
   virtual ~LuaStateMgrImpl() {
-    while (!_states.is_empty()) {
-      lua_State *s = _states.get();
+    lua_State *s = NULL;
+    while (_states.try_get(&s)) {
       lua_close(s);
     }
   }
 
-  virtual lua_State *get() { return _states.get(); }
+  virtual lua_State *get() {
+    lua_State *s = NULL;
+    if (_states.try_get(&s)) {
+      return s;
+    }
+
+    int limit = _max_num > 0 ? _max_num : kMaxStates;
+    if (_created < limit && (s = create_state()) != NULL) {
+      LOG(INFO) << "create lua state:" << _created << " for more threads";
+      return s;
+    }
+    return _states.get();
+  }
 
   void release(lua_State *s) { _states.put(s); }
 
 private:
-  std::string _lua_script;
+  lua_State *create_state() {
+    if (_created.fetch_add(1) >= (_max_num > 0 ? _max_num : kMaxStates)) {
+      _created--;
+      return NULL;
+    }
+
+    lua_State *s = luaL_newstate();
+    if (0 != initLuaEnv(s, _bytecode)) {
+      lua_close(s);
+      _created--;
+      return NULL;
+    }
+    return s;
+  }
+
+  int _max_num;
+  std::atomic<int> _created;
+  std::string _bytecode;
   BlockingQueue<lua_State *> _states;
 };
 
@@ -66,11 +66,13 @@ int LuacvProcess::init(const ops_conf_t &ops) {
   confhelper.get("tochw", &_tochw, 0);
   LOG(INFO) << "set tochw to " << _tochw;
 
-  int state_num = 1;
+  // one state for each thread by default
+  int state_num = 0;
   confhelper.get("state_num", &state_num, state_num);
   LOG(INFO) << "create lua manager with state_num:" << state_num;
   _lua_mgr = LuaStateMgr::create(lua_script, isfile, state_num);
   if (_lua_mgr) {
+    _stats.init(std::vector<std::string>(1, "lua_op"));
     return 0;
   } else {
     return -1;
@@ -83,7 +85,8 @@ int LuacvProcess::process(const transformer_input_data_t &input,
   int err_no = TRANS_ERR_OK;
   std::string err_msg = "";
 
-  size_t input_len = input.data.size();
+  size_t input_len = input.image_size();
+  int64_t start_ts = now_usec();
   BufLogger logger;
   logger.append("[luacvprocess][input:{id:%d,size:%d}]", input.id, input_len);
 
@@ -93,7 +96,7 @@ int LuacvProcess::process(const transformer_input_data_t &input,
   ScopedState scopped_state(_lua_mgr);
   kaguya::State state(scopped_state.value());
 
-  cv::Mat inputmat(1, input.data.size(), CV_8U, (void *)input.data.c_str());
+  cv::Mat inputmat(1, input_len, CV_8U, (void *)input.image());
   cv::Mat labelmat(1, input.label.size(), CV_8U, (void *)input.label.c_str());
   lua_param_type_t lua_outputs;
   std::vector<cv::Mat> lua_inputs;
@@ -127,22 +130,23 @@ int LuacvProcess::process(const transformer_input_data_t &input,
         err_msg.c_str());
   } else {
     size_t totalsize = result.total() * result.elemSize();
-    output.data.resize(totalsize);
+    char *buf = output.alloc(totalsize);
     if (_tochw) {
       output.shape.push_back(result.channels());
       output.shape.push_back(result.rows);
       output.shape.push_back(result.cols);
-      tochw(result, &output.data);
+      tochw(result, buf);
     } else {
       output.shape.push_back(result.rows);
       output.shape.push_back(result.cols);
       output.shape.push_back(result.channels());
-      std::memcpy((void *)output.data.data(), result.data, totalsize);
+      std::memcpy(buf, result.data, totalsize);
     }
     output.label = mat2str(lua_outputs[1]);
   }
 
   state.garbageCollect();
+  _stats.add(0, now_usec() - start_ts, err_no);
   logger.append("[used_mem:%dKB]", state.useKBytes());
   logger.append("[output:{size:%d,err_no:%d,err_msg:[%s]}]",
                 output.data.size(),
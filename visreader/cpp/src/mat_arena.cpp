@@ -0,0 +1,139 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+#include "include/mat_arena.h"
+
+namespace vistool {
+
+MatArena::MatArena() : _peak(0), _recent_peak(0), _count(0) {}
+
+MatArena::~MatArena() {
+  for (int i = 0; i < kSlotNum; i++) {
+    cv::fastFree(_slots[i].data);
+    _slots[i].data = NULL;
+  }
+}
+
+MatArena *MatArena::thread_arena() {
+  static thread_local MatArena arena;
+  return &arena;
+}
+
+cv::UMatData *MatArena::allocate(int dims,
+                                 const int *sizes,
+                                 int type,
+                                 void *data,
+                                 size_t *step,
+                                 int flags,
+                                 cv::UMatUsageFlags usage) const {
+  if (data != NULL) {
+    // not allocated by this arena
+    return cv::Mat::getStdAllocator()->allocate(
+        dims, sizes, type, data, step, flags, usage);
+  }
+
+  size_t total = CV_ELEM_SIZE(type);
+  for (int i = dims - 1; i >= 0; i--) {
+    if (step) {
+      step[i] = total;
+    }
+    total *= sizes[i];
+  }
+
+  _stats.allocs++;
+  _peak = std::max(_peak, total);
+  if (++_count >= kWindow) {
+    _recent_peak = _peak;
+    _peak = 0;
+    _count = 0;
+  }
+
+  // the free slot which fits best, or the smallest one to grow
+  slot_t *fit = NULL;
+  slot_t *grow = NULL;
+  for (int i = 0; i < kSlotNum; i++) {
+    slot_t *s = &_slots[i];
+    if (s->used) {
+      continue;
+    }
+    if (s->capacity >= total) {
+      if (!fit || s->capacity < fit->capacity) {
+        fit = s;
+      }
+    } else if (!grow || s->capacity < grow->capacity) {
+      grow = s;
+    }
+  }
+
+  uchar *buf = NULL;
+  if (fit) {
+    _stats.reused++;
+    fit->used = true;
+    buf = fit->data;
+  } else {
+    _stats.mallocs++;
+    buf = static_cast<uchar *>(cv::fastMalloc(total));
+    if (grow) {
+      cv::fastFree(grow->data);
+      grow->data = buf;
+      grow->capacity = total;
+      grow->used = true;
+    }
+  }
+
+  cv::UMatData *u = new cv::UMatData(this);
+  u->data = u->origdata = buf;
+  u->size = total;
+  return u;
+}
+
+bool MatArena::allocate(cv::UMatData *data,
+                        int accessflags,
+                        cv::UMatUsageFlags usage) const {
+  return data != NULL;
+}
+
+void MatArena::deallocate(cv::UMatData *u) const {
+  if (!u) {
+    return;
+  }
+
+  CV_Assert(u->urefcount == 0);
+  CV_Assert(u->refcount == 0);
+  bool in_slot = false;
+  for (int i = 0; i < kSlotNum; i++) {
+    slot_t *s = &_slots[i];
+    if (s->data != NULL && s->data == u->origdata) {
+      in_slot = true;
+      s->used = false;
+      if (_recent_peak > 0 && s->capacity > 2 * _recent_peak) {
+        // much larger than recent images, so give it back
+        cv::fastFree(s->data);
+        s->data = NULL;
+        s->capacity = 0;
+      }
+      break;
+    }
+  }
+
+  if (!in_slot) {
+    cv::fastFree(u->origdata);
+  }
+  u->origdata = NULL;
+  delete u;
+}
+
+};  // namespace vistool
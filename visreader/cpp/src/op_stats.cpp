@@ -0,0 +1,93 @@
+/**
+ * Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ **/
+
+#include "include/op_stats.h"
+
+namespace vistool {
+
+static int bucket_of(uint64_t us) {
+  int b = 0;
+  while (us > 0 && b < kStatBuckets - 1) {
+    us >>= 1;
+    b++;
+  }
+  return b;
+}
+
+void OpStats::init(const std::vector<std::string> &names) {
+  _counters.clear();
+  for (size_t i = 0; i < names.size(); i++) {
+    _counters.push_back(std::unique_ptr<counter_t>(new counter_t()));
+    _counters.back()->name = names[i];
+  }
+}
+
+void OpStats::add(int index, int64_t cost_us, int err_no) {
+  if (index < 0 || index >= static_cast<int>(_counters.size())) {
+    return;
+  }
+
+  counter_t *c = _counters[index].get();
+  uint64_t us = cost_us > 0 ? static_cast<uint64_t>(cost_us) : 0;
+  c->count.fetch_add(1, std::memory_order_relaxed);
+  c->total_us.fetch_add(us, std::memory_order_relaxed);
+  c->hist[bucket_of(us)].fetch_add(1, std::memory_order_relaxed);
+
+  uint64_t max_us = c->max_us.load(std::memory_order_relaxed);
+  while (us > max_us && !c->max_us.compare_exchange_weak(max_us, us)) {
+  }
+
+  if (err_no) {
+    std::lock_guard<std::mutex> lock(c->mutex);
+    c->errors[err_no]++;
+  }
+}
+
+void OpStats::snapshot(std::vector<op_stat_t> *stats) const {
+  stats->clear();
+  for (size_t i = 0; i < _counters.size(); i++) {
+    counter_t *c = _counters[i].get();
+    op_stat_t st;
+    st.name = c->name;
+    st.count = c->count;
+    st.total_us = c->total_us;
+    st.max_us = c->max_us;
+    for (int b = 0; b < kStatBuckets; b++) {
+      st.hist.push_back(c->hist[b]);
+    }
+    {
+      std::lock_guard<std::mutex> lock(c->mutex);
+      st.errors = c->errors;
+    }
+    stats->push_back(st);
+  }
+}
+
+void OpStats::reset() {
+  for (size_t i = 0; i < _counters.size(); i++) {
+    counter_t *c = _counters[i].get();
+    c->count = 0;
+    c->total_us = 0;
+    c->max_us = 0;
+    for (int b = 0; b < kStatBuckets; b++) {
+      c->hist[b] = 0;
+    }
+    std::lock_guard<std::mutex> lock(c->mutex);
+    c->errors.clear();
+  }
+}
+
+};  // namespace vistool
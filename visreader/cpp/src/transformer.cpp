@@ -45,4 +45,63 @@ void Transformer::destroy(Transformer *t) {
   }
 }
 
+OutputPool::~OutputPool() {
+  for (size_t i = 0; i < _free.size(); i++) {
+    delete _free[i];
+  }
+  _free.clear();
+}
+
+void OutputPool::set_capacity(size_t capacity) {
+  std::unique_lock<std::mutex> lock(_mutex);
+  _capacity = capacity;
+}
+
+transformer_output_data_t *OutputPool::alloc() {
+  transformer_output_data_t *output = NULL;
+  {
+    std::unique_lock<std::mutex> lock(_mutex);
+    if (!_free.empty()) {
+      output = _free.back();
+      _free.pop_back();
+    }
+  }
+
+  if (output == NULL) {
+    return new transformer_output_data_t;
+  }
+
+  // clear() keeps the memory of 'data' for the next result
+  output->id = 0;
+  output->err_no = 0;
+  output->err_msg.clear();
+  output->shape.clear();
+  output->dtype = "uint8";
+  output->label.clear();
+  output->data.clear();
+  output->dst = NULL;
+  output->dst_size = 0;
+  return output;
+}
+
+void OutputPool::release(transformer_output_data_t *output) {
+  if (output == NULL) {
+    return;
+  }
+
+  {
+    std::unique_lock<std::mutex> lock(_mutex);
+    if (_free.size() < _capacity) {
+      _free.push_back(output);
+      return;
+    }
+  }
+  delete output;
+}
+
+size_t OutputPool::size() {
+  std::unique_lock<std::mutex> lock(_mutex);
+  return _free.size();
+}
+
 };  // namespace vistool
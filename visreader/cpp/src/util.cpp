@@ -19,21 +19,33 @@
 #include <stdlib.h>
 
 #include <chrono>
+#include <random>
 #include <string>
 #include <vector>
 
 #include "include/logger.h"
 #include "include/util.h"
-#define random rand
 namespace vistool {
 
+/*
+ * generator of current thread, the mapping from its output to values
+ * is done by ourselves to be reproducible across different std libs
+ */
+static std::mt19937_64 &randEngine() {
+  static thread_local std::mt19937_64 engine(std::random_device{}());
+  return engine;
+}
+
+void seedRand(uint64_t seed) { randEngine().seed(seed); }
+
 int randInt(int min, int max) {
   if (min > max) {
     int t = min;
     min = max;
     max = t;
   }
-  return (random() % (max - min + 1)) + min;
+  uint64_t range = static_cast<uint64_t>(static_cast<int64_t>(max) - min) + 1;
+  return static_cast<int>(min + static_cast<int64_t>(randEngine()() % range));
 }
 
 float randFloat(float min, float max) {
@@ -42,8 +54,8 @@ float randFloat(float min, float max) {
     min = max;
     max = t;
   }
-  int64_t r = random();
-  double d_r = static_cast<double>(r) / RAND_MAX;
+  // 53 random bits to a double in [0, 1)
+  double d_r = (randEngine()() >> 11) * (1.0 / 9007199254740992.0);
   return static_cast<float>(min + (max - min) * d_r);
 }
 
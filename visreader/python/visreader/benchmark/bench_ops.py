@@ -0,0 +1,412 @@
+"""
+# Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+"""
+# micro benchmark of operators in 'operators.op_names', each of them is run
+# by 'pil' and 'opencv' op_class and by native 'PyProcessor' on synthetic and
+# real jpeg images of several sizes, and results are saved as json, eg:
+#   python -m visreader.benchmark.bench_ops --out ops.json
+#   python -m visreader.benchmark.bench_ops --baseline ops.json --out new.json
+# note that:
+#   1, native ops take encoded images, so except for decoding ops, they are
+#      planned after a 'decode' and 'net_p50_ms' excludes the decoding cost
+#   2, 'minflt_per_call' is minor page faults of each call, which grows with
+#      the bytes of fresh memory, 'alloc_kb_per_call' is only available when
+#      'tracemalloc' can be imported
+"""
+
+import os
+import io
+import gc
+import sys
+import json
+import time
+import platform
+import multiprocessing
+import resource
+import argparse
+import subprocess
+import numpy as np
+from PIL import Image
+import logging
+
+from .. import operators
+from ..operators import base
+from ..operators import pil_ops
+from ..operators import opencv_ops
+
+logger = logging.getLogger(__name__)
+
+OP_CLASSES = ['pil', 'opencv', 'native']
+
+# operators which take encoded images as input
+DECODE_OPS = ['DecodeImage', 'DecodeRandCropImage']
+
+# params to create each operator, None means not benchmarked by default
+OP_PARAMS = {
+    'DecodeImage': {},
+    'NormalizeImage': {'order': 'hwc'},
+    'ResizeImage': {'size': 224},
+    'RotateImage': {'rg': 10},
+    'CropImage': {'size': 224},
+    'RandCropImage': {'size': 224},
+    'DecodeRandCropImage': {'size': 224},
+    'RandFlipImage': {},
+    'RandDistortColor': {},
+    'ToCHWImage': {},
+    'NormalizeToCHWImage': {},
+    'LuaProcessImage': None,
+}
+
+
+def _op_class(name, op_class):
+    """ find the class of operator 'name', None if not implemented,
+        native ops are planned by 'pil' operators
+    """
+    cls = getattr(base, name, None)
+    if cls is None:
+        op_mod = opencv_ops if op_class == 'opencv' else pil_ops
+        cls = getattr(op_mod, name, None)
+    return cls
+
+
+def _encode(img, quality=90):
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def synthetic_jpeg(w, h, seed=0):
+    """ make a jpeg image of size (w, h) with smooth gradients and noise,
+        which is closer to natural images than pure noise when encoded
+    """
+    rng = np.random.RandomState(seed)
+    xs = np.linspace(0, 255, w, dtype='float32')
+    ys = np.linspace(0, 255, h, dtype='float32')
+    img = np.empty((h, w, 3), dtype='float32')
+    img[:, :, 0] = xs[np.newaxis, :]
+    img[:, :, 1] = ys[:, np.newaxis]
+    img[:, :, 2] = (xs[np.newaxis, :] + ys[:, np.newaxis]) / 2
+    img += rng.normal(0, 16, img.shape)
+    img = np.clip(img, 0, 255).astype('uint8')
+    return _encode(Image.fromarray(img))
+
+
+def real_jpeg(fname, w, h):
+    """ resize the real image in 'fname' to (w, h) and encode it as jpeg
+    """
+    img = Image.open(fname).convert('RGB')
+    return _encode(img.resize((w, h), Image.BILINEAR))
+
+
+def make_images(sizes, real_image=None):
+    """ make encoded images of each size in 'sizes'
+
+    Returns:
+        list of (name, (w, h), data)
+    """
+    images = []
+    for w, h in sizes:
+        images.append(('synthetic', (w, h), synthetic_jpeg(w, h)))
+        if real_image is not None:
+            images.append(('real', (w, h), real_jpeg(real_image, w, h)))
+    return images
+
+
+def _minflt():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+
+
+def _alloc_kb(func, iters):
+    """ kilobytes allocated by each call of 'func',
+        None if 'tracemalloc' is not available
+    """
+    try:
+        import tracemalloc
+    except ImportError as e:
+        return None
+
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        total = 0
+        for i in xrange(iters):
+            func()
+            cur, _ = tracemalloc.get_traced_memory()
+            total += max(cur - start, 0)
+    finally:
+        tracemalloc.stop()
+    return total / 1024.0 / iters
+
+
+def measure(func, iters, warmup=3):
+    """ run 'func' for 'iters' times and measure it
+
+    Returns:
+        dict with 'images_per_sec', 'p50_ms', 'p99_ms', 'minflt_per_call'
+        and 'alloc_kb_per_call'
+    """
+    for i in xrange(warmup):
+        func()
+
+    gc.collect()
+    gc.disable()
+    try:
+        costs = np.empty(iters, dtype='float64')
+        minflt = _minflt()
+        start_ts = time.time()
+        for i in xrange(iters):
+            ts = time.time()
+            func()
+            costs[i] = time.time() - ts
+        total = time.time() - start_ts
+        minflt = _minflt() - minflt
+    finally:
+        gc.enable()
+
+    costs *= 1000
+    return {
+        'images_per_sec': iters / total if total > 0 else float('inf'),
+        'p50_ms': float(np.percentile(costs, 50)),
+        'p99_ms': float(np.percentile(costs, 99)),
+        'minflt_per_call': float(minflt) / iters,
+        'alloc_kb_per_call': _alloc_kb(func, min(iters, 10)),
+    }
+
+
+def _native_processor(op=None, decode=True):
+    """ make a PyProcessor planned with 'op', and a 'decode' before it if needed
+    """
+    from ..transformer.pytransformer import PyProcessor
+    proc = PyProcessor()
+    if decode:
+        proc.decode(to_rgb=True)
+    if op is not None:
+        op.make_plan(proc)
+    proc._init()
+    return proc
+
+
+def _native_available():
+    try:
+        from ..transformer.pytransformer import PyProcessor
+        return True
+    except ImportError as e:
+        return False
+
+
+def _loaded(img):
+    """ PIL decodes images lazily, so force it to be done
+    """
+    if isinstance(img, Image.Image):
+        img.load()
+    return img
+
+
+def _prepare(name, op_class, data):
+    """ make the operator and its input for 'op_class'
+
+    Returns:
+        (func, extra) where 'func' runs the op once, and 'extra'
+        is a dict of fields to report
+    """
+    cls = _op_class(name, op_class)
+    if cls is None:
+        raise NotImplementedError('not implemented in class[%s]' %
+                                  (op_class))
+    op = cls(**OP_PARAMS[name])
+
+    if op_class == 'native':
+        proc = _native_processor(op, decode=name not in DECODE_OPS)
+        return lambda: proc(data), {'with_decode': name not in DECODE_OPS}
+
+    if name in DECODE_OPS:
+        img = data
+    else:
+        img = _loaded(_op_class('DecodeImage', op_class)(to_rgb=True)(data))
+    return lambda: _loaded(op(img)), {}
+
+
+def bench(names, op_classes, images, iters):
+    """ benchmark operators 'names' of 'op_classes' on 'images'
+
+    Returns:
+        list of dict, one for each (op, op_class, image)
+    """
+    results = []
+    for img_name, (w, h), data in images:
+        decode_p50 = None
+        if 'native' in op_classes:
+            proc = _native_processor()
+            decode_p50 = measure(lambda: proc(data), iters)['p50_ms']
+
+        for name in names:
+            for op_class in op_classes:
+                r = {
+                    'op': name,
+                    'op_class': op_class,
+                    'image': img_name,
+                    'size': [w, h],
+                }
+                try:
+                    func, extra = _prepare(name, op_class, data)
+                    r.update(extra)
+                    r.update(measure(func, iters))
+                except (NotImplementedError, AssertionError,
+                        operators.OperatorParamError) as e:
+                    r['skipped'] = str(e)
+                    results.append(r)
+                    continue
+
+                if r.get('with_decode'):
+                    r['net_p50_ms'] = max(r['p50_ms'] - decode_p50, 0.0)
+                results.append(r)
+                logger.info('%s/%s on %s[%dx%d]: %.1f images/sec' %
+                            (name, op_class, img_name, w, h,
+                             r['images_per_sec']))
+    return results
+
+
+def _git_commit():
+    try:
+        path = os.path.dirname(os.path.realpath(__file__))
+        with open(os.devnull, 'w') as null:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=path,
+                stderr=null).strip()
+    except (OSError, subprocess.CalledProcessError) as e:
+        return None
+
+
+def environment():
+    """ versions and machine info to tell where the results come from
+    """
+    import PIL
+    env = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'numpy': np.__version__,
+        'pillow': getattr(PIL, '__version__', None),
+        'native': _native_available(),
+    }
+    try:
+        import cv2
+        env['opencv'] = cv2.__version__
+    except ImportError as e:
+        env['opencv'] = None
+    return env
+
+
+def _key(r):
+    return (r['op'], r['op_class'], r['image'], tuple(r['size']))
+
+
+def compare(results, baseline, threshold):
+    """ find results whose throughput dropped more than 'threshold'
+        compared to 'baseline'
+
+    Returns:
+        list of (result, baseline result, ratio)
+    """
+    base_results = dict([(_key(r), r) for r in baseline \
+        if 'images_per_sec' in r])
+    regressions = []
+    for r in results:
+        b = base_results.get(_key(r))
+        if b is None or 'images_per_sec' not in r:
+            continue
+
+        ratio = r['images_per_sec'] / b['images_per_sec']
+        if ratio < 1 - threshold:
+            regressions.append((r, b, ratio))
+    return regressions
+
+
+def _parse_sizes(sizes):
+    return [tuple(int(v) for v in s.split('x')) for s in sizes.split(',')]
+
+
+def main(argv=None):
+    work_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description='benchmark for operators')
+    parser.add_argument('--ops', default=','.join(
+        [n for n in operators.op_names if OP_PARAMS.get(n) is not None]),
+        help='names of operators to run')
+    parser.add_argument('--op_classes', default=','.join(OP_CLASSES))
+    parser.add_argument('--sizes', default='320x240,640x480,1920x1080',
+                        help='sizes of input images in WxH')
+    parser.add_argument('--real_image', default=os.path.join(
+        work_dir, '../test/test.jpg'), help='real image, "" to skip it')
+    parser.add_argument('--iters', type=int, default=50)
+    parser.add_argument('--out', default=None, help='json file of results')
+    parser.add_argument('--baseline', default=None,
+                        help='json file of results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='max drop of throughput allowed in --baseline')
+    args = parser.parse_args(argv)
+
+    names = args.ops.split(',')
+    unknown = [n for n in names if n not in OP_PARAMS]
+    if len(unknown) > 0:
+        parser.error('unknown ops%s, supported are %s' %
+                     (str(unknown), str(operators.op_names)))
+    if 'LuaProcessImage' in names:
+        parser.error('LuaProcessImage needs a script, so not supported here')
+
+    op_classes = args.op_classes.split(',')
+    if 'native' in op_classes and not _native_available():
+        logger.warn('native ops not available, so skip them')
+        op_classes.remove('native')
+
+    real_image = args.real_image if args.real_image else None
+    images = make_images(_parse_sizes(args.sizes), real_image)
+    results = bench(names, op_classes, images, args.iters)
+
+    print('%-20s %-7s %-10s %-10s %10s %8s %8s %8s' % ('op', 'class',
+        'image', 'size', 'images/s', 'p50_ms', 'p99_ms', 'minflt'))
+    for r in results:
+        size = '%dx%d' % tuple(r['size'])
+        if 'skipped' in r:
+            print('%-20s %-7s %-10s %-10s skipped: %s' % (r['op'],
+                r['op_class'], r['image'], size, r['skipped']))
+            continue
+        print('%-20s %-7s %-10s %-10s %10.1f %8.3f %8.3f %8.1f' % (r['op'],
+            r['op_class'], r['image'], size, r['images_per_sec'],
+            r['p50_ms'], r['p99_ms'], r['minflt_per_call']))
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump({'environment': environment(), 'iters': args.iters,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for r, b, ratio in regressions:
+            print('regression: %s/%s on %s[%dx%d] %.1f -> %.1f images/sec' %
+                  (r['op'], r['op_class'], r['image'], r['size'][0],
+                   r['size'][1], b['images_per_sec'], r['images_per_sec']))
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARN)
+    sys.exit(main())
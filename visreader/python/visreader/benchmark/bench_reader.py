@@ -0,0 +1,472 @@
+"""
+# Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+"""
+# end-to-end benchmark of readers built by 'ReaderBuilder' for imagenet
+# and coco, which sweeps the concurrent settings of the builders on a
+# directory of seqfiles, and a synthetic one is generated if not exist, eg:
+#   python -m visreader.benchmark.bench_reader --dataset imagenet.train \
+#       --data_dir /tmp/imagenet.bench --worker_num 4,8 --out reader.json
+# note that:
+#   1, cpu, rss and shared memory are sampled from '/proc' for this process
+#      and its children, so they are only available on linux
+#   2, 'cpu_util' is cpu seconds per second, eg: 4.0 means 4 busy cores
+#   3, shared memory is counted once in 'peak_rss_mb' though it is mapped
+#      by all workers, and only the part allocated after the start of a run
+#      is counted, so memory left by readers of previous runs is excluded
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import cPickle
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+import logging
+
+from ..misc.kvtool import SequenceFileWriter
+from ..reader_builder import ReaderBuilder
+from ..reader_builder import ReaderSetting
+from . import bench_ops
+
+logger = logging.getLogger(__name__)
+
+DATASETS = ['imagenet.train', 'imagenet.val', 'coco.train']
+
+WORKER_MODE_TYPES = ['native_thread', 'python_thread', 'python_process']
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def make_sample(dataset, image, index, size):
+    """ make a record of 'dataset' in the format of 'tools/jpeg2seqfile.py'
+
+    Args:
+        @dataset (str): one of DATASETS
+        @image (str): encoded image
+        @index (int): index of this sample
+        @size (tuple): (w, h) of the image
+
+    Returns:
+        pickled record
+    """
+    if dataset.startswith('coco'):
+        w, h = size
+        rng = np.random.RandomState(index)
+        boxes = []
+        for i in xrange(rng.randint(1, 8)):
+            bw = rng.randint(16, w // 2)
+            bh = rng.randint(16, h // 2)
+            x = rng.randint(0, w - bw)
+            y = rng.randint(0, h - bh)
+            boxes.append({
+                'pos': [x, y, bw, bh],
+                '_area': float(bw * bh),
+                '_category_id': rng.randint(1, 81),
+                '_iscrowd': 0
+            })
+        label = {'_id': index, 'boxes': boxes}
+    else:
+        label = index % 1000
+
+    return cPickle.dumps({'image': image, 'label': label}, -1)
+
+
+def make_dataset(data_dir, dataset, num, size, file_num=4, image_num=16):
+    """ generate synthetic seqfiles of 'dataset' in 'data_dir'
+
+    Args:
+        @data_dir (str): directory to put the seqfiles
+        @dataset (str): one of DATASETS
+        @num (int): total num of samples
+        @size (tuple): (w, h) of the images
+        @file_num (int): num of seqfiles to split the samples
+        @image_num (int): num of different images, which are repeated
+            to make 'num' samples fast
+
+    Returns:
+        list of generated files
+    """
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    w, h = size
+    images = [bench_ops.synthetic_jpeg(w, h, seed=i) \
+        for i in xrange(min(image_num, num))]
+    files = []
+    per_file = int(np.ceil(float(num) / file_num))
+    for i in xrange(file_num):
+        fname = os.path.join(data_dir, 'part-%05d' % (i))
+        with open(fname, 'wb') as f:
+            writer = SequenceFileWriter(f)
+            for j in xrange(i * per_file, min((i + 1) * per_file, num)):
+                value = make_sample(dataset, images[j % len(images)], j, size)
+                writer.write('%08d' % (j), value)
+        files.append(fname)
+
+    logger.info('generated %d samples of %s in %d files in [%s]' %
+                (num, dataset, file_num, data_dir))
+    return files
+
+
+def _parse_kv(r):
+    """ parse kv data from sequence file
+    """
+    k, v = r
+    obj = cPickle.loads(v)
+    return obj['image'], obj['label']
+
+
+def _proc_stat(pid):
+    """ (ppid, cpu seconds, rss bytes) of process 'pid' from '/proc'
+    """
+    with open('/proc/%d/stat' % (pid), 'r') as f:
+        stat = f.read()
+    # skip the command name which may contain spaces
+    fields = stat[stat.rfind(')') + 2:].split()
+    cpu = float(int(fields[11]) + int(fields[12])) / _CLK_TCK
+    return int(fields[1]), cpu, int(fields[21]) * _PAGE_SIZE
+
+
+def _proc_shmem(pid):
+    """ bytes of shared memory mapped by process 'pid'
+    """
+    with open('/proc/%d/status' % (pid), 'r') as f:
+        for l in f:
+            if l.startswith('RssShmem:'):
+                return int(l.split()[1]) * 1024
+    return 0
+
+
+class ResourceMonitor(object):
+    """ a monitor which samples cpu, rss and shared memory used by
+        process 'pid' and its children in a background thread
+    """
+
+    def __init__(self, pid=None, interval=0.2):
+        self._pid = os.getpid() if pid is None else pid
+        self._interval = interval
+        self.available = os.path.exists('/proc/%d/stat' % (self._pid))
+        self._cpu = {}  # last cpu seconds seen of each process
+        self._peak_rss = 0
+        self._peak_shmem = 0
+        self._base_shmem = None  # shared memory allocated before start
+        self._procs = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _processes(self):
+        """ pid of this process and its descendants with their stats
+        """
+        stats = {}
+        for d in os.listdir('/proc'):
+            if not d.isdigit():
+                continue
+            try:
+                stats[int(d)] = _proc_stat(int(d))
+            except (IOError, OSError, IndexError, ValueError) as e:
+                continue  # exited already
+
+        procs = {}
+        pending = [self._pid]
+        while len(pending) > 0:
+            pid = pending.pop()
+            if pid not in stats:
+                continue
+            procs[pid] = stats[pid]
+            pending += [p for p, st in stats.items() if st[0] == pid]
+        return procs
+
+    def sample(self):
+        """ sample the resources used now
+        """
+        procs = self._processes()
+        rss = 0
+        shmem = 0
+        for pid, (_, cpu, proc_rss) in procs.items():
+            self._cpu[pid] = cpu
+            try:
+                proc_shmem = _proc_shmem(pid)
+            except (IOError, OSError) as e:
+                proc_shmem = 0
+            rss += proc_rss - proc_shmem
+            shmem = max(shmem, proc_shmem)
+
+        if self._base_shmem is None:
+            self._base_shmem = shmem
+        shmem = max(shmem - self._base_shmem, 0)
+        self._peak_rss = max(self._peak_rss, rss + shmem)
+        self._peak_shmem = max(self._peak_shmem, shmem)
+        self._procs = max(self._procs, len(procs))
+
+    def cpu_seconds(self):
+        """ cpu seconds used by all processes seen till now
+        """
+        if self.available:
+            self.sample()
+        return sum(self._cpu.values())
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.sample()
+
+    def start(self):
+        """ start sampling in background
+        """
+        if not self.available:
+            return self
+        self.sample()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ stop sampling and get the statistics
+
+        Returns:
+            dict with 'peak_rss_mb', 'peak_shmem_mb' and 'processes',
+            values are None if not available
+        """
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self.sample()
+
+        if not self.available:
+            return {'peak_rss_mb': None, 'peak_shmem_mb': None, \
+                'processes': None}
+
+        return {
+            'peak_rss_mb': self._peak_rss / 1024.0**2,
+            'peak_shmem_mb': self._peak_shmem / 1024.0**2,
+            'processes': self._procs
+        }
+
+
+def build_reader(dataset, data_dir, worker_args, passes=1, shuffle_size=0):
+    """ build a reader of 'dataset' in 'data_dir' with 'ReaderBuilder'
+
+    Args:
+        @dataset (str): one of DATASETS
+        @data_dir (str): directory of seqfiles
+        @worker_args (dict): 'worker_args' for the builder
+        @passes (int): times to read the data
+        @shuffle_size (int): size of shuffle buffer for training data
+
+    Returns:
+        reader
+    """
+    pl_name, which = dataset.split('.')
+    settings = {
+        'sample_parser': _parse_kv,
+        'worker_args': dict(worker_args),
+    }
+    if which == 'train':
+        settings['shuffle_size'] = shuffle_size
+
+    rd_setting = ReaderSetting(
+        data_dir, sc_setting={'pass_num': passes}, pl_setting=settings)
+    builder = ReaderBuilder(settings={which: rd_setting}, pl_name=pl_name)
+    return getattr(builder, which)()
+
+
+def run(reader, warmup=0):
+    """ read all samples from 'reader', the first 'warmup'
+        samples are not counted in the speed
+
+    Returns:
+        dict with 'samples', 'samples_per_sec', 'cpu_util', 'cpu_percent',
+        'peak_rss_mb', 'peak_shmem_mb' and 'processes'
+    """
+    monitor = ResourceMonitor().start()
+    ct = 0
+    start_ts = time.time()
+    start_cpu = monitor.cpu_seconds()
+    for _ in reader():
+        ct += 1
+        if ct == warmup:
+            start_ts = time.time()
+            start_cpu = monitor.cpu_seconds()
+
+    cost = time.time() - start_ts
+    cpu = monitor.cpu_seconds() - start_cpu
+    result = monitor.stop()
+
+    samples = max(ct - warmup, 0)
+    result['samples'] = ct
+    result['samples_per_sec'] = samples / cost if cost > 0 else 0.0
+    if monitor.available and cost > 0:
+        result['cpu_util'] = cpu / cost
+        result['cpu_percent'] = 100.0 * cpu / cost / \
+            multiprocessing.cpu_count()
+    else:
+        result['cpu_util'] = None
+        result['cpu_percent'] = None
+    return result
+
+
+def configs(dataset, worker_modes, worker_nums, use_sharedmems, \
+        buffer_sizes):
+    """ all combinations of settings to sweep for 'dataset'
+
+    Returns:
+        list of (worker_args, reason) where 'reason' is not None
+        for unsupported ones
+    """
+    native = True
+    try:
+        from ..transformer.pytransformer import PyProcessor
+    except ImportError as e:
+        native = False
+
+    results = []
+    for mode in worker_modes:
+        for num in worker_nums:
+            for shm in use_sharedmems:
+                if shm and mode != 'python_process':
+                    continue  # only used by processes
+
+                for size in buffer_sizes:
+                    args = {
+                        'worker_mode': mode,
+                        'worker_num': num,
+                        'use_sharedmem': shm,
+                        'buffer_size': size
+                    }
+                    reason = None
+                    if mode == 'native_thread' and dataset.startswith(
+                            'coco'):
+                        reason = 'native_thread not supported by coco'
+                    elif mode == 'native_thread' and not native:
+                        reason = 'native ops not available'
+                    results.append((args, reason))
+    return results
+
+
+def sweep(dataset, data_dir, worker_args_list, passes=1, warmup=0, \
+        shuffle_size=0, shared_memsize=None):
+    """ run readers of 'dataset' with each of 'worker_args_list'
+
+    Returns:
+        list of dict with worker args and results of 'run'
+    """
+    results = []
+    for worker_args, reason in worker_args_list:
+        r = dict(worker_args)
+        r['dataset'] = dataset
+        if reason is not None:
+            r['skipped'] = reason
+            results.append(r)
+            continue
+
+        args = dict(worker_args)
+        if args['use_sharedmem'] and shared_memsize is not None:
+            args['shared_memsize'] = shared_memsize
+
+        gc.collect()  # release memory of previous readers
+        reader = build_reader(dataset, data_dir, args, passes, shuffle_size)
+        r.update(run(reader, warmup))
+        del reader
+        logger.info('%s with %s: %.1f samples/sec' %
+                    (dataset, str(worker_args), r['samples_per_sec']))
+        results.append(r)
+    return results
+
+
+def _ints(s):
+    return [int(v) for v in s.split(',')]
+
+
+def _fmt(v, fmt):
+    return fmt % (v) if v is not None else '-'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='end-to-end benchmark for readers')
+    parser.add_argument('--dataset', choices=DATASETS,
+                        default='imagenet.train')
+    parser.add_argument('--data_dir', required=True,
+                        help='directory of seqfiles, generated if not exist')
+    parser.add_argument('--num', type=int, default=2000,
+                        help='num of samples to generate')
+    parser.add_argument('--image_size', default='500x375',
+                        help='size of generated images in WxH')
+    parser.add_argument('--file_num', type=int, default=4)
+    parser.add_argument('--worker_modes', default=','.join(WORKER_MODE_TYPES))
+    parser.add_argument('--worker_num', default='4,8,16')
+    parser.add_argument('--use_sharedmem', default='0,1',
+                        help='whether to use shared memory, eg: 0,1')
+    parser.add_argument('--buffer_size', default='1000')
+    parser.add_argument('--shared_memsize', type=int, default=1024**3)
+    parser.add_argument('--shuffle_size', type=int, default=0)
+    parser.add_argument('--passes', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='leading samples not counted in the speed')
+    parser.add_argument('--out', default=None, help='json file of results')
+    args = parser.parse_args(argv)
+
+    modes = args.worker_modes.split(',')
+    unknown = [m for m in modes if m not in WORKER_MODE_TYPES]
+    if len(unknown) > 0:
+        parser.error('unknown worker_modes%s, supported are %s' %
+                     (str(unknown), str(WORKER_MODE_TYPES)))
+
+    if not os.path.isdir(args.data_dir) or len(os.listdir(args.data_dir)) == 0:
+        size = tuple(int(v) for v in args.image_size.split('x'))
+        make_dataset(args.data_dir, args.dataset, args.num, size,
+                     args.file_num)
+
+    worker_args_list = configs(args.dataset, modes,
+                               _ints(args.worker_num),
+                               [bool(v) for v in _ints(args.use_sharedmem)],
+                               _ints(args.buffer_size))
+    results = sweep(args.dataset, os.path.abspath(args.data_dir),
+                    worker_args_list, args.passes, args.warmup,
+                    args.shuffle_size, args.shared_memsize)
+
+    print('%-15s %-7s %-6s %-7s %10s %8s %10s %10s' % ('worker_mode',
+        'workers', 'shm', 'buffer', 'samples/s', 'cpu%', 'rss_mb',
+        'shmem_mb'))
+    for r in results:
+        head = '%-15s %-7d %-6s %-7d' % (r['worker_mode'], r['worker_num'],
+                                         r['use_sharedmem'], r['buffer_size'])
+        if 'skipped' in r:
+            print('%s skipped: %s' % (head, r['skipped']))
+            continue
+        print('%s %10.1f %8s %10s %10s' % (head, r['samples_per_sec'],
+            _fmt(r['cpu_percent'], '%.1f'), _fmt(r['peak_rss_mb'], '%.1f'),
+            _fmt(r['peak_shmem_mb'], '%.1f')))
+
+    if args.out is not None:
+        env = bench_ops.environment()
+        env['dataset'] = args.dataset
+        env['data_dir'] = os.path.abspath(args.data_dir)
+        with open(args.out, 'w') as f:
+            json.dump({'environment': env, 'results': results}, f, \
+                indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARN)
+    sys.exit(main())
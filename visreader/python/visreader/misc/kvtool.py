@@ -141,6 +141,16 @@ class KvFileReader(object):
         value = f.read(valuelen)
         return key, value
 
+    def tell(self):
+        """ tell the position of currently readed
+        """
+        return self.kvfile.tell()
+
+    def seek(self, pos):
+        """ seek to the specified position
+        """
+        self.kvfile.seek(pos)
+
 
 class SequenceFileReader(KvFileReader):
     """ a reader for sequencefile
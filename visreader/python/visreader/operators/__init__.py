@@ -16,6 +16,7 @@
 
 from .base import OperatorParamError
 from .base import build
+from .decode_cache import DecodeCache
 
 op_names = [
     'DecodeImage',
@@ -24,9 +25,11 @@ op_names = [
     'RotateImage',
     'CropImage',
     'RandCropImage',
+    'DecodeRandCropImage',
     'RandFlipImage',
     'RandDistortColor',
     'ToCHWImage',
+    'NormalizeToCHWImage',
     'LuaProcessImage',
 ]
 
@@ -13,18 +13,62 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """
+import sys
+import math
 import numpy as np
 import functools
+import random
+import threading
 import logging
 logger = logging.getLogger(__name__)
 
+_MASK64 = (1 << 64) - 1
+
+# random generator of the sample being processed in current thread
+_local_rng = threading.local()
+
 
 class OperatorParamError(ValueError):
     pass
 
 
+def _splitmix64(x):
+    """ mix the bits of a 64-bit integer
+    """
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def sample_seed(seed, epoch, index):
+    """ derive a seed for the 'index'th sample in 'epoch' from global 'seed',
+        the result is a non-negative integer less than 2**63
+    """
+    x = _splitmix64(seed & _MASK64)
+    x = _splitmix64(x ^ (epoch & _MASK64))
+    x = _splitmix64(x ^ (index & _MASK64))
+    return x >> 1
+
+
+def seed_rng(seed):
+    """ seed the random generator used by operators in current thread,
+        'None' means to use the global generator of module 'random'
+    """
+    _local_rng.rng = None if seed is None else random.Random(seed)
+
+
+def get_rng():
+    """ get the random generator for operators in current thread
+    """
+    rng = getattr(_local_rng, 'rng', None)
+    return random if rng is None else rng
+
+
 class LuaProcessImage(object):
-    """ an lua operator which can execute any code in lua env
+    """ an lua operator which can execute any code in lua env, it can be
+        planned with other native operators, eg: after decoding and
+        cropping, in which case it gets the image output by the previous one
     """
 
     def __init__(self, lua_fname='', lua_code='', tochw=False):
@@ -34,10 +78,11 @@ class LuaProcessImage(object):
         self._pyprocessor = None
 
     def __call__(self, img):
-        assert len(self._lua_script) > 0, 'invalid lua script'
+        assert len(self._lua_fname) > 0 or len(self._lua_code) > 0, \
+            'invalid lua script'
 
         if self._pyprocessor is None:
-            from ..pytransformer import PyProcessor
+            from ..transformer.pytransformer import PyProcessor
             self._pyprocessor = PyProcessor()
             self._pyprocessor.lua(lua_fname=self._lua_fname,
                                   lua_code=self._lua_code,
@@ -58,9 +103,13 @@ class NormalizeImage(object):
         mean = mean if mean is not None else [0.485, 0.456, 0.406]
         std = std if std is not None else [0.229, 0.224, 0.225]
 
+        # keep them in float32 to avoid upcasting the result
+        self.order = order
         shape = (3, 1, 1) if order == 'chw' else (1, 1, 3)
-        self.mean = np.array(mean).reshape(shape)
-        self.std = np.array(std).reshape(shape)
+        self.mean = np.array(mean, dtype='float32').reshape(shape)
+        self.std = np.array(std, dtype='float32').reshape(shape)
+        self.alpha = (self.scale / self.std).astype('float32')
+        self.beta = (-self.mean / self.std).astype('float32')
 
     def __call__(self, img):
         from PIL import Image
@@ -69,11 +118,15 @@ class NormalizeImage(object):
 
         assert isinstance(img,
                           np.ndarray), "invalid input 'img' in NormalizeImage"
-        return (img.astype('float32') * self.scale - self.mean) / self.std
+        out = np.multiply(img, self.alpha, dtype='float32')
+        out += self.beta
+        return out
 
     def make_plan(self, planner):
-        raise NotImplementedError('%s::_make_plan not implemented' \
-            % (type(self).__name__))
+        return planner.normalize(
+            scale=self.scale,
+            mean=self.mean.ravel().tolist(),
+            std=self.std.ravel().tolist())
 
 
 class ToCHWImage(object):
@@ -91,6 +144,226 @@ class ToCHWImage(object):
         return planner.to_chw()
 
 
+class NormalizeToCHWImage(object):
+    """ convert an image in HWC to a normalized one in CHW, which is the same
+        as 'ToCHWImage' followed by 'NormalizeImage', but computed in one
+        pass without float temporaries
+    """
+    # no more operators are planned after this one in native_thread mode
+    ends_plan = True
+
+    def __init__(self, scale=None, mean=None, std=None, dtype='float32'):
+        if dtype not in ['float32', 'float16']:
+            raise OperatorParamError('not supported dtype[%s]' % (dtype))
+
+        self.scale = scale if scale is not None else 1.0 / 255.0
+        self.mean = mean if mean is not None else [0.485, 0.456, 0.406]
+        self.std = std if std is not None else [0.229, 0.224, 0.225]
+        self.dtype = dtype
+
+        mean = np.array(self.mean, dtype='float32').reshape((-1, 1, 1))
+        std = np.array(self.std, dtype='float32').reshape((-1, 1, 1))
+        self.alpha = (self.scale / std).astype('float32')
+        self.beta = (-mean / std).astype('float32')
+
+    def __call__(self, img, out=None):
+        """ normalize 'img' to 'out' which is allocated if None
+        """
+        from PIL import Image
+        if isinstance(img, Image.Image):
+            img = np.array(img)
+
+        assert isinstance(img, np.ndarray) and img.ndim == 3, \
+            "invalid input 'img' in NormalizeToCHWImage"
+        src = img.transpose((2, 0, 1))
+        if out is None:
+            out = np.empty(src.shape, dtype=self.dtype)
+
+        np.multiply(src, self.alpha, out=out, casting='unsafe')
+        np.add(out, self.beta, out=out, casting='unsafe')
+        return out
+
+    def batch(self, imgs, out=None):
+        """ normalize a batch of images with the same size in HWC
+
+        Args:
+            @imgs (list or ndarray): images or an array in NHWC
+            @out (ndarray): buffer in NCHW to hold the result, allocated if None
+
+        Returns:
+            normalized images in NCHW
+        """
+        h, w, c = np.shape(imgs[0])
+        shape = (len(imgs), c, h, w)
+        if out is None:
+            out = np.empty(shape, dtype=self.dtype)
+        elif out.shape != shape:
+            raise OperatorParamError('invalid shape%s of out buffer, '\
+                'expected %s' % (str(out.shape), str(shape)))
+
+        for i, img in enumerate(imgs):
+            self(img, out=out[i])
+        return out
+
+    def make_plan(self, planner):
+        return planner.normalize_to_chw(
+            scale=self.scale, mean=self.mean, std=self.std, dtype=self.dtype)
+
+
+def jpeg_size(data):
+    """ get (width, height) of jpeg image 'data' from its header,
+        return None if not a jpeg
+    """
+    if len(data) < 4 or data[:2] != '\xff\xd8':
+        return None
+
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != '\xff':
+            return None
+
+        marker = ord(data[pos + 1])
+        if marker == 0xFF:  # padding
+            pos += 1
+            continue
+
+        seglen = (ord(data[pos + 2]) << 8) | ord(data[pos + 3])
+        if 0xC0 <= marker <= 0xCF and marker not in [0xC4, 0xC8, 0xCC]:
+            if pos + 9 > len(data):
+                return None
+            h = (ord(data[pos + 5]) << 8) | ord(data[pos + 6])
+            w = (ord(data[pos + 7]) << 8) | ord(data[pos + 8])
+            return (w, h)
+        pos += 2 + seglen
+
+    return None
+
+
+def reduced_scale(size, size_hint, scales=(8, 4, 2)):
+    """ get the largest scale in 'scales' to reduce an image of 'size',
+        so that the reduced one is not smaller than 'size_hint'
+
+    Args:
+        @size (tuple): (w, h) of the image
+        @size_hint (int or tuple): short edge or (w, h) at least to keep
+
+    Returns:
+        scale to divide the size, 1 means no reduction
+    """
+    w, h = size
+    for s in scales:
+        sw = (w + s - 1) // s
+        sh = (h + s - 1) // s
+        if type(size_hint) is int:
+            ok = min(sw, sh) >= size_hint
+        else:
+            ok = sw >= size_hint[0] and sh >= size_hint[1]
+        if ok:
+            return s
+    return 1
+
+
+def rand_crop_rect(img_w, img_h, scale, ratio, rng):
+    """ pick a random crop window in an image of size 'img_w x img_h'
+
+    Args:
+        @scale (list of floats): range of the area to crop relative to the image
+        @ratio (list of floats): range of aspect ratio of the area to crop
+        @rng (random.Random): random generator
+
+    Returns:
+        (x, y, w, h) of the window
+    """
+    aspect_ratio = math.sqrt(rng.uniform(*ratio))
+    w = 1. * aspect_ratio
+    h = 1. / aspect_ratio
+
+    bound = min((float(img_w) / img_h) / (w**2),
+                (float(img_h) / img_w) / (h**2))
+    scale_max = min(scale[1], bound)
+    scale_min = min(scale[0], bound)
+
+    target_area = img_w * img_h * rng.uniform(scale_min, scale_max)
+    target_size = math.sqrt(target_area)
+    w = int(target_size * w)
+    h = int(target_size * h)
+
+    i = rng.randint(0, img_w - w)
+    j = rng.randint(0, img_h - h)
+    return i, j, w, h
+
+
+def _fuse_normalize(ops):
+    """ replace adjacent 'ToCHWImage' and 'NormalizeImage' in 'ops'
+        with a 'NormalizeToCHWImage'
+    """
+    fused = []
+    i = 0
+    while i < len(ops):
+        pair = ops[i:i + 2]
+        types = [type(o) for o in pair]
+        if (types == [ToCHWImage, NormalizeImage] and pair[1].order == 'chw') \
+                or (types == [NormalizeImage, ToCHWImage] and \
+                pair[0].order != 'chw'):
+            norm = pair[1] if types[0] is ToCHWImage else pair[0]
+            fused.append(
+                NormalizeToCHWImage(norm.scale,
+                                    norm.mean.ravel().tolist(),
+                                    norm.std.ravel().tolist()))
+            i += 2
+        else:
+            fused.append(ops[i])
+            i += 1
+    return fused
+
+
+def fuse_ops(ops, fuse_decode=True):
+    """ fuse adjacent operators in 'ops' which can be done in one pass:
+        1, 'ToCHWImage' and 'NormalizeImage' to 'NormalizeToCHWImage'
+        2, the leading 'DecodeImage' and 'RandCropImage' to a
+           'DecodeRandCropImage' which only decodes the cropped area,
+           skipped if the size hint of 'DecodeImage' is set explicitly
+
+    Returns:
+        new list of operators
+    """
+    ops = _fuse_normalize(ops)
+    if not fuse_decode or len(ops) < 2 \
+            or type(ops[0]).__name__ != 'DecodeImage' \
+            or getattr(ops[0], 'size_hint', None) != 'auto':
+        return ops
+
+    mod = sys.modules[type(ops[0]).__module__]
+    fused = getattr(mod, 'DecodeRandCropImage', None)
+    crop_op = getattr(mod, 'RandCropImage', None)
+    if fused is None or type(ops[1]) is not crop_op:
+        return ops
+
+    logger.debug('fuse DecodeImage and RandCropImage in %s' % (mod.__name__))
+    op = fused(ops[1].size, scale=ops[1].scale, ratio=ops[1].ratio, \
+        to_rgb=ops[0].to_rgb, interpolation=ops[1].interpolation)
+    return [op] + list(ops[2:])
+
+
+def propagate_size_hint(ops):
+    """ set size hint of the leading 'DecodeImage' in 'ops' from
+        the first downstream operator which resizes the image,
+        operators between them must keep the size of the image
+    """
+    if len(ops) == 0 or getattr(ops[0], 'size_hint', None) != 'auto':
+        return
+
+    hint = None
+    for o in ops[1:]:
+        if hasattr(o, 'min_input_size'):
+            hint = o.min_input_size()
+            break
+        elif not getattr(o, 'keep_size', False):
+            break
+
+    ops[0].auto_size_hint = hint
+
+
 def choose_first_param(func):
     """ A decorator to choose the first element of the input(if it's tuple)
         as the param of 'func' which only accept one param. And the output
@@ -133,6 +406,8 @@ def build_mapper(ops):
 
 
 def make_cpp_plan(ops, planner):
+    ops = fuse_ops(ops)
+    propagate_size_hint(ops)
     noacc_ops = []
     for i, o in enumerate(ops):
         try:
@@ -141,6 +416,10 @@ def make_cpp_plan(ops, planner):
             noacc_ops += ops[i:]
             break
 
+        if getattr(o, 'ends_plan', False):
+            noacc_ops += ops[i + 1:]
+            break
+
     post_mapper = None
     if len(noacc_ops) > 0:
         logger.debug('left last %d python ops', len(noacc_ops))
@@ -149,9 +428,77 @@ def make_cpp_plan(ops, planner):
     return post_mapper
 
 
+def _seeded_mapper(mapper):
+    """ make a mapper which accepts samples attached with seed,
+        and seeds the random generator of operators before mapping
+    """
+
+    def _mapper(sample):
+        seed, r = sample
+        seed_rng(seed)
+        try:
+            return mapper(r)
+        finally:
+            seed_rng(None)
+
+    return _mapper
+
+
+def _with_sample_seed(decorator, seed):
+    """ attach a seed derived from 'seed', epoch and index to each sample
+        before passed to 'decorator'
+    """
+
+    def _decorator(reader):
+        # epoch and index of the first sample in next pass
+        ctx = {'epoch': 0, 'index': 0}
+
+        def _seeded_reader():
+            epoch, start = ctx['epoch'], ctx['index']
+            ctx['epoch'] += 1
+            ctx['index'] = 0
+            for i, r in enumerate(reader(), start):
+                yield sample_seed(seed, epoch, i), r
+
+        rd = decorator(_seeded_reader)
+        return with_seed_state(rd, ctx)
+
+    return _decorator
+
+
+def with_seed_state(reader, ctx):
+    """ expose 'ctx' of the seeds of samples as the state of 'reader',
+        which is saved and restored by 'Pipeline'
+    """
+    reader.state_dict = lambda: dict(ctx)
+    reader.load_state_dict = ctx.update
+    return reader
+
+
+def _report_decode_cache(decorator, cache):
+    """ report statistics of 'cache' when each pass of the reader finished
+    """
+
+    def _decorator(reader):
+        rd = decorator(reader)
+
+        def _reader():
+            for r in rd():
+                yield r
+            cache.report(reset=True)
+
+        if hasattr(rd, 'state_dict'):
+            _reader.state_dict = rd.state_dict
+            _reader.load_state_dict = rd.load_state_dict
+        return _reader
+
+    return _decorator
+
+
 def build(ops, worker_num=16, buffer_size=1000, \
         worker_mode='python_thread', \
-        use_sharedmem=False, **kwargs):
+        use_sharedmem=False, decode_cache=None, seed=None, \
+        post_worker_num=0, post_worker_mode='python_thread', **kwargs):
     """ build a concurrently processing reader decorator which accept 
         a reader as input and return the processed reader as output
 
@@ -160,11 +507,33 @@ def build(ops, worker_num=16, buffer_size=1000, \
         @worker_num (int): num of workers to process in the decorator
         @worker_mode (str): concurrency mode, eg: python_thread, python_process or native_thread
         @use_sharedmem (bool): whether to use shared memory for IPC
+        @decode_cache (DecodeCache): cache for the output of leading 'DecodeImage',
+                                     not supported in native_thread mode
+        @seed (int): if not None, random operators use a generator seeded by
+                     this seed, the epoch and the index of each sample, so the
+                     results not depend on the number of workers
+        @post_worker_num (int): num of workers to run python operators left by
+                     native_thread mode, 0 means running them in the consumer thread
+        @post_worker_mode (str): python_thread or python_process for these workers
 
     Returns:
         decorator of reader
+
+    Raises:
+        OperatorParamError when a memory decode cache is used by processes
     """
     logger.debug('build concurrent mapper in mode[%s]' % (worker_mode))
+    if decode_cache is not None and worker_mode == 'native_thread':
+        logger.warn('not supported decode_cache in native_thread mode')
+        decode_cache = None
+
+    if decode_cache is not None:
+        if kwargs.get('use_process') and decode_cache.where == 'memory':
+            raise OperatorParamError('memory decode cache can not be '\
+                'reused by worker processes of next pass, use disk cache')
+        from .decode_cache import with_decode_cache
+        ops = with_decode_cache(ops, decode_cache)
+
     if worker_mode == 'native_thread':
         if use_sharedmem:
             logger.warn('not supported use_sharedmem in native_thread mode')
@@ -176,9 +545,20 @@ def build(ops, worker_num=16, buffer_size=1000, \
             planner,
             buffer_size=buffer_size,
             worker_num=worker_num,
-            post_mapper=post_mapper)
+            post_mapper=post_mapper,
+            seed=seed,
+            post_worker_num=post_worker_num,
+            post_use_process=post_worker_mode == 'python_process',
+            post_order=kwargs.get('order', False))
     else:
         mapper = build_mapper(ops)
+        if seed is not None:
+            mapper = _seeded_mapper(mapper)
         from ..pipeline.decorator import Xmap
-        return Xmap(mapper, worker_num=worker_num, buffer_size=buffer_size, \
+        xmapper = Xmap(mapper, worker_num=worker_num, buffer_size=buffer_size, \
                 use_sharedmem=use_sharedmem, **kwargs)
+        if seed is not None:
+            xmapper = _with_sample_seed(xmapper, seed)
+        if decode_cache is not None:
+            xmapper = _report_decode_cache(xmapper, decode_cache)
+        return xmapper
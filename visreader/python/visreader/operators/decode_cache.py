@@ -0,0 +1,481 @@
+"""
+# Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+"""
+# a cache for decoded images which makes later epochs skip the
+# deterministic 'DecodeImage' and only replay the random operators,
+# note that:
+#   1, memory store lives in each worker, so it is not allowed with workers
+#      in 'python_process' mode, use disk store to share between processes
+#   2, hit/miss statistics are kept in shared memory and can be reported
+#      from the parent process
+"""
+
+import os
+import io
+import time
+import hashlib
+import threading
+import collections
+import multiprocessing
+import numpy as np
+import logging
+
+from .base import OperatorParamError
+
+logger = logging.getLogger(__name__)
+
+# codecs supported to store decoded images
+CODEC_TYPES = ['raw', 'jpeg', 'png']
+
+# libraries to encode and resize cached images, same as the decoding operator
+BACKEND_TYPES = ['cv2', 'pil']
+
+
+class CacheError(ValueError):
+    """ CacheError
+    """
+    pass
+
+
+def _import_cv2():
+    """ import cv2 which is only needed by caches of opencv operators
+    """
+    try:
+        import cv2
+    except ImportError as e:
+        raise CacheError('cv2 is needed by decode cache of opencv operators, '\
+            'failed to import it with error[%s]' % (str(e)))
+    return cv2
+
+
+def _encode(img, codec, quality, backend='cv2'):
+    """ encode an uint8 ndarray to a cached value
+    """
+    if codec == 'raw':
+        # keep a private copy, which is never modified by users
+        value = np.array(img, order='C')
+        value.flags.writeable = False
+        return value
+
+    if backend == 'pil':
+        from PIL import Image
+        buf = io.BytesIO()
+        if codec == 'jpeg':
+            Image.fromarray(img).save(buf, format='JPEG', quality=quality)
+        else:
+            Image.fromarray(img).save(buf, format='PNG', compress_level=1)
+        return buf.getvalue()
+
+    cv2 = _import_cv2()
+    if codec == 'jpeg':
+        ok, buf = cv2.imencode('.jpg', img,
+                               [cv2.IMWRITE_JPEG_QUALITY, quality])
+    else:
+        ok, buf = cv2.imencode('.png', img, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+
+    if not ok:
+        raise CacheError('failed to encode image with codec[%s]' % (codec))
+    return buf.tostring()
+
+
+def _decode(value, codec, backend='cv2'):
+    """ decode a cached value to an uint8 ndarray
+    """
+    if codec == 'raw':
+        return value.copy()
+
+    if backend == 'pil':
+        from PIL import Image
+        return np.asarray(Image.open(io.BytesIO(value)))
+
+    cv2 = _import_cv2()
+    data = np.frombuffer(value, dtype='uint8')
+    return cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+
+
+def _sizeof(value):
+    """ bytes occupied by a cached value
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    else:
+        return len(value)
+
+
+class MemoryStore(object):
+    """ a LRU store in memory which is limited by 'capacity' in bytes
+    """
+
+    def __init__(self, capacity):
+        assert capacity > 0, "invalid capacity[%d] for MemoryStore" % (
+            capacity)
+        self._capacity = capacity
+        self._size = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ get value of 'key' and mark it as recently used
+        """
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        """ put a value and evict least recently used ones when full
+        """
+        sz = _sizeof(value)
+        if sz > self._capacity:
+            return False
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= _sizeof(old)
+
+            while self._size + sz > self._capacity:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= _sizeof(evicted)
+
+            self._items[key] = value
+            self._size += sz
+        return True
+
+    def size(self):
+        """ bytes used in this store
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskStore(object):
+    """ a LRU store in local directory 'path' which is limited by 'capacity' in bytes,
+        existing files in 'path' will be reused
+    """
+
+    def __init__(self, path, capacity):
+        assert capacity > 0, "invalid capacity[%d] for DiskStore" % (capacity)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self._path = path
+        self._capacity = capacity
+        self._size = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        files = [os.path.join(path, f) for f in os.listdir(path) \
+            if f.endswith('.cache')]
+        for f in sorted(files, key=os.path.getmtime):
+            key = os.path.basename(f)[:-len('.cache')]
+            sz = os.path.getsize(f)
+            self._items[key] = sz
+            self._size += sz
+
+    def _fname(self, key):
+        return os.path.join(self._path, key + '.cache')
+
+    def get(self, key):
+        """ get value of 'key' and mark it as recently used
+        """
+        with self._lock:
+            sz = self._items.pop(key, None)
+            if sz is None:
+                return None
+            self._items[key] = sz
+
+        try:
+            with open(self._fname(key), 'rb') as f:
+                return f.read()
+        except IOError as e:
+            # maybe evicted by another process
+            with self._lock:
+                self._items.pop(key, None)
+            return None
+
+    def put(self, key, value):
+        """ put a value and evict least recently used ones when full
+        """
+        if isinstance(value, np.ndarray):
+            raise CacheError('only encoded values can be stored in DiskStore')
+
+        sz = len(value)
+        if sz > self._capacity:
+            return False
+
+        fname = self._fname(key)
+        tmpname = '%s.%d.%d.tmp' % (fname, os.getpid(),
+                                    threading.current_thread().ident)
+        with open(tmpname, 'wb') as f:
+            f.write(value)
+        os.rename(tmpname, fname)
+
+        evicted = []
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old
+
+            while self._size + sz > self._capacity and len(self._items) > 0:
+                k, s = self._items.popitem(last=False)
+                self._size -= s
+                evicted.append(k)
+
+            self._items[key] = sz
+            self._size += sz
+
+        for k in evicted:
+            try:
+                os.remove(self._fname(k))
+            except OSError as e:
+                pass
+        return True
+
+    def size(self):
+        """ bytes used in this store
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DecodeCache(object):
+    """ cache for decoded images, which is used by 'operators.build'
+        to replace the leading 'DecodeImage' operator
+    """
+    # index of statistics in shared array, the last two are never reset
+    # and used to estimate the average decoding cost
+    _HITS = 0
+    _MISSES = 1
+    _DECODE_MS = 2
+    _LOAD_MS = 3
+    _TOTAL_MISSES = 4
+    _TOTAL_DECODE_MS = 5
+
+    def __init__(self,
+                 where='memory',
+                 capacity=8 * 1024**3,
+                 path=None,
+                 codec='raw',
+                 quality=95,
+                 resize_short=None):
+        """ init
+
+        Args:
+            @where (str): 'memory' or 'disk' to store the decoded images
+            @capacity (int): max bytes to be used by this cache
+            @path (str): directory for 'disk' store, eg: a path on local SSD
+            @codec (str): 'raw' to store uint8 pixels, 'jpeg' or 'png' to re-encode them
+            @quality (int): quality used by 'jpeg' codec
+            @resize_short (int): if not None, shrink decoded images
+                whose short edge is larger than this before caching
+        """
+        if where not in ['memory', 'disk']:
+            raise OperatorParamError('not supported cache location[%s]' %
+                                     (where))
+        if codec not in CODEC_TYPES:
+            raise OperatorParamError('not supported cache codec[%s]' %
+                                     (codec))
+
+        if where == 'disk':
+            if path is None:
+                raise OperatorParamError("'path' is needed for disk cache")
+            if codec == 'raw':
+                codec = 'png'
+                logger.warn('raw codec is not supported by disk cache, '\
+                    'so switch to png')
+            self._store = DiskStore(path, capacity)
+        else:
+            self._store = MemoryStore(capacity)
+
+        self.where = where
+        self.codec = codec
+        self.quality = quality
+        self.resize_short = resize_short
+        self.backend = 'cv2'
+        self._stats = multiprocessing.Array('d', 6)
+        self.epoch_stats = []  # statistics reported for each epoch
+
+    def set_backend(self, backend):
+        """ set library to encode and resize cached images, which is
+            called by 'CachedDecodeImage' according to the decoding operator
+
+        Args:
+            @backend (str): 'cv2' or 'pil'
+        """
+        if backend not in BACKEND_TYPES:
+            raise OperatorParamError('not supported cache backend[%s]' %
+                                     (backend))
+        self.backend = backend
+
+    @staticmethod
+    def make_key(data):
+        """ make cache key for encoded image 'data'
+        """
+        return hashlib.md5(data).hexdigest()
+
+    def _shrink(self, img):
+        """ resize short edge of 'img' to 'self.resize_short'
+        """
+        short = self.resize_short
+        h, w = img.shape[:2]
+        if short is None or min(h, w) <= short:
+            return img
+
+        percent = float(short) / min(w, h)
+        w = int(round(w * percent))
+        h = int(round(h * percent))
+        if self.backend == 'pil':
+            from PIL import Image
+            resized = Image.fromarray(img).resize(
+                (w, h), getattr(Image, 'BOX', Image.BILINEAR))
+            return np.asarray(resized)
+
+        cv2 = _import_cv2()
+        return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+
+    def get(self, key):
+        """ get decoded image of 'key', return None if not found
+        """
+        start_ts = time.time()
+        value = self._store.get(key)
+        if value is None:
+            return None
+
+        img = _decode(value, self.codec, self.backend)
+        with self._stats.get_lock():
+            self._stats[self._HITS] += 1
+            self._stats[self._LOAD_MS] += 1000 * (time.time() - start_ts)
+        return img
+
+    def put(self, key, img, decode_ms=0):
+        """ put a decoded image to this cache,
+            'decode_ms' is the time cost to decode it
+        """
+        with self._stats.get_lock():
+            for i in [self._MISSES, self._TOTAL_MISSES]:
+                self._stats[i] += 1
+            for i in [self._DECODE_MS, self._TOTAL_DECODE_MS]:
+                self._stats[i] += decode_ms
+
+        img = self._shrink(img)
+        self._store.put(key,
+                        _encode(img, self.codec, self.quality, self.backend))
+        return img
+
+    def stats(self, reset=False):
+        """ get statistics of this cache
+
+        Args:
+            @reset (bool): whether to reset statistics after this call
+
+        Returns:
+            dict with 'hits', 'misses', 'hit_rate' and 'saved_ms' which is
+            decode time saved by hits
+        """
+        with self._stats.get_lock():
+            hits, misses, decode_ms, load_ms, total_misses, \
+                total_decode_ms = self._stats[:]
+            if reset:
+                for i in range(self._TOTAL_MISSES):
+                    self._stats[i] = 0
+
+        total = hits + misses
+        avg_decode_ms = total_decode_ms / total_misses \
+            if total_misses > 0 else 0
+        return {
+            'hits': int(hits),
+            'misses': int(misses),
+            'hit_rate': hits / total if total > 0 else 0.0,
+            'decode_ms': decode_ms,
+            'load_ms': load_ms,
+            'saved_ms': max(hits * avg_decode_ms - load_ms, 0),
+        }
+
+    def report(self, reset=True):
+        """ log statistics of this epoch, and reset them by default
+        """
+        st = self.stats(reset=reset)
+        logger.info('decode cache of epoch[%d]: hit_rate[%.4f] with '\
+            'hits[%d] misses[%d], saved %dms of decoding' % (len(
+            self.epoch_stats), st['hit_rate'], st['hits'], st['misses'],
+            st['saved_ms']))
+        if reset:
+            self.epoch_stats.append(st)
+        return st
+
+
+class CachedDecodeImage(object):
+    """ an operator which wraps 'DecodeImage' operator with a DecodeCache
+    """
+
+    def __init__(self, decode_op, cache):
+        """ init
+
+        Args:
+            @decode_op (DecodeImage): the operator to decode images when missed
+            @cache (DecodeCache): cache of decoded images
+        """
+        from . import pil_ops
+        self._decode_op = decode_op
+        self._cache = cache
+        is_pil = isinstance(decode_op, pil_ops.DecodeImage)
+        self._to_pil = is_pil and not decode_op.to_np
+        self._cache.set_backend('pil' if is_pil else 'cv2')
+
+    def __call__(self, img):
+        key = self._cache.make_key(img)
+        decoded = self._cache.get(key)
+        if decoded is None:
+            start_ts = time.time()
+            decoded = np.asarray(self._decode_op(img))
+            decode_ms = 1000 * (time.time() - start_ts)
+            decoded = self._cache.put(key, decoded, decode_ms)
+
+        if self._to_pil:
+            from PIL import Image
+            return Image.fromarray(decoded)
+        else:
+            return decoded
+
+    def make_plan(self, planner):
+        raise NotImplementedError('%s::make_plan not implemented' \
+            % (type(self).__name__))
+
+
+def with_decode_cache(ops, cache):
+    """ replace the leading 'DecodeImage' in 'ops' with a cached one
+
+    Args:
+        @ops (list): list of operator instance
+        @cache (DecodeCache): cache of decoded images
+
+    Returns:
+        new list of operators
+    """
+    from . import pil_ops
+    from . import opencv_ops
+    if len(ops) == 0 or not isinstance(
+            ops[0], (pil_ops.DecodeImage, opencv_ops.DecodeImage)):
+        raise OperatorParamError('decode cache needs the first operator '\
+            'to be DecodeImage')
+
+    return [CachedDecodeImage(ops[0], cache)] + list(ops[1:])
@@ -28,24 +28,96 @@ import functools
 import numpy as np
 from PIL import Image
 import cv2
+import logging
+logger = logging.getLogger(__name__)
 
 from .base import OperatorParamError
 from .base import NormalizeImage
 from .base import ToCHWImage
+from .base import get_rng
+from .base import jpeg_size
+from .base import reduced_scale
+from .base import rand_crop_rect
+from .resize import resize as resize_image
+from .resize import check_interpolation
+from .resize import op_backend
+
+
+# flags of opencv to decode with reduced size
+_reduced_flags = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# whether 'cv2.imdecode' supports reduced flags, which is ignored
+# by some versions of opencv, and PIL will be used in that case
+_cv2_reduced = {'supported': True}
+
+
+def _decode_reduced(img, size, scale):
+    """ decode jpeg 'img' of 'size' to a BGR image reduced by 'scale'
+    """
+    if _cv2_reduced['supported']:
+        data = np.frombuffer(img, dtype='uint8')
+        dec = cv2.imdecode(data, _reduced_flags[scale])
+        if dec is None or dec.shape[1] < size[0]:
+            return dec
+
+        logger.warn('reduced decoding not supported by cv2.imdecode, '\
+            'so switch to PIL')
+        _cv2_reduced['supported'] = False
+
+    dec = Image.open(io.BytesIO(img))
+    dec.draft('RGB', (size[0] // scale, size[1] // scale))
+    dec = np.asarray(dec.convert('RGB'))
+    return cv2.cvtColor(dec, cv2.COLOR_RGB2BGR)
+
+
+def _resize(img, size, interpolation):
+    """ resize with the default interpolation of cv2 if None,
+        otherwise with cv2 for 'interpolation', unless another
+        backend is set by 'resize.set_default_backend'
+    """
+    if interpolation is None:
+        return cv2.resize(img, tuple(size))
+    return resize_image(img, size, interpolation, op_backend('opencv'))
 
 
 class DecodeImage(object):
-    def __init__(self, to_rgb=True, to_np=False, channel_first=False):
+    def __init__(self, to_rgb=True, to_np=False, channel_first=False, \
+            size_hint='auto'):
         self.to_rgb = to_rgb
         self.to_np = to_np  #to numpy
         self.channel_first = channel_first  #only enabled when to_np is True
+        # jpeg images are decoded with a reduced size not smaller than this,
+        # 'auto' means to get it from downstream operators in native plans
+        self.size_hint = size_hint
+        self.auto_size_hint = None
+
+    def get_size_hint(self):
+        """ size hint used to decode images
+        """
+        if self.size_hint == 'auto':
+            return self.auto_size_hint
+        else:
+            return self.size_hint
 
     def __call__(self, img):
         assert type(img) is str and len(
             img) > 0, "invalid input 'img' in DecodeImage"
 
-        data = np.frombuffer(img, dtype='uint8')
-        img = cv2.imdecode(data, 1)  # BGR mode, but need RGB mode
+        scale = 1
+        size_hint = self.get_size_hint()
+        size = jpeg_size(img) if size_hint else None
+        if size is not None:
+            scale = reduced_scale(size, size_hint)
+
+        if scale > 1:
+            img = _decode_reduced(img, size, scale)
+        else:
+            data = np.frombuffer(img, dtype='uint8')
+            img = cv2.imdecode(data, 1)  # BGR mode, but need RGB mode
         if self.to_rgb:
             img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
@@ -56,7 +128,9 @@ class DecodeImage(object):
 
 
 class ResizeImage(object):
-    def __init__(self, size=None, resize_short=None):
+    def __init__(self, size=None, resize_short=None, interpolation=None):
+        self.interpolation = interpolation if interpolation is None else \
+            check_interpolation(interpolation)
         if resize_short is not None and resize_short > 0:
             self.resize_short = resize_short
             self.w = None
@@ -79,10 +153,20 @@ class ResizeImage(object):
             w = self.w
             h = self.h
 
-        return cv2.resize(img, (w, h))
+        return _resize(img, (w, h), self.interpolation)
+
+    def min_input_size(self):
+        """ minimal size of input image needed by this operator
+        """
+        if self.resize_short is not None:
+            return self.resize_short
+        else:
+            return (self.w, self.h)
 
 
 class RotateImage(object):
+    keep_size = True
+
     def __init__(self, rg, rand=True):
         assert type(rg) == int and rg > 0, "only positive interger "\
             "are allowed for RandRotateImage"
@@ -92,7 +176,7 @@ class RotateImage(object):
     def __call__(self, img):
         rg = self.range
         if self.rand:
-            angle = random.randint(-rg, rg)
+            angle = get_rng().randint(-rg, rg)
         else:
             angle = rg
 
@@ -121,7 +205,7 @@ class CropImage(object):
 
 
 class RandCropImage(object):
-    def __init__(self, size, scale=None, ratio=None):
+    def __init__(self, size, scale=None, ratio=None, interpolation=None):
         if type(size) is int:
             self.size = (size, size)  # (h, w)
         else:
@@ -129,42 +213,82 @@ class RandCropImage(object):
 
         self.scale = [0.08, 1.0] if scale is None else scale
         self.ratio = [3. / 4., 4. / 3.] if ratio is None else ratio
+        self.interpolation = interpolation if interpolation is None else \
+            check_interpolation(interpolation)
 
     def __call__(self, img):
-        size = self.size
-        scale = self.scale
-        ratio = self.ratio
+        img_h, img_w = img.shape[:2]
+        i, j, w, h = rand_crop_rect(img_w, img_h, self.scale, self.ratio,
+                                    get_rng())
 
-        aspect_ratio = math.sqrt(random.uniform(*ratio))
-        w = 1. * aspect_ratio
-        h = 1. / aspect_ratio
+        img = img[j:j + h, i:i + w, :]
+        return _resize(img, self.size, self.interpolation)
 
-        img_h, img_w = img.shape[:2]
+    def min_input_size(self):
+        """ short edge of input image to keep enough pixels
+            for the smallest area to crop
+        """
+        min_ratio = min(self.ratio[0], 1. / self.ratio[1])
+        return int(math.ceil(max(self.size) / \
+            math.sqrt(self.scale[0] * min_ratio)))
 
-        bound = min((float(img_w) / img_h) / (w**2),
-                    (float(img_h) / img_w) / (h**2))
-        scale_max = min(scale[1], bound)
-        scale_min = min(scale[0], bound)
 
-        target_area = img_w * img_h * random.uniform(\
-            scale_min, scale_max)
-        target_size = math.sqrt(target_area)
-        w = int(target_size * w)
-        h = int(target_size * h)
+class DecodeRandCropImage(object):
+    """ decode and random crop an image, which is the same as 'DecodeImage'
+        followed by 'RandCropImage', but the crop window is picked with the
+        size in jpeg header, so jpeg images can be decoded with a reduced size
+    """
 
-        i = random.randint(0, img_w - w)
-        j = random.randint(0, img_h - h)
+    def __init__(self, size, scale=None, ratio=None, to_rgb=True, \
+            interpolation=None):
+        if type(size) is int:
+            self.size = (size, size)
+        else:
+            self.size = size
 
-        img = img[j:j + h, i:i + w, :]
-        return cv2.resize(img, size)
+        self.scale = [0.08, 1.0] if scale is None else scale
+        self.ratio = [3. / 4., 4. / 3.] if ratio is None else ratio
+        self.to_rgb = to_rgb
+        self.interpolation = interpolation if interpolation is None else \
+            check_interpolation(interpolation)
+
+    def __call__(self, img):
+        assert type(img) is str and len(
+            img) > 0, "invalid input 'img' in DecodeRandCropImage"
+
+        size = jpeg_size(img)
+        if size is None:
+            # not a jpeg, so decode the whole image before cropping
+            img = cv2.imdecode(np.frombuffer(img, dtype='uint8'), 1)
+            size = (img.shape[1], img.shape[0])
+
+        i, j, w, h = rand_crop_rect(size[0], size[1], self.scale, self.ratio,
+                                    get_rng())
+        if type(img) is str:
+            scale = reduced_scale((w, h), self.size)
+            if scale > 1:
+                img = _decode_reduced(img, size, scale)
+            else:
+                img = cv2.imdecode(np.frombuffer(img, dtype='uint8'), 1)
+
+        # map the window to the reduced image
+        fx = float(img.shape[1]) / size[0]
+        fy = float(img.shape[0]) / size[1]
+        img = img[int(j * fy):int((j + h) * fy), int(i * fx):int((i + w) * fx)]
+        if self.to_rgb:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        return _resize(img, self.size, self.interpolation)
 
 
 class RandFlipImage(object):
+    keep_size = True
+
     def __init__(self, flip_dir=None):
         self.flip_dir = flip_dir if flip_dir is not None else Image.FLIP_LEFT_RIGHT
 
     def __call__(self, img):
-        if random.randint(0, 1) == 1:
+        if get_rng().randint(0, 1) == 1:
             if self.flip_dir == Image.FLIP_LEFT_RIGHT:
                 return cv2.flip(img, 0)
             else:
@@ -36,19 +36,70 @@ logger = logging.getLogger(__name__)
 from .base import OperatorParamError
 from .base import NormalizeImage
 from .base import ToCHWImage
+from .base import get_rng
+from .base import reduced_scale
+from .base import rand_crop_rect
+from .resize import resize as resize_image
+from .resize import check_interpolation
+from .resize import op_backend
+from .resize import cv2_flags
+
+
+def rotate_hue(img, delta):
+    """ rotate hue of a RGB image by 'delta' turns
+    """
+    mode = img.mode
+    h, s, v = img.convert('HSV').split()
+    shift = int(round((delta % 1.0) * 256))
+    h = h.point(lambda x: (x + shift) % 256)
+    return Image.merge('HSV', (h, s, v)).convert(mode)
+
+
+def _resize(img, size, interpolation):
+    """ resize with LANCZOS of PIL by default, otherwise
+        with PIL for 'interpolation', unless another backend
+        is set by 'resize.set_default_backend'
+    """
+    if interpolation is None:
+        return img.resize(size, Image.LANCZOS)
+    return resize_image(img, size, interpolation, op_backend('pil'))
+
+
+def _cv2_flag(interpolation):
+    return cv2_flags['lanczos' if interpolation is None else interpolation]
 
 
 class DecodeImage(object):
-    def __init__(self, to_rgb=True, to_np=False, channel_first=False):
+    def __init__(self, to_rgb=True, to_np=False, channel_first=False, \
+            size_hint='auto'):
         self.to_rgb = to_rgb
         self.to_np = to_np  #to numpy
         self.channel_first = channel_first  #only enabled when to_np is True
+        # jpeg images are decoded with a reduced size not smaller than this,
+        # 'auto' means to get it from downstream operators in native plans
+        self.size_hint = size_hint
+        self.auto_size_hint = None
+
+    def get_size_hint(self):
+        """ size hint used to decode images
+        """
+        if self.size_hint == 'auto':
+            return self.auto_size_hint
+        else:
+            return self.size_hint
 
     def __call__(self, img):
         assert type(img) is str and len(
             img) > 0, "invalid input 'img' in DecodeImage"
         stream = io.BytesIO(img)
         img = Image.open(stream)
+        size_hint = self.get_size_hint()
+        if size_hint and img.format == 'JPEG':
+            scale = reduced_scale(img.size, size_hint)
+            if scale > 1:
+                mode = 'RGB' if self.to_rgb else img.mode
+                img.draft(mode, (img.size[0] // scale, img.size[1] // scale))
+
         if self.to_rgb and img.mode != 'RGB':
             img = img.convert('RGB')
 
@@ -62,11 +113,13 @@ class DecodeImage(object):
     def make_plan(self, planner):
         """ plan pipeline of operators using 'planner'
         """
-        return planner.decode(self.to_rgb)
+        return planner.decode(self.to_rgb, size_hint=self.get_size_hint())
 
 
 class ResizeImage(object):
-    def __init__(self, size=None, resize_short=None):
+    def __init__(self, size=None, resize_short=None, interpolation=None):
+        self.interpolation = interpolation if interpolation is None else \
+            check_interpolation(interpolation)
         if resize_short is not None and resize_short > 0:
             self.resize_short = resize_short
             self.w = None
@@ -90,17 +143,27 @@ class ResizeImage(object):
             w = self.w
             h = self.h
 
-        return img.resize((w, h), Image.LANCZOS)
+        return _resize(img, (w, h), self.interpolation)
 
     def make_plan(self, planner):
-        intp = 'INTER_LANCZOS4'
+        intp = _cv2_flag(self.interpolation)
         if self.resize_short is not None:
             return planner.resize_short(self.resize_short, interpolation=intp)
         else:
             return planner.resize(self.w, self.h, interpolation=intp)
 
+    def min_input_size(self):
+        """ minimal size of input image needed by this operator
+        """
+        if self.resize_short is not None:
+            return self.resize_short
+        else:
+            return (self.w, self.h)
+
 
 class RotateImage(object):
+    keep_size = True
+
     def __init__(self, rg, rand=True):
         assert type(rg) == int and rg > 0, "only positive interger "\
             "are allowed for RandRotateImage"
@@ -112,7 +175,7 @@ class RotateImage(object):
             img, Image.Image), "invalid input 'img' in RandRotateImage"
         rg = self.range
         if self.rand:
-            angle = random.randint(-rg, rg)
+            angle = get_rng().randint(-rg, rg)
         else:
             angle = rg
 
@@ -149,7 +212,7 @@ class CropImage(object):
 
 
 class RandCropImage(object):
-    def __init__(self, size, scale=None, ratio=None):
+    def __init__(self, size, scale=None, ratio=None, interpolation=None):
         if type(size) is int:
             self.size = (size, size)
         else:
@@ -157,50 +220,98 @@ class RandCropImage(object):
 
         self.scale = [0.08, 1.0] if scale is None else scale
         self.ratio = [3. / 4., 4. / 3.] if ratio is None else ratio
+        self.interpolation = interpolation if interpolation is None else \
+            check_interpolation(interpolation)
 
     def __call__(self, img):
         assert isinstance(img,
                           Image.Image), "invalid input 'img' in RandCropImage"
 
-        size = self.size
-        scale = self.scale
-        ratio = self.ratio
+        i, j, w, h = rand_crop_rect(img.size[0], img.size[1], self.scale,
+                                    self.ratio, get_rng())
 
-        aspect_ratio = math.sqrt(random.uniform(*ratio))
-        w = 1. * aspect_ratio
-        h = 1. / aspect_ratio
+        img = img.crop((i, j, i + w, j + h))
+        return _resize(img, self.size, self.interpolation)
 
-        bound = min((float(img.size[0]) / img.size[1]) / (w**2),
-                    (float(img.size[1]) / img.size[0]) / (h**2))
-        scale_max = min(scale[1], bound)
-        scale_min = min(scale[0], bound)
+    def make_plan(self, planner):
+        return planner.random_crop(
+            self.size,
+            scale=self.scale,
+            ratio=self.ratio,
+            interpolation=_cv2_flag(self.interpolation))
+
+    def min_input_size(self):
+        """ short edge of input image to keep enough pixels
+            for the smallest area to crop
+        """
+        min_ratio = min(self.ratio[0], 1. / self.ratio[1])
+        return int(math.ceil(max(self.size) / \
+            math.sqrt(self.scale[0] * min_ratio)))
 
-        target_area = img.size[0] * img.size[1] * random.uniform(scale_min,
-                                                                 scale_max)
-        target_size = math.sqrt(target_area)
-        w = int(target_size * w)
-        h = int(target_size * h)
 
-        i = random.randint(0, img.size[0] - w)
-        j = random.randint(0, img.size[1] - h)
+class DecodeRandCropImage(object):
+    """ decode and random crop an image, which is the same as 'DecodeImage'
+        followed by 'RandCropImage', but the crop window is picked with the
+        size in image header, so jpeg images can be decoded with a reduced
+        size, and only the cropped area is decoded in native_thread mode
+    """
 
-        img = img.crop((i, j, i + w, j + h))
-        img = img.resize(size, Image.LANCZOS)
-        return img
+    def __init__(self, size, scale=None, ratio=None, to_rgb=True, \
+            interpolation=None):
+        if type(size) is int:
+            self.size = (size, size)
+        else:
+            self.size = size
+
+        self.scale = [0.08, 1.0] if scale is None else scale
+        self.ratio = [3. / 4., 4. / 3.] if ratio is None else ratio
+        self.to_rgb = to_rgb
+        self.interpolation = interpolation if interpolation is None else \
+            check_interpolation(interpolation)
+
+    def __call__(self, img):
+        assert type(img) is str and len(
+            img) > 0, "invalid input 'img' in DecodeRandCropImage"
+        img = Image.open(io.BytesIO(img))
+        img_w, img_h = img.size
+        i, j, w, h = rand_crop_rect(img_w, img_h, self.scale, self.ratio,
+                                    get_rng())
+
+        if img.format == 'JPEG':
+            scale = reduced_scale((w, h), self.size)
+            if scale > 1:
+                mode = 'RGB' if self.to_rgb else img.mode
+                img.draft(mode, (img_w // scale, img_h // scale))
+
+        # map the window to the reduced image
+        fx = float(img.size[0]) / img_w
+        fy = float(img.size[1]) / img_h
+        img = img.crop((int(i * fx), int(j * fy), int((i + w) * fx),
+                        int((j + h) * fy)))
+        if self.to_rgb and img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        return _resize(img, self.size, self.interpolation)
 
     def make_plan(self, planner):
-        return planner.random_crop(
-            self.size, scale=self.scale, ratio=self.ratio)
+        return planner.decode_random_crop(
+            self.size,
+            scale=self.scale,
+            ratio=self.ratio,
+            to_rgb=self.to_rgb,
+            interpolation=_cv2_flag(self.interpolation))
 
 
 class RandFlipImage(object):
+    keep_size = True
+
     def __init__(self, flip_dir=None):
         self.flip_dir = flip_dir if flip_dir is not None else Image.FLIP_LEFT_RIGHT
 
     def __call__(self, img):
         assert isinstance(img,
                           Image.Image), "invalid input 'img' in RandFlipImage"
-        if random.randint(0, 1) == 1:
+        if get_rng().randint(0, 1) == 1:
             return img.transpose(self.flip_dir)
         else:
             return img
@@ -218,38 +329,56 @@ class RandFlipImage(object):
 
 
 class RandDistortColor(object):
+    keep_size = True
+
     def __init__(self, brightness=[0.5, 1.5],\
-        contrast=[0.5, 1.5], color=[0.5, 1.5]):
+        contrast=[0.5, 1.5], color=[0.5, 1.5], hue=None):
+        self.brightness = brightness
+        self.contrast = contrast
+        self.color = color
+        self.hue = hue
+
         def random_brightness(img):
             """ random_brightness """
             lower, upper = brightness
-            e = random.uniform(lower, upper)
+            e = get_rng().uniform(lower, upper)
             return ImageEnhance.Brightness(img).enhance(e)
 
         def random_contrast(img):
             """ random_contrast """
             lower, upper = contrast
-            e = random.uniform(lower, upper)
+            e = get_rng().uniform(lower, upper)
             return ImageEnhance.Contrast(img).enhance(e)
 
         def random_color(img):
             """ random_color """
             lower, upper = color
-            e = random.uniform(lower, upper)
+            e = get_rng().uniform(lower, upper)
             return ImageEnhance.Color(img).enhance(e)
 
+        def random_hue(img):
+            """ random_hue """
+            lower, upper = hue
+            e = get_rng().uniform(lower, upper)
+            return rotate_hue(img, e)
+
         self.ops = [random_brightness, random_contrast, random_color]
+        if hue is not None:
+            self.ops.append(random_hue)
 
     def __call__(self, img):
         assert isinstance(
             img, Image.Image), "invalid input 'img' in RandomFlipImage"
         ops = copy.copy(self.ops)
-        random.shuffle(ops)
+        get_rng().shuffle(ops)
         for f in ops:
             img = f(img)
 
         return img
 
     def make_plan(self, planner):
-        raise NotImplementedError('%s.make_plan not implemented' \
-            % (type(self).__name__))
+        return planner.distort_color(
+            brightness=self.brightness,
+            contrast=self.contrast,
+            saturation=self.color,
+            hue=self.hue)
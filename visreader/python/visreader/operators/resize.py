@@ -0,0 +1,203 @@
+"""
+# Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+"""
+# resize images with backends 'pil'(maybe Pillow-SIMD) or 'opencv', operators
+# use the library of their op class by default, and the fastest backend for
+# each interpolation can be opted in by 'set_default_backend('auto')', which
+# picks it by timing both of them on a small image, note that:
+#   1, outputs of different backends are not close, eg: PIL antialiases when
+#      downscaling but opencv does not, so 'auto' breaks reproducibility
+#      if the backend picked differs between runs
+#   2, images are returned in the same type as input, so the cost
+#      of converting between PIL.Image and ndarray is counted in timing
+"""
+
+import time
+import numpy as np
+from PIL import Image
+import logging
+
+from .base import OperatorParamError
+
+logger = logging.getLogger(__name__)
+
+INTERPOLATIONS = ['nearest', 'bilinear', 'bicubic', 'area', 'lanczos']
+
+BACKENDS = ['auto', 'pil', 'opencv']
+
+# filters of PIL for each interpolation
+pil_filters = {
+    'nearest': Image.NEAREST,
+    'bilinear': Image.BILINEAR,
+    'bicubic': Image.BICUBIC,
+    'area': getattr(Image, 'BOX', Image.BILINEAR),
+    'lanczos': Image.LANCZOS,
+}
+
+# names of opencv flags for each interpolation, also used by native planner
+cv2_flags = {
+    'nearest': 'INTER_NEAREST',
+    'bilinear': 'INTER_LINEAR',
+    'bicubic': 'INTER_CUBIC',
+    'area': 'INTER_AREA',
+    'lanczos': 'INTER_LANCZOS4',
+}
+
+# backend used by operators, None means the library of their op class
+default_backend = None
+
+# fastest backend found for (interpolation, input type)
+_fastest = {}
+
+
+def check_interpolation(interpolation):
+    """ check whether 'interpolation' is supported
+    """
+    if interpolation not in INTERPOLATIONS:
+        raise OperatorParamError('not supported interpolation[%s], '\
+            'supported are %s' % (str(interpolation), str(INTERPOLATIONS)))
+    return interpolation
+
+
+def is_pillow_simd():
+    """ whether PIL is provided by Pillow-SIMD
+    """
+    import PIL
+    return '.post' in getattr(PIL, '__version__', '')
+
+
+def _has_cv2():
+    try:
+        import cv2
+        return True
+    except ImportError as e:
+        return False
+
+
+def _pil_resize(img, size, interpolation):
+    to_np = isinstance(img, np.ndarray)
+    if to_np:
+        img = Image.fromarray(img)
+    img = img.resize(size, pil_filters[interpolation])
+    return np.asarray(img) if to_np else img
+
+
+def _cv2_resize(img, size, interpolation):
+    import cv2
+    to_pil = isinstance(img, Image.Image)
+    if to_pil:
+        img = np.asarray(img)
+    flag = getattr(cv2, cv2_flags[interpolation])
+    img = cv2.resize(img, tuple(size), interpolation=flag)
+    return Image.fromarray(img) if to_pil else img
+
+
+_resizers = {'pil': _pil_resize, 'opencv': _cv2_resize}
+
+
+def _time(func, img, size, interpolation, times=5):
+    func(img, size, interpolation)  # warm up
+    start_ts = time.time()
+    for i in xrange(times):
+        func(img, size, interpolation)
+    return time.time() - start_ts
+
+
+def fastest_backend(interpolation, to_pil=True):
+    """ get the fastest backend to resize images with 'interpolation'
+
+    Args:
+        @interpolation (str): one of INTERPOLATIONS
+        @to_pil (bool): whether the images are PIL.Image or ndarray
+
+    Returns:
+        'pil' or 'opencv'
+    """
+    key = (interpolation, to_pil)
+    if key in _fastest:
+        return _fastest[key]
+
+    if not _has_cv2():
+        _fastest[key] = 'pil'
+        return 'pil'
+
+    img = np.random.randint(0, 256, (384, 512, 3)).astype('uint8')
+    if to_pil:
+        img = Image.fromarray(img)
+
+    costs = {}
+    for name, func in _resizers.items():
+        costs[name] = _time(func, img, (224, 224), interpolation)
+
+    fastest = min(costs, key=costs.get)
+    logger.info('use backend[%s] to resize with interpolation[%s], '\
+        'costs:%s, pillow-simd:%s' % (fastest, interpolation, str(costs),
+        is_pillow_simd()))
+    _fastest[key] = fastest
+    return fastest
+
+
+def set_default_backend(backend):
+    """ set the backend used by operators, and the fastest backends are
+        picked at once for 'auto', so that workers forked later share them
+
+    Args:
+        @backend (str): 'pil', 'opencv', 'auto' to use the fastest one,
+            or None to use the library of the op class
+    """
+    global default_backend
+    if backend is not None and backend not in BACKENDS:
+        raise OperatorParamError('not supported resize backend[%s]' %
+                                 (backend))
+
+    if backend == 'auto':
+        for interpolation in INTERPOLATIONS:
+            for to_pil in [True, False]:
+                fastest_backend(interpolation, to_pil)
+    default_backend = backend
+
+
+def op_backend(own):
+    """ backend used by operators whose own library is 'own'
+    """
+    return own if default_backend is None else default_backend
+
+
+def resize(img, size, interpolation, backend=None):
+    """ resize 'img' to 'size'
+
+    Args:
+        @img (PIL.Image or ndarray): image to resize
+        @size (tuple): (w, h) to resize to
+        @interpolation (str): one of INTERPOLATIONS
+        @backend (str): 'pil', 'opencv' or 'auto' to use the fastest one,
+            None means to use 'default_backend', or 'pil' for PIL.Image
+            and 'opencv' for ndarray if it is None too
+
+    Returns:
+        resized image in the same type as 'img'
+    """
+    backend = default_backend if backend is None else backend
+    if backend is None:
+        backend = 'pil' if isinstance(img, Image.Image) else 'opencv'
+    if backend == 'auto':
+        backend = fastest_backend(interpolation,
+                                  isinstance(img, Image.Image))
+    elif backend not in _resizers:
+        raise OperatorParamError('not supported resize backend[%s]' %
+                                 (backend))
+
+    return _resizers[backend](img, size, interpolation)
@@ -16,15 +16,18 @@
 
 __all__ = [
     'map_readers', 'buffered', 'compose', 'chain', 'shuffle', 'xmap_reader',
-    'Xmap'
+    'Xmap', 'fanout'
 ]
 
 from threading import Thread
+from threading import Event
+from threading import Lock
 import subprocess
 import weakref
 import time
 from multiprocessing.util import Finalize
 from Queue import Queue
+from Queue import Full
 import itertools
 import random
 import copy
@@ -63,7 +66,7 @@ class ReaderEndSignal(object):
     pass
 
 
-def shuffle(reader, buf_size):
+def shuffle(reader, buf_size, rng=None, hooks=None):
     """
     Creates a data reader whose data output is shuffled.
     Output from the iterator that created by original reader will be
@@ -73,21 +76,36 @@ def shuffle(reader, buf_size):
     :type reader: callable
     :param buf_size: shuffle buffer size
     :type buf_size: int
+    :param rng: random generator used to shuffle, default to module 'random'
+    :type rng: random.Random
+    :param hooks: tracker of windows to replay from, see 'ReplayTracker'
+    :type hooks: object
     :return: the new reader whose output is shuffled.
     :rtype: callable
     """
 
     assert buf_size > 0, "invalid buf_size in shuffle" % (buf_size)
+    rng = random if rng is None else rng
     end = ReaderEndSignal()
 
     def _start_prefetch(rd, inq, outq):
         def _fetcher(rd, inq, outq):
-            for i, d in enumerate(rd()):
+            it = rd()
+            i = 0
+            while True:
+                if hooks is not None and i % buf_size == 0:
+                    hooks.window(i)
+                try:
+                    d = next(it)
+                except StopIteration:
+                    break
+
                 if i >= inq.maxsize:
                     if isinstance(inq.get(), ReaderEndSignal):
                         break
 
                 outq.put(d)
+                i += 1
             outq.put(end)
 
         p = Thread(target=_fetcher, args=(rd, inq, outq))
@@ -99,6 +117,15 @@ def shuffle(reader, buf_size):
         data_q = Queue(buf_size)
         _start_prefetch(reader, token_q, data_q)
 
+        # samples of the first window which are consumed before resuming
+        skip = hooks.skip() if hooks is not None else 0
+        window = 0
+
+        def _shuffle(buf):
+            if hooks is not None:
+                hooks.shuffled(window)
+            rng.shuffle(buf)
+
         stopped = False
         buf = []
         yield_buf = []
@@ -108,18 +135,23 @@ def shuffle(reader, buf_size):
                 if not isinstance(e, ReaderEndSignal):
                     buf.append(e)
                     if len(buf) >= buf_size:
-                        random.shuffle(buf)
+                        _shuffle(buf)
+                        window += 1
                         yield_buf += buf
                         buf = []
                 else:
                     stopped = True
                     if buf:
-                        random.shuffle(buf)
+                        _shuffle(buf)
                         yield_buf += buf
                         buf = []
 
             if len(yield_buf) > 0:
-                yield yield_buf.pop(0)
+                e = yield_buf.pop(0)
+                if skip > 0:
+                    skip -= 1
+                else:
+                    yield e
                 token_q.put(True)  #need more
             elif stopped:
                 break
@@ -127,7 +159,7 @@ def shuffle(reader, buf_size):
     return _reader
 
 
-def echo(reader, times, size=0, copy_func=None):
+def echo(reader, times, size=0, copy_func=None, rng=None):
     """
     Repeat samples for several times specified by 'times',
     and then shuffle them in a range specified by 'size',
@@ -141,11 +173,14 @@ def echo(reader, times, size=0, copy_func=None):
     :type size: int
     :param copy_func: function to copy data when echoing
     :type copy_func: callable
+    :param rng: random generator used to shuffle, default to module 'random'
+    :type rng: random.Random
     :return: the new reader whose output is echoed.
     :rtype: callable
     """
 
     assert times > 0, "invalid param of times[%d] to echo" % (times)
+    rng = random if rng is None else rng
 
     copy_func = copy.deepcopy if copy_func is None else copy_func
 
@@ -183,7 +218,7 @@ def echo(reader, times, size=0, copy_func=None):
             pos = (pos + 1) % len(index)
             if pos == len(index):
                 index = list(range(len(sample_buf)))
-                random.shuffle(index)
+                rng.shuffle(index)
 
             which = index[pos] % len(sample_buf)
             sample = sample_buf[which]
@@ -286,6 +321,122 @@ def buffered(reader, size):
     return data_reader
 
 
+class _FanoutState(object):
+    """ state shared by the driver and consumers of 'fanout',
+        the driver is stopped after all consumers are closed
+    """
+
+    def __init__(self, num_consumers):
+        self.stop = Event()
+        self._active = num_consumers
+        self._lock = Lock()
+
+    def release(self):
+        """ called once by each consumer when it is closed
+        """
+        with self._lock:
+            self._active -= 1
+            if self._active <= 0:
+                self.stop.set()
+
+
+class FanoutIter(object):
+    """ one of the iterators created by 'fanout', which only
+        contends with other consumers on dequeue
+    """
+
+    def __init__(self, queue, state):
+        self._queue = queue
+        self._state = state
+        self._stopped = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """ next """
+        if self._stopped:
+            raise StopIteration
+
+        e = self._queue.get()
+        if isinstance(e, XmapEndSignal):
+            self.close()
+            if e.get_errno() != 0:
+                raise DecoratorError(e.get_errmsg())
+            raise StopIteration
+
+        return e
+
+    __next__ = next
+
+    def close(self):
+        """ stop consuming from this iterator, the driver thread exits
+            without reading the rest when all iterators are closed
+        """
+        if not self._stopped:
+            self._stopped = True
+            self._state.release()
+
+    def __del__(self):
+        self.close()
+
+
+def fanout(reader, num_consumers, buffer_size=None):
+    """
+    Creates 'num_consumers' iterators which share the output of one pass of 'reader',
+    a driver thread pulls samples from 'reader' and pushes them into a queue,
+    so every sample is delivered to exactly one of the iterators which is ready
+    to consume it.
+    :param reader: the data reader to read from.
+    :type reader: callable
+    :param num_consumers: number of iterators to create
+    :type num_consumers: int
+    :param buffer_size: max number of samples buffered in the queue,
+                        default to 2 * num_consumers
+    :type buffer_size: int
+    :returns: list of iterators, consumers which stop early should 'close'
+              their iterators or drop them, so the driver thread can exit
+    """
+    assert num_consumers > 0, "invalid param num_consumers[%d] for fanout" \
+        % (num_consumers)
+    if buffer_size is None:
+        buffer_size = 2 * num_consumers
+
+    q = Queue(maxsize=buffer_size)
+    state = _FanoutState(num_consumers)
+
+    def _put(e):
+        # wake up periodically to check whether all consumers are closed
+        while not state.stop.is_set():
+            try:
+                q.put(e, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _driver():
+        end = XmapEndSignal(errmsg='ok', errno=0)
+        try:
+            for d in reader():
+                if not _put(d):
+                    return
+        except Exception as e:
+            stack_info = traceback.format_exc()
+            logger.warn('exception occured in fanout driver with '\
+                'stack info[%s]' % (stack_info))
+            end = XmapEndSignal(stack_info, -1)
+
+        for _ in xrange(num_consumers):
+            if not _put(end):
+                return
+
+    t = Thread(target=_driver)
+    t.daemon = True
+    t.start()
+    return [FanoutIter(q, state) for _ in xrange(num_consumers)]
+
+
 class XmapEndSignal(ValueError):
     """ XmapEndSignal
     """
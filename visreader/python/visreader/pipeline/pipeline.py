@@ -19,6 +19,7 @@
 
 import types
 import json
+import random
 import functools
 import logging
 import traceback
@@ -167,15 +168,138 @@ class Context(object):
         self.out_num = value
 
 
+class ReplayTracker(object):
+    """ track points to replay the current pass of a transformed reader from,
+        which are taken at the start of the pass and, if the pipeline allows,
+        at the start of every window read by the first 'shuffle' (or by the
+        source if no shuffle), so a restarted pipeline re-reads at most
+        one window to restore the samples buffered by transformations
+    """
+    # window size used when no shuffle in the pipeline
+    DEFAULT_WINDOW = 1000
+
+    def __init__(self, source, window_size=None, rng=None, factor=1):
+        """ init
+
+        Args:
+            source (callable): reader of a 'DataSource'
+            window_size (int): samples in a window, None if the pipeline
+                can only be replayed from the start of a pass
+            rng (random.Random): generator of the shuffle reading windows
+            factor (int): num of window samples in an output sample,
+                eg: size of a batch after the shuffle
+        """
+        self.source = source
+        self.window_size = window_size
+        self.rng = rng
+        self.factor = factor
+        self.consumed = 0  # num of output samples consumed in current pass
+        self.base = 0  # index of the first window read in current pass
+        self._skip = 0
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def start_pass(self, consumed=0, window=0, skip=0):
+        """ called at the start of a pass, which is resumed from the
+            'skip'th sample of 'window' with 'consumed' samples output
+        """
+        self.consumed = consumed
+        self.base = window
+        self._skip = skip
+        with self._lock:
+            self._windows = {}
+
+    def skip(self):
+        """ num of samples to skip in the first window, which is called
+            by the reader of windows at the start of a pass
+        """
+        skip, self._skip = self._skip, 0
+        return skip
+
+    def window(self, index):
+        """ called before reading the 'index'th sample in current pass
+            when it starts a new window
+        """
+        k = self.base + index // self.window_size
+        oldest = self.consumed * self.factor // self.window_size - 1
+        with self._lock:
+            for w in [w for w in self._windows if w < oldest]:
+                del self._windows[w]
+            self._windows[k] = {'source': self.source.state_dict()}
+
+    def shuffled(self, index):
+        """ called before shuffling the 'index'th window in current pass
+        """
+        with self._lock:
+            w = self._windows.get(self.base + index)
+            if w is not None:
+                w['rng'] = self.rng.getstate()
+
+    def replay_point(self):
+        """ get the window and the num of samples to skip in it for
+            samples consumed in current pass, None if not available
+        """
+        if self.window_size is None:
+            return None
+
+        n = self.consumed * self.factor
+        k, skip = n // self.window_size, n % self.window_size
+        if skip == 0 and k > self.base:
+            # samples of window 'k' maybe not shuffled yet
+            k, skip = k - 1, self.window_size
+
+        with self._lock:
+            w = self._windows.get(k)
+            if w is None or (self.rng is not None and 'rng' not in w):
+                return None
+            return k, skip, dict(w)
+
+    def tap(self, reader):
+        """ read windows from 'reader' directly when no shuffle
+        """
+
+        def _reader():
+            skip = self.skip()
+            it = reader()
+            i = 0
+            while True:
+                if i % self.window_size == 0:
+                    self.window(i)
+                try:
+                    r = next(it)
+                except StopIteration:
+                    break
+
+                i += 1
+                if skip > 0:
+                    skip -= 1
+                else:
+                    yield r
+
+        return _reader
+
+
 class Pipeline(object):
     """ a class to facilitate chainning the transformations applied to 'reader'
     """
 
-    def __init__(self, reader=None, threadsafe=False):
+    def __init__(self, reader=None, threadsafe=False, seed=None):
         """ init
+
+        Args:
+            reader (callable): a reader to provide data records
+            threadsafe (bool): whether the transformed reader is thread safe
+            seed (int): seed for random generators of 'shuffle' and 'echo',
+                        not deterministic if None
         """
         self._reader = reader
         self.threadsafe = threadsafe
+        self.seed = seed
+        self._source = None
+        self._pending_state = None
+        self._pass_start = None
+        self._seeded = []
+        self._tracker = None
         self.reset()
 
     def reset(self, reader=None):
@@ -193,6 +317,14 @@ class Pipeline(object):
         self._transformed = None
         self._pipeline = []
 
+    def _make_rng(self):
+        """ make a random generator for the next transformation in pipeline
+        """
+        if self.seed is None:
+            return random.Random()
+        else:
+            return random.Random(self.seed + len(self._pipeline))
+
     def shuffle(self, size):
         """ shuffle the records in range of 'size'
 
@@ -209,7 +341,10 @@ class Pipeline(object):
             None
         """
         if size != 0:
-            self._pipeline.append(('shuffle', {'size': size}))
+            self._pipeline.append(('shuffle', {
+                'size': size,
+                'rng': self._make_rng()
+            }))
         else:
             #0 means no shuffle
             pass
@@ -234,7 +369,8 @@ class Pipeline(object):
         self._pipeline.append(('echo', {
             'size': size,
             'times': times,
-            'copy_func': copy_func
+            'copy_func': copy_func,
+            'rng': self._make_rng()
         }))
 
         return self
@@ -283,7 +419,10 @@ class Pipeline(object):
         """
         from ..operators import build
         reader_mapper = build(ops, *args, **kwargs)
-        return self.map(reader_mapper=reader_mapper)
+        self.map(reader_mapper=reader_mapper)
+        # one output for each input which makes it replayable by counting
+        self._pipeline[-1][1]['one_to_one'] = True
+        return self
 
     def filter(self, f):
         """ do a filtering 'f' on every record in this reader,
@@ -381,17 +520,29 @@ class Pipeline(object):
             PipelineError when not supported op_name appears
         """
         assert callable(reader), "source reader is not a valid function"
+        self._source = reader if hasattr(reader, 'state_dict') else None
+        self._seeded = []
+        self._tracker = None
+        anchor = -1
+        if self._source is not None:
+            anchor, self._tracker = self._make_tracker()
+
         rd = reader
-        for op_name, param in self._pipeline:
+        if anchor < 0 and self._tracker is not None and \
+                self._tracker.window_size is not None:
+            rd = self._tracker.tap(rd)
+
+        for i, (op_name, param) in enumerate(self._pipeline):
             if op_name == 'buffered':
                 rd = decorator.buffered(rd, param['size'])
             elif op_name == 'cache':
                 rd = cache_reader(rd, param['where'])
             elif op_name == 'shuffle':
-                rd = decorator.shuffle(rd, param['size'])
+                hooks = self._tracker if i == anchor else None
+                rd = decorator.shuffle(rd, param['size'], param['rng'], hooks)
             elif op_name == 'echo':
                 rd = decorator.echo(rd, param['times'], param['size'],
-                                    param['copy_func'])
+                                    param['copy_func'], param['rng'])
             elif op_name == 'batch':
                 rd = _batch(rd, param['size'], param['drop'])
             elif op_name == 'map':
@@ -399,6 +550,9 @@ class Pipeline(object):
                     rd = decorator.map_readers(param['record_mapper'], rd)
                 else:
                     rd = param['reader_mapper'](rd)
+                    # readers which attach seeds of samples have states
+                    if hasattr(rd, 'state_dict'):
+                        self._seeded.append((rd, self._batch_factor(i)))
             elif op_name == 'filter':
                 rd = filter_reader(param['func'], rd)
             elif op_name == 'xmap':
@@ -413,10 +567,20 @@ class Pipeline(object):
                 raise PipelineError('not supported trasnfromation[%s]' %
                                     (op_name))
 
+        tracker = self._tracker
+
         def _guard_reader():
             while True:
+                skip = 0
+                if tracker is not None:
+                    skip = self._start_pass()
                 try:
                     for i in rd():
+                        if skip > 0:
+                            skip -= 1
+                            continue
+                        if tracker is not None:
+                            tracker.consumed += 1
                         yield i
                 except Exception as e:
                     stack_info = traceback.format_exc()
@@ -430,14 +594,20 @@ class Pipeline(object):
             _guard_reader) if self.threadsafe else _guard_reader
         return _guard_reader
 
-    def reader(self, infinite=False):
+    def reader(self, infinite=False, num_consumers=None, buffer_size=None):
         """ get the transformed reader from 'self._reader'
 
         Args:
-            None
+            infinite (bool): whether to repeat the reader forever
+            num_consumers (int): if not None, return this number of iterators
+                which share one pass of the transformed reader,
+                and each of them can be consumed by a different thread,
+                iterators which are not exhausted should be closed
+            buffer_size (int): max number of samples buffered for consumers
 
         Returns:
-            reader (callable): transformed reader
+            reader (callable): transformed reader if 'num_consumers' is None,
+                otherwise a list of iterators
 
         Raises:
             None
@@ -445,7 +615,178 @@ class Pipeline(object):
         if self._transformed is None:
             self._transformed = self.transform(self._reader, infinite)
 
-        return self._transformed
+        if num_consumers is None:
+            return self._transformed
+
+        # only the driver thread of 'fanout' reads it, so no lock is needed
+        rd = self._transformed
+        if isinstance(rd, SafeIter):
+            rd = rd.it
+        return decorator.fanout(rd, num_consumers, buffer_size)
+
+    def _batch_factor(self, index):
+        """ num of samples output by the 'index'th transformation in
+            one sample output by the pipeline
+        """
+        factor = 1
+        for op_name, param in self._pipeline[index + 1:]:
+            if op_name == 'batch':
+                factor *= param['size']
+        return factor
+
+    def _make_tracker(self):
+        """ make a tracker of replay points for this pipeline, windows are
+            used only when transformations before the first shuffle keep
+            no samples and those after it output samples by counting
+
+        Returns:
+            (index of the shuffle reading windows or -1, ReplayTracker)
+        """
+        names = [op_name for op_name, _ in self._pipeline]
+        anchor = names.index('shuffle') if 'shuffle' in names else -1
+
+        def _stateless(op_name, param):
+            if op_name == 'map':
+                return param['record_mapper'] is not None
+            return op_name in ['filter', 'batch']
+
+        def _countable(op_name, param):
+            if op_name == 'map':
+                return param['record_mapper'] is not None or \
+                    param.get('one_to_one', False)
+            return op_name in ['buffered', 'xmap', 'batch']
+
+        windowed = all(_stateless(*t) for t in self._pipeline[:max(anchor, 0)]) \
+            and all(_countable(*t) for t in self._pipeline[anchor + 1:])
+        if not windowed:
+            return -1, ReplayTracker(self._source)
+
+        factor = self._batch_factor(anchor)
+        if anchor < 0:
+            return anchor, ReplayTracker(self._source,
+                                         ReplayTracker.DEFAULT_WINDOW, None,
+                                         factor)
+
+        param = self._pipeline[anchor][1]
+        size = param['size']
+        if size < 0:
+            # shuffle all samples in one window
+            return -1, ReplayTracker(self._source)
+        return anchor, ReplayTracker(self._source, size, param['rng'], factor)
+
+    def _rngs(self):
+        """ random generators of transformations in this pipeline
+        """
+        return [p['rng'] for _, p in self._pipeline if 'rng' in p]
+
+    def _start_pass(self):
+        """ restore the pending state at the start of a pass
+            and take the replay point of the pass start
+
+        Returns:
+            num of output samples to skip
+        """
+        tracker = self._tracker
+        state = self._pending_state
+        self._pending_state = None
+        if state is not None:
+            self._source.load_state_dict(state['source'])
+            for (rd, _), seed_state in zip(self._seeded, state['seeds']):
+                rd.load_state_dict(seed_state)
+
+        self._pass_start = {
+            'source': self._source.state_dict(),
+            'rngs': [rng.getstate() for rng in self._rngs()],
+            'seeds': [rd.state_dict() for rd, _ in self._seeded]
+        }
+
+        if state is None:
+            tracker.start_pass()
+            return 0
+        elif state['window'] is not None and tracker.window_size is None:
+            raise PipelineError('transformations not match with the state, '\
+                'which is replayed from window[%d]' % (state['window']))
+        elif state['window'] is None:
+            # replay the pass from its start
+            tracker.start_pass(state['consumed'])
+            return state['consumed']
+        else:
+            tracker.start_pass(state['consumed'], state['window'],
+                               state['skip'])
+            return 0
+
+    def state_dict(self):
+        """ get the state of this pipeline which can be saved in a checkpoint,
+            which consists of a point to replay the current pass from,
+            and the num of samples consumed in the pass. The replay point
+            is the start of the last window read by the first shuffle
+            (or the source if no shuffle) when transformations before it
+            keep no samples and those after it output the same num of
+            samples for each input (or batches), otherwise the start of
+            the pass. Samples buffered by transformations are replayed
+            and consumed ones are skipped, which is exact if the pipeline
+            is deterministic, eg: with seeds and ordered workers
+
+        Returns:
+            dict which consists of positions of the source reader, states
+            of random generators and seeds of samples at the replay point
+
+        Raises:
+            PipelineError when the source reader has no state
+        """
+        if self._source is None or self._tracker is None:
+            raise PipelineError('no stateful source found in this pipeline, '\
+                'use a reader from DataSource')
+
+        if self._pending_state is not None:
+            return dict(self._pending_state)
+
+        tracker = self._tracker
+        start = self._pass_start
+        if start is None:
+            start = {
+                'source': self._source.state_dict(),
+                'rngs': [rng.getstate() for rng in self._rngs()],
+                'seeds': [rd.state_dict() for rd, _ in self._seeded]
+            }
+
+        state = dict(start)
+        state.update({'consumed': tracker.consumed, 'window': None, 'skip': 0})
+        point = tracker.replay_point()
+        if point is not None:
+            window, skip, w = point
+            state.update({'source': w['source'], 'window': window, \
+                'skip': skip})
+            if 'rng' in w:
+                state['rngs'] = [w['rng']]
+            # seeds of samples after the replay point follow consumed ones
+            state['seeds'] = [{'epoch': st['epoch'], \
+                'index': tracker.consumed * factor} \
+                for st, (_, factor) in zip(start['seeds'], self._seeded)]
+        return state
+
+    def load_state_dict(self, state):
+        """ restore the state from 'state_dict', it should be called
+            before iterating the transformed reader
+
+        Args:
+            state (dict): state got from 'state_dict'
+
+        Returns:
+            None
+
+        Raises:
+            PipelineError when transformations not match with the state
+        """
+        rngs = self._rngs()
+        if len(rngs) != len(state['rngs']):
+            raise PipelineError('mismatched random generators in state, '\
+                'expect %d but got %d' % (len(rngs), len(state['rngs'])))
+
+        for rng, rng_state in zip(rngs, state['rngs']):
+            rng.setstate(rng_state)
+        self._pending_state = state
+        self._pass_start = None
 
     def __str__(self):
         """ readable representation for this object, used to debug
@@ -16,5 +16,7 @@
 
 from .reader_builder import ReaderBuilder
 from .reader_builder import ReaderSetting
+from .spec import compile_spec
+from .spec import SpecError
 
-__all__ = ['ReaderBuilder', 'ReaderSetting']
+__all__ = ['ReaderBuilder', 'ReaderSetting', 'compile_spec', 'SpecError']
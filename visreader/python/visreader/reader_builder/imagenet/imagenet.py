@@ -33,6 +33,7 @@ default_settings = {
     'lua_fname': None, #use lua code to process images
     'image_op_class': 'pil', #default to using PIL
     'normalize': True, #whether substract mean and divide std of image
+    'decode_cache': None, #kwargs of ops.DecodeCache to cache decoded images
     'worker_args': { #config for concurrent processing
         'worker_mode': WORKER_MODE_TYPES[0],
         'worker_num': 16,
@@ -51,7 +52,7 @@ def train(settings=None):
     df_sets['shuffle_size'] = 10000
     if settings is not None:
         for k, v in settings.items():
-            if v != 'worker_args':
+            if k != 'worker_args':
                 df_sets[k] = v
             else:
                 df_sets[k].update(v)
@@ -100,7 +101,11 @@ def train(settings=None):
         raise ValueError('not recognized mode[%s] for worker_args' %
                          (worker_args['worker_mode']))
 
-    pl.map_ops(img_ops, **worker_args)
+    decode_cache = None
+    if df_sets['decode_cache'] is not None and df_sets['lua_fname'] is None:
+        decode_cache = ops.DecodeCache(**df_sets['decode_cache'])
+
+    pl.map_ops(img_ops, decode_cache=decode_cache, **worker_args)
     return pl
 
 
@@ -112,7 +117,7 @@ def val(settings=None):
     df_sets = copy.deepcopy(default_settings)
     if settings is not None:
         for k, v in settings.items():
-            if v != 'worker_args':
+            if k != 'worker_args':
                 df_sets[k] = v
             else:
                 df_sets[k].update(v)
@@ -158,5 +163,9 @@ def val(settings=None):
         raise ValueError('not recognized mode[%s] for worker_args' %
                          (worker_args['worker_mode']))
 
-    pl.map_ops(img_ops, **worker_args)
+    decode_cache = None
+    if df_sets['decode_cache'] is not None and df_sets['lua_fname'] is None:
+        decode_cache = ops.DecodeCache(**df_sets['decode_cache'])
+
+    pl.map_ops(img_ops, decode_cache=decode_cache, **worker_args)
     return pl
@@ -1,6 +1,7 @@
 import copy
 import traceback
 from ..source import source
+from . import spec
 
 
 class ReaderSetting(object):
@@ -39,7 +40,11 @@ class ReaderBuilder(object):
 
         Args:
             settings (dict): ReaderSettings 'train|val|test' reader
-            pl_name (str): name of pipeline used to transform data
+            pl_name (str): name of pipeline used to transform data,
+                or a spec(path to json/yaml file or a dict) which has
+                sections for 'train|val|test' as defined in 'spec.py',
+                whose params are overridden by 'pl_setting' of each reader,
+                see 'spec.apply_settings'
         """
         for k, v in settings.items():
             assert isinstance(
@@ -81,6 +86,15 @@ class ReaderBuilder(object):
             which)
         rd_setting = self.settings[which]
         sc = self.get_source(which, rd_setting)
+        if spec.is_spec(self.pl_name):
+            specs = spec.load_spec(self.pl_name)
+            if which not in specs:
+                raise spec.SpecError('not found section[%s] in spec' %
+                                     (which))
+            section = spec.apply_settings(specs[which],
+                                          rd_setting.pl_setting)
+            return spec.compile_spec(section).reader(sc)
+
         pl_setting = rd_setting.pl_setting
         mod_name = '.'.join([self.pl_name] * 2)
         try:
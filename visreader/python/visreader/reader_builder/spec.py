@@ -0,0 +1,467 @@
+"""
+# Copyright (c) 2018 PaddlePaddle Authors. All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+"""
+# function
+#    compile a declarative spec in json or yaml into a pipeline, eg:
+#    {
+#       "source": {"uri": "file://path/to/data", "filetype": "seqfile"},
+#       "seed": 1,
+#       "stages": [
+#           {"shuffle": {"size": 10000}},
+#           {"map": {"record_mapper": "mymodule:parse_sample"}},
+#           {"map_ops": {
+#               "ops": [{"DecodeImage": {}}, {"RandCropImage": {"size": 224}}],
+#               "op_class": "pil",
+#               "worker_mode": "native_thread",
+#               "worker_num": 16
+#           }},
+#           {"batch": {"size": 32}}
+#       ]
+#    }
+#    strings like "module:attr" for callable params are imported when compiling,
+#    and the compiled plan is cached while pipelines are made for each reader
+"""
+
+import os
+import copy
+import json
+import collections
+import hashlib
+import inspect
+import importlib
+import logging
+
+from .. import operators as ops
+from ..operators import pil_ops
+from ..operators import opencv_ops
+from ..operators import base
+from ..pipeline import Pipeline
+from ..source import source
+
+logger = logging.getLogger(__name__)
+
+#mode type for concurrent processing of image data
+WORKER_MODE_TYPES = ['native_thread', 'python_thread', 'python_process']
+
+# params of stages which accept callables
+CALLABLE_PARAMS = {
+    'map': ['record_mapper', 'reader_mapper'],
+    'filter': ['f'],
+    'xmap': ['funcs'],
+    'echo': ['copy_func'],
+}
+
+STAGE_TYPES = ['shuffle', 'echo', 'batch', 'map', 'map_ops', 'filter', \
+    'xmap', 'buffered', 'cache']
+
+# params of 'map_ops' besides 'ops' which are passed to 'operators.build'
+MAP_OPS_PARAMS = ['op_class', 'worker_mode', 'worker_num', 'buffer_size', \
+    'use_sharedmem', 'decode_cache', 'seed', 'post_worker_num', \
+    'post_worker_mode']
+
+# max num of compiled specs to cache
+MAX_CACHED_SPECS = 32
+
+# compiled specs indexed by their digests, least recently used first
+_compiled_specs = collections.OrderedDict()
+
+
+class SpecError(ValueError):
+    """ SpecError
+    """
+    pass
+
+
+def load_spec(spec):
+    """ load a spec from a json or yaml file
+
+    Args:
+        @spec (str or dict): path to the spec file, or a loaded spec
+
+    Returns:
+        spec as a dict
+    """
+    if isinstance(spec, dict):
+        return spec
+
+    if not os.path.isfile(spec):
+        raise SpecError('not found spec file[%s]' % (spec))
+
+    with open(spec, 'r') as f:
+        content = f.read()
+
+    if spec.endswith('.yaml') or spec.endswith('.yml'):
+        try:
+            import yaml
+        except ImportError as e:
+            raise SpecError('yaml is needed to load spec[%s], '\
+                'or use json format instead' % (spec))
+        return yaml.safe_load(content)
+    else:
+        return json.loads(content)
+
+
+def is_spec(spec):
+    """ whether 'spec' is a dict or a path to spec file
+    """
+    if isinstance(spec, dict):
+        return True
+
+    return isinstance(spec, basestring) and \
+        os.path.splitext(spec)[1] in ['.json', '.yaml', '.yml']
+
+
+def _import_callable(name):
+    """ import a callable from string like 'module:attr'
+    """
+    if callable(name):
+        return name
+
+    if not isinstance(name, basestring) or ':' not in name:
+        raise SpecError('invalid callable[%s], should be "module:attr"' %
+                        (name))
+
+    mod_name, attr = name.split(':', 1)
+    try:
+        obj = importlib.import_module(mod_name)
+        for a in attr.split('.'):
+            obj = getattr(obj, a)
+    except (ImportError, AttributeError) as e:
+        raise SpecError('failed to import callable[%s] for reason[%s]' %
+                        (name, str(e)))
+
+    if not callable(obj):
+        raise SpecError('[%s] is not callable' % (name))
+    return obj
+
+
+def _check_args(func, args, where):
+    """ check whether 'args' are acceptable keyword arguments of 'func'
+    """
+    if not isinstance(args, dict):
+        raise SpecError('params of %s should be a dict, but got[%s]' %
+                        (where, str(args)))
+
+    argspec = inspect.getargspec(func)
+    names = [n for n in argspec.args if n != 'self']
+    unknown = [k for k in args if k not in names]
+    if len(unknown) > 0 and argspec.keywords is None:
+        raise SpecError('unknown params%s for %s, supported are %s' %
+                        (str(unknown), where, str(names)))
+
+    defaults = argspec.defaults if argspec.defaults is not None else ()
+    required = names[:len(names) - len(defaults)]
+    missed = [n for n in required if n not in args]
+    if len(missed) > 0:
+        raise SpecError('missed params%s for %s' % (str(missed), where))
+
+
+def _op_class(name, op_class):
+    """ find the class of operator 'name'
+    """
+    if name not in ops.op_names:
+        raise SpecError('not supported operator[%s], supported are %s' %
+                        (name, str(ops.op_names)))
+
+    cls = getattr(base, name, None)
+    if cls is None:
+        op_mod = pil_ops if op_class == 'pil' else opencv_ops
+        cls = getattr(op_mod, name, None)
+
+    if cls is None:
+        raise SpecError('operator[%s] not implemented in class[%s]' %
+                        (name, op_class))
+    return cls
+
+
+def _compile_ops(stage):
+    """ validate a 'map_ops' stage and get classes and params of operators,
+        and args for 'operators.build'
+    """
+    if not isinstance(stage, dict) or 'ops' not in stage:
+        raise SpecError("missed params['ops'] for stage[map_ops]")
+
+    unknown = [k for k in stage if k != 'ops' and k not in MAP_OPS_PARAMS]
+    if len(unknown) > 0:
+        raise SpecError('unknown params%s for stage[map_ops], supported '\
+            'are %s' % (str(unknown), str(['ops'] + MAP_OPS_PARAMS)))
+
+    args = copy.deepcopy(stage)
+    op_class = args.pop('op_class', ops.default_class).lower()
+    if op_class not in ['pil', 'opencv']:
+        raise SpecError('not supported op_class[%s]' % (op_class))
+
+    mode = args.get('worker_mode', 'python_thread')
+    if mode not in WORKER_MODE_TYPES:
+        raise SpecError('not recognized worker_mode[%s], supported are %s' %
+                        (mode, str(WORKER_MODE_TYPES)))
+    args['worker_mode'] = mode
+    args['use_process'] = mode == 'python_process'
+    if mode != 'python_process':
+        args['use_sharedmem'] = False
+
+    if not isinstance(args['ops'], list) or len(args['ops']) == 0:
+        raise SpecError('no operators found in stage[map_ops]')
+
+    img_ops = []
+    for op in args.pop('ops'):
+        if not isinstance(op, dict) or len(op) != 1:
+            raise SpecError('operator should be like {name: {params}}, '\
+                'but got[%s]' % (str(op)))
+
+        name, params = op.items()[0]
+        params = {} if params is None else params
+        cls = _op_class(name, op_class)
+        _check_args(cls.__init__, params, 'operator[%s]' % (name))
+        # instance is made once to validate values of params
+        cls(**params)
+        img_ops.append((cls, params))
+
+    if args.get('decode_cache') is not None:
+        _check_args(ops.DecodeCache.__init__, args['decode_cache'],
+                    'decode_cache')
+
+    return img_ops, args
+
+
+def _compile_stages(spec):
+    """ validate the 'stages' in 'spec' and import callables in them
+
+    Returns:
+        list of (stage name, params)
+    """
+    compiled = []
+    stages = spec.get('stages', [])
+    if not isinstance(stages, list):
+        raise SpecError("'stages' should be a list")
+
+    for i, stage in enumerate(stages):
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise SpecError('stage[%d] should be like {type: {params}}, '\
+                'but got[%s]' % (i, str(stage)))
+
+        name, params = stage.items()[0]
+        params = {} if params is None else dict(params)
+        if name not in STAGE_TYPES:
+            raise SpecError('not supported stage[%s], supported are %s' %
+                            (name, str(STAGE_TYPES)))
+
+        if name == 'map_ops':
+            compiled.append((name, _compile_ops(params)))
+            continue
+
+        _check_args(getattr(Pipeline, name), params, 'stage[%s]' % (name))
+        for k in CALLABLE_PARAMS.get(name, []):
+            v = params.get(k)
+            if isinstance(v, list):
+                params[k] = [_import_callable(f) for f in v]
+            elif v is not None:
+                params[k] = _import_callable(v)
+        compiled.append((name, params))
+
+    return compiled
+
+
+class CompiledSpec(object):
+    """ a validated plan compiled from a spec, which is not changed after
+        compiling and makes a new pipeline for each reader
+    """
+
+    def __init__(self, spec):
+        """ init
+
+        Args:
+            @spec (dict): loaded spec
+        """
+        unknown = [k for k in spec if k not in ['source', 'seed', 'stages']]
+        if len(unknown) > 0:
+            raise SpecError('unknown sections%s in spec' % (str(unknown)))
+
+        self.spec = spec
+        self.seed = spec.get('seed')
+        self.source_args = spec.get('source')
+        if self.source_args is not None:
+            _check_args(source.load, self.source_args, 'source')
+        self.stages = _compile_stages(spec)
+
+    def get_source(self):
+        """ make a new source defined in this spec
+        """
+        if self.source_args is None:
+            raise SpecError("no 'source' defined in spec")
+        return source.load(**copy.deepcopy(self.source_args))
+
+    def pipeline(self):
+        """ make a new pipeline with its own random generators and operators
+        """
+        pl = Pipeline(seed=self.seed)
+        for name, params in self.stages:
+            if name != 'map_ops':
+                getattr(pl, name)(**params)
+                continue
+
+            op_specs, args = params
+            img_ops = [cls(**copy.deepcopy(p)) for cls, p in op_specs]
+            args = dict(args)
+            if args.get('decode_cache') is not None:
+                args['decode_cache'] = ops.DecodeCache(**args['decode_cache'])
+            pl.map_ops(img_ops, **args)
+
+        return pl
+
+    def reader(self, sc=None):
+        """ get the transformed reader of source 'sc'
+            or a new source defined in this spec
+        """
+        sc = self.get_source() if sc is None else sc
+        return self.pipeline().transform(sc.reader())
+
+
+class _NotCacheable(Exception):
+    """ raised for values in a spec which can not be used in digests
+    """
+    pass
+
+
+def _normalize(value):
+    """ make a json serializable value from 'value' in a spec,
+        callables are replaced by their names if they can be imported
+    """
+    if isinstance(value, dict):
+        for k in value:
+            if not isinstance(k, basestring):
+                raise SpecError('key[%s] in spec should be a string' % (k))
+        return dict([(k, _normalize(v)) for k, v in value.items()])
+    elif isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    elif value is None or isinstance(value, (basestring, bool, int, long,
+                                             float)):
+        return value
+    elif callable(value):
+        name = '%s:%s' % (getattr(value, '__module__', None),
+                          getattr(value, '__name__', None))
+        try:
+            if _import_callable(name) is value:
+                return name
+        except SpecError as e:
+            pass
+        raise _NotCacheable(str(value))
+    else:
+        raise SpecError('not serializable value[%s] in spec' % (str(value)))
+
+
+def digest(spec):
+    """ digest of a loaded spec which is used as the key of compiled ones
+
+    Returns:
+        digest string, or None if the spec has callables without names,
+        eg: lambdas, which can not be cached
+
+    Raises:
+        SpecError when values not serializable found
+    """
+    try:
+        normalized = _normalize(spec)
+    except _NotCacheable as e:
+        logger.debug('not cache spec with callable[%s]' % (str(e)))
+        return None
+
+    data = json.dumps(normalized, sort_keys=True)
+    return hashlib.md5(data).hexdigest()
+
+
+def compile_spec(spec, use_cache=True):
+    """ compile a spec to a plan of pipelines, all params are validated here
+
+    Args:
+        @spec (str or dict): path to the spec file, or a loaded spec
+        @use_cache (bool): whether to reuse the plan compiled before
+
+    Returns:
+        CompiledSpec instance
+
+    Raises:
+        SpecError when invalid spec found
+    """
+    spec = load_spec(spec)
+    if not isinstance(spec, dict):
+        raise SpecError('spec should be a dict, but got[%s]' % (str(spec)))
+
+    key = digest(spec)
+    use_cache = use_cache and key is not None
+    if use_cache and key in _compiled_specs:
+        compiled = _compiled_specs.pop(key)
+        _compiled_specs[key] = compiled
+        return compiled
+
+    logger.debug('compile spec[%s]' % (key))
+    compiled = CompiledSpec(copy.deepcopy(spec))
+    if use_cache:
+        _compiled_specs[key] = compiled
+        while len(_compiled_specs) > MAX_CACHED_SPECS:
+            _compiled_specs.popitem(last=False)
+    return compiled
+
+
+def apply_settings(spec, settings):
+    """ override params in a loaded spec with 'settings', eg:
+        {'seed': 2, 'source': {'part_num': 8}, 'map_ops': {'worker_num': 8}}
+        updates 'seed', params of 'source' and params of all 'map_ops' stages
+
+    Args:
+        @spec (dict): loaded spec
+        @settings (dict): params to override, None for nothing
+
+    Returns:
+        a new spec
+    """
+    spec = copy.copy(spec)
+    if not settings:
+        return spec
+
+    if not isinstance(settings, dict):
+        raise SpecError('settings should be a dict, but got[%s]' %
+                        (str(settings)))
+
+    stages = list(spec.get('stages', []))
+    stages_changed = False
+    for k, v in settings.items():
+        if k in STAGE_TYPES:
+            if not isinstance(v, dict):
+                raise SpecError('settings of stage[%s] should be a dict' % (k))
+            found = False
+            for i, stage in enumerate(stages):
+                if isinstance(stage, dict) and stage.keys() == [k]:
+                    params = dict(stage[k] or {})
+                    params.update(v)
+                    stages[i] = {k: params}
+                    found = True
+            if not found:
+                raise SpecError('not found stage[%s] for settings' % (k))
+            stages_changed = True
+        elif k == 'source' and isinstance(v, dict):
+            src = dict(spec.get('source') or {})
+            src.update(v)
+            spec['source'] = src
+        elif k == 'stages':
+            stages = v
+            stages_changed = True
+        else:
+            spec[k] = v
+
+    if stages_changed:
+        spec['stages'] = stages
+    return spec
@@ -21,10 +21,12 @@ from ..misc import kvtool
 logger = logging.getLogger(__name__)
 
 
-def line_reader(f, bufsize=10240):
-    """ line reader from file 'f'
+def line_reader(f, bufsize=10240, with_offset=False):
+    """ line reader from file 'f', and if 'with_offset' is True,
+        yield the line with the offset of next line in 'f'
     """
     d = ''
+    offset = f.tell() if with_offset else 0
     while True:
         buf_data = f.read(bufsize)
         if buf_data is None or len(buf_data) == 0:
@@ -34,51 +36,43 @@ def line_reader(f, bufsize=10240):
         lines = d.split('\n')
         if len(lines) > 1:
             for l in lines[:-1]:
-                yield l
+                offset += len(l) + 1
+                yield (l, offset) if with_offset else l
             d = lines[-1]
 
     if len(d) > 0:
-        yield d
+        offset += len(d)
+        yield (d, offset) if with_offset else d
 
 
 class FileReader(object):
     """ file reader
     """
 
-    def __init__(self, filetype, fd_reader, notify=None):
+    def __init__(self, filetype):
         """ init
 
         Args:
             @filetype (str): file formate, eg: seqfile or textfile
-            @fd_reader (generator): provide opened fds
-            @notify (function): cb for notify the samples and bytes readed
         """
-        self.fd_reader = fd_reader
         self.filetype = filetype
-        self.notify = notify
 
-    def reader(self):
-        """ generator to yield records from these fds
+    def records(self, f, offset=0):
+        """ generator to yield records from fd 'f' which start from 'offset',
+            and every record is yielded with the offset of next record
         """
         ft = self.filetype
         if ft == 'textfile':
-            for i, f in enumerate(self.fd_reader()):
-                ct = 0
-                for l in line_reader(f):
-                    ct += 1
-                    yield l.rstrip('\n')
-
-                if self.notify is not None:
-                    self.notify(i, samples=ct)
+            if offset > 0:
+                f.seek(offset)
+            for l, pos in line_reader(f, with_offset=True):
+                yield l.rstrip('\n'), pos
         elif ft == 'seqfile':
-            for i, f in enumerate(self.fd_reader()):
-                ct = 0
-                for r in kvtool.get_reader(f, type=ft):
-                    ct += 1
-                    yield r
-
-                if self.notify is not None:
-                    self.notify(i, samples=ct)
+            rd = kvtool.get_reader(f, type=ft)
+            if offset > 0:
+                rd.seek(offset)
+            for r in rd:
+                yield r, rd.tell()
         else:
             raise SourceError('not supported filetype[%s]' % (ft))
 
@@ -38,6 +38,8 @@ class LocalSource(DataSource):
 
         self.meta = meta
         self._setup()
+        self._seed = meta.seed if meta.seed is not None \
+                else random.randint(0, 2**31 - 1)
 
     def _setup(self):
         """ setup
@@ -71,36 +73,43 @@ class LocalSource(DataSource):
         """
         return cls._type_name
 
+    def file_order(self, epoch):
+        """ order of files to read in 'epoch' which is determined by
+            the seed of this source
+        """
+        indices = range(len(self.meta.flist))
+        random.Random(self._seed + epoch).shuffle(indices)
+        return indices
+
     def _make_reader(self):
-        """ make a reader of this source
+        """ make a reader of this source which reads one epoch
+            from the position in a cursor given to it
         """
         m = self.meta
+        file_reader = FileReader(m.filetype)
 
-        notified = {'index': None, 'samples': None}
-
-        def _notify(index, samples=None):
-            notified['index'] = index
-            notified['samples'] = samples
-
-        def _fd_reader():
-            indices = range(len(m.flist))
-            random.shuffle(indices)
-
+        def _reader(cursor):
+            order = self.file_order(cursor['epoch'])
             total_samples = 0
-            for index, i in enumerate(indices):
-                fname = m.flist[i]
+            while cursor['file_index'] < len(order):
+                fname = m.flist[order[cursor['file_index']]]
+                ct = 0
                 with open(self.strip_prefix(fname), 'r') as f:
-                    yield f
+                    for r, offset in file_reader.records(f, cursor['offset']):
+                        cursor['offset'] = offset
+                        ct += 1
+                        yield r
+
+                total_samples += ct
+                logger.debug('read %d/%d from file[%s]' % \
+                        (ct, total_samples, os.path.basename(fname)))
+                cursor['file_index'] += 1
+                cursor['offset'] = 0
 
-                if index == notified['index'] and notified[
-                        'samples'] is not None:
-                    s = notified['samples']
-                    total_samples += s
-                    logger.debug('read %d/%d from file[%s]' % \
-                            (s, total_samples, os.path.basename(fname)))
-                    notified['samples'] = None
+            cursor['epoch'] += 1
+            cursor['file_index'] = 0
 
-        return FileReader(m.filetype, _fd_reader, _notify).reader
+        return _reader
 
 
 DataSource.register(LocalSource)
@@ -47,7 +47,8 @@ class SourceMeta(object):
                  part_num=None,
                  cache=None,
                  pass_num=1,
-                 to_dict=True):
+                 to_dict=True,
+                 seed=None):
         """ init
         """
         self.uri = strip_spaces(uri)
@@ -62,6 +63,7 @@ class SourceMeta(object):
         self.cache = strip_spaces(cache)
         self.pass_num = pass_num
         self.to_dict = to_dict
+        self.seed = seed  #seed to shuffle files, random if None
 
         if self.cache is not None:
             uri_path = urlparse(self.uri).path
@@ -94,6 +96,22 @@ class DataSource(object):
     """
     _supported_sources = []
 
+    def __init__(self):
+        """ init
+        """
+        # seed to shuffle the order of files in each epoch
+        self._seed = 0
+        # epoch to start with in next call of the reader
+        self._epoch = 0
+        # position restored by 'load_state_dict' for next call of the reader
+        self._resume = None
+        # position of the reader called last, which consists of:
+        #   epoch: epoch being read, which also decides the order of files
+        #   pass_id: passes finished in this call of the reader
+        #   file_index: index of the file being read in this epoch
+        #   offset: offset of next record in the file being read
+        self._cursor = None
+
     @classmethod
     def create(cls, meta):
         """ create a datasource
@@ -141,11 +159,25 @@ class DataSource(object):
             return getattr(self.meta, param)
 
     def _make_reader(self):
-        """ make a reader of this source
+        """ make a reader of this source, which reads one epoch from
+            the position in a cursor given to it and moves the cursor
         """
         raise NotImplementedError(
             'invalid callinig to _make_reader of DataSource')
 
+    def _open_cursor(self):
+        """ get a cursor for a new call of the reader, which starts
+            a fresh epoch unless a position is restored
+        """
+        state, self._resume = self._resume, None
+        if state is None:
+            state = {'epoch': self._epoch}
+        cursor = {'epoch': state['epoch'], 'pass_id': state.get('pass_id', 0), \
+            'file_index': state.get('file_index', 0), \
+            'offset': state.get('offset', 0)}
+        self._cursor = cursor
+        return cursor
+
     def reader(self, pass_num=None):
         """ get a reader of this source
 
@@ -161,16 +193,51 @@ class DataSource(object):
         rd = self._make_reader()
 
         def _reader():
-            ct = 0
-            while True:
-                for i in rd():
-                    yield i
-                ct += 1
+            cursor = self._open_cursor()
+            try:
+                while True:
+                    # concurrent calls of the reader take other epochs
+                    self._epoch = max(self._epoch, cursor['epoch'] + 1)
+                    for i in rd(cursor):
+                        yield i
+                    cursor['pass_id'] += 1
+
+                    if pass_num > 0 and cursor['pass_id'] >= pass_num:
+                        cursor['pass_id'] = 0
+                        break
+            finally:
+                if self._cursor is cursor:
+                    self._cursor = None
+
+        # expose the position of this reader to 'Pipeline'
+        _reader.state_dict = self.state_dict
+        _reader.load_state_dict = self.load_state_dict
+        return _reader
 
-                if pass_num > 0 and ct >= pass_num:
-                    break
+    def state_dict(self):
+        """ get the position of the reader called last if it is being read,
+            otherwise the position next call of the reader starts from,
+            note that records prefetched by downstream are treated as consumed
 
-        return _reader
+        Returns:
+            dict which can be restored by 'load_state_dict'
+        """
+        if self._resume is not None:
+            state = dict(self._resume)
+        elif self._cursor is not None:
+            state = dict(self._cursor)
+        else:
+            state = {'epoch': self._epoch, 'pass_id': 0, \
+                'file_index': 0, 'offset': 0}
+        state['seed'] = self._seed
+        return state
+
+    def load_state_dict(self, state):
+        """ restore the position of the reader of this source,
+            which takes effect in the next call of the reader
+        """
+        self._seed = state.get('seed', self._seed)
+        self._resume = dict(state)
 
 
 def load(uri, filetype=None, part_id=None, part_num=None, **kwargs):
@@ -0,0 +1,118 @@
+"""
+# micro benchmark for resizing images with PIL, OpenCV and native ops,
+# reports images/sec of each interpolation for several input sizes, eg:
+#   python bench_resize.py --sizes 256,512,1024 --out_size 224
+"""
+
+import os
+import io
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+import set_env
+from visreader.operators import resize
+
+
+def _throughput(func, iters):
+    """ images/sec of running 'func' for 'iters' times
+    """
+    func()  # warm up
+    start_ts = time.time()
+    for i in xrange(iters):
+        func()
+    cost = time.time() - start_ts
+    return iters / cost if cost > 0 else float('inf')
+
+
+def _native_processor(interpolation, out_size):
+    """ make a native processor to decode and resize,
+        return None if native ops not available
+    """
+    try:
+        from visreader.transformer.pytransformer import PyProcessor
+    except ImportError as e:
+        return None
+
+    proc = PyProcessor()
+    proc.decode(to_rgb=True)
+    if interpolation is not None:
+        proc.resize(out_size, out_size, resize.cv2_flags[interpolation])
+    return proc
+
+
+def bench(img, sizes, out_size, interpolations, iters):
+    """ benchmark resizing 'img' scaled to each of 'sizes'
+
+    Returns:
+        list of dict with 'size', 'interpolation', 'backend' and 'images_per_sec'
+    """
+    results = []
+    dst = (out_size, out_size)
+    for size in sizes:
+        scale = float(size) / min(img.size)
+        src = img.resize((int(img.size[0] * scale), int(img.size[1] * scale)),
+                         Image.BILINEAR)
+        src_np = np.asarray(src)
+        buf = io.BytesIO()
+        src.save(buf, format='JPEG', quality=90)
+        data = buf.getvalue()
+
+        decode = _native_processor(None, out_size)
+        decode_speed = _throughput(lambda: decode(data), iters) \
+            if decode is not None else None
+
+        for intp in interpolations:
+            funcs = {
+                'pil': lambda: resize.resize(src, dst, intp, backend='pil'),
+                'opencv': lambda: resize.resize(src_np, dst, intp, \
+                    backend='opencv'),
+                'auto': lambda: resize.resize(src, dst, intp, backend='auto'),
+            }
+
+            proc = _native_processor(intp, out_size)
+            if proc is not None:
+                funcs['native'] = lambda: proc(data)
+
+            for backend, func in sorted(funcs.items()):
+                speed = _throughput(func, iters)
+                if backend == 'native':
+                    # exclude the cost of decoding
+                    speed = 1.0 / max(1.0 / speed - 1.0 / decode_speed, 1e-9)
+
+                results.append({
+                    'size': size,
+                    'interpolation': intp,
+                    'backend': backend,
+                    'images_per_sec': speed
+                })
+    return results
+
+
+def main():
+    work_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description='benchmark for resizing')
+    parser.add_argument('--image', default=os.path.join(work_dir, 'test.jpg'))
+    parser.add_argument('--sizes', default='256,512,1024',
+                        help='short edges of input images')
+    parser.add_argument('--out_size', type=int, default=224)
+    parser.add_argument('--interpolations', default=','.join(
+        resize.INTERPOLATIONS))
+    parser.add_argument('--iters', type=int, default=50)
+    args = parser.parse_args()
+
+    img = Image.open(args.image).convert('RGB')
+    sizes = [int(s) for s in args.sizes.split(',')]
+    results = bench(img, sizes, args.out_size, args.interpolations.split(','),
+                    args.iters)
+
+    print('pillow-simd: %s' % (resize.is_pillow_simd()))
+    print('%-6s %-10s %-8s %12s' % ('size', 'interp', 'backend', 'images/sec'))
+    for r in results:
+        print('%-6d %-10s %-8s %12.1f' % (r['size'], r['interpolation'],
+                                          r['backend'], r['images_per_sec']))
+
+
+if __name__ == '__main__':
+    main()
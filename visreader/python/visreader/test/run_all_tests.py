@@ -4,6 +4,7 @@
 """
 
 import unittest
+import test_benchmark
 import test_pipeline
 import test_dataset
 import test_operators
@@ -21,6 +22,7 @@ if __name__ == '__main__':
             test_pytransformer.TestPyTransformer,
             test_reader_builder.TestReaderBuilder,
             test_sharedqueue.TestSharedQueue,
+            test_benchmark.TestBenchmark,
         ]
     ])
 
@@ -0,0 +1,104 @@
+import os
+import json
+import unittest
+import tempfile
+import shutil
+import logging
+
+import set_env
+from visreader.benchmark import bench_ops
+from visreader.benchmark import bench_reader
+from visreader.misc import kvtool
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test cases for visreader.benchmark
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """ setup
+        """
+        cls.work_dir = tempfile.mkdtemp(suffix='test_benchmark')
+        cls.test_image = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), 'test.jpg')
+
+    @classmethod
+    def tearDownClass(cls):
+        """ tearDownClass
+        """
+        shutil.rmtree(cls.work_dir)
+
+    def test_bench_ops(self):
+        """ test benchmark of operators
+        """
+        images = bench_ops.make_images([(320, 240)], self.test_image)
+        self.assertEqual([(n, s) for n, s, _ in images],
+                         [('synthetic', (320, 240)), ('real', (320, 240))])
+
+        names = ['DecodeImage', 'RandCropImage', 'RandDistortColor']
+        results = bench_ops.bench(names, ['pil', 'opencv'], images, 2)
+        self.assertEqual(len(results), 2 * len(names) * 2)
+        for r in results:
+            if r['op'] == 'RandDistortColor' and r['op_class'] == 'opencv':
+                self.assertTrue('skipped' in r)
+                continue
+
+            self.assertGreater(r['images_per_sec'], 0)
+            self.assertLessEqual(r['p50_ms'], r['p99_ms'])
+
+        slower = [dict(r) for r in results if 'skipped' not in r]
+        for r in slower:
+            r['images_per_sec'] /= 2
+        regressions = bench_ops.compare(slower, results, 0.1)
+        self.assertEqual(len(regressions), len(slower))
+        self.assertEqual(len(bench_ops.compare(results, results, 0.1)), 0)
+
+    def test_bench_ops_main(self):
+        """ test command of benchmark of operators
+        """
+        out = os.path.join(self.work_dir, 'ops.json')
+        argv = ['--ops', 'DecodeImage', '--op_classes', 'pil', '--sizes', \
+            '64x48', '--iters', '2', '--out', out]
+        self.assertEqual(bench_ops.main(argv), 0)
+
+        with open(out, 'r') as f:
+            results = json.load(f)
+        self.assertTrue('git_commit' in results['environment'])
+        self.assertEqual(len(results['results']), 2)
+        self.assertEqual(bench_ops.main(argv + ['--baseline', out, \
+            '--threshold', '1.0']), 0)
+
+    def test_bench_reader(self):
+        """ test benchmark of readers on generated seqfiles
+        """
+        data_dir = os.path.join(self.work_dir, 'coco')
+        files = bench_reader.make_dataset(data_dir, 'coco.train', 10, \
+            (96, 64), file_num=3, image_num=2)
+        self.assertEqual(len(files), 3)
+        records = []
+        for fname in files:
+            with open(fname, 'rb') as f:
+                records += list(kvtool.SequenceFileReader(f))
+        self.assertEqual(len(records), 10)
+        image, label = bench_reader._parse_kv(records[0])
+        self.assertEqual(label['_id'], 0)
+        self.assertGreater(len(label['boxes']), 0)
+
+        data_dir = os.path.join(self.work_dir, 'imagenet')
+        bench_reader.make_dataset(data_dir, 'imagenet.val', 20, (96, 64))
+        configs = bench_reader.configs('imagenet.val', ['python_thread', \
+            'python_process'], [2], [False, True], [8])
+        self.assertEqual(len(configs), 3)
+
+        results = bench_reader.sweep('imagenet.val', data_dir, configs[:1], \
+            passes=2, warmup=5)
+        self.assertEqual(results[0]['samples'], 40)
+        self.assertGreater(results[0]['samples_per_sec'], 0)
+        self.assertTrue('peak_rss_mb' in results[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
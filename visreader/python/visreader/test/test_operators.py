@@ -38,6 +38,21 @@ def run_ops(op_list, img):
     return img
 
 
+class RecordPlanner(object):
+    """ a planner which records names of planned ops
+    """
+
+    def __init__(self):
+        self.ops = []
+
+    def __getattr__(self, name):
+        def _plan(*args, **kwargs):
+            self.ops.append(name)
+            return self
+
+        return _plan
+
+
 class TestOperators(unittest.TestCase):
     """Test cases for visreader.operators
     """
@@ -216,6 +231,306 @@ class TestOperators(unittest.TestCase):
         print('processed total %d samples with qps:%d' \
                 % (total, total / (time.time() - start_ts)))
 
+    def test_decode_cache(self):
+        """ test decode cache
+        """
+        data_num = 20
+
+        def _data_source():
+            for i in xrange(data_num):
+                yield (self.img_data, i)
+
+        for op_class in ['pil', 'opencv']:
+            cache = ops.DecodeCache(capacity=64 * 1024**2, resize_short=256)
+            xmapper = ops.build(
+                get_ops(op_class=op_class, normalize=False),
+                worker_num=2,
+                decode_cache=cache)
+            rd = xmapper(_data_source)
+            for epoch in range(2):
+                ct = 0
+                for img, label in rd():
+                    self.assertEqual(img.shape, (3, 224, 224))
+                    ct += 1
+                self.assertEqual(ct, data_num)
+
+            first, second = cache.epoch_stats
+            self.assertEqual(first['hits'] + first['misses'], data_num)
+            self.assertEqual(second['misses'], 0)
+            self.assertEqual(second['hit_rate'], 1.0)
+            self.assertGreater(second['saved_ms'], 0)
+
+    def test_memory_cache_hits(self):
+        """ test hits of memory cache not sharing arrays with users
+        """
+        cache = ops.DecodeCache(capacity=64 * 1024**2)
+        cached_op = ops.decode_cache.with_decode_cache(
+            get_ops(op_class='opencv'), cache)[0]
+        first = cached_op(self.img_data)
+        expect = first.copy()
+        first[:] = 0
+        second = cached_op(self.img_data)
+        self.assertIsNot(first, second)
+        self.assertTrue(np.array_equal(second, expect))
+        second[:] = 0
+        self.assertTrue(np.array_equal(cached_op(self.img_data), expect))
+
+        self.assertRaises(ops.OperatorParamError, ops.build, \
+            get_ops(op_class='opencv'), use_process=True, decode_cache=cache)
+
+    def test_disk_cache(self):
+        """ test decode cache on disk
+        """
+        import shutil
+        import tempfile
+        path = tempfile.mkdtemp()
+        try:
+            cache = ops.DecodeCache(where='disk', path=path, codec='jpeg')
+            cached_op = ops.decode_cache.with_decode_cache(
+                get_ops(op_class='opencv'), cache)[0]
+            first = cached_op(self.img_data)
+            second = cached_op(self.img_data)
+            self.assertEqual(first.shape, second.shape)
+
+            st = cache.stats()
+            self.assertEqual(st['hits'], 1)
+            self.assertEqual(st['misses'], 1)
+            self.assertEqual(len(os.listdir(path)), 1)
+        finally:
+            shutil.rmtree(path)
+
+    def test_pil_disk_cache(self):
+        """ test decode cache of pil operators, which should not need cv2
+        """
+        import sys
+        import shutil
+        import tempfile
+        path = tempfile.mkdtemp()
+        cv2 = sys.modules.get('cv2')
+        try:
+            cache = ops.DecodeCache(where='disk', path=path, codec='png', \
+                resize_short=100)
+            cached_op = ops.decode_cache.with_decode_cache(
+                [ops.DecodeImage(op_class='pil')], cache)[0]
+            sys.modules['cv2'] = None
+            first = np.array(cached_op(self.img_data))
+            second = np.array(cached_op(self.img_data))
+            self.assertEqual(cache.backend, 'pil')
+            self.assertEqual(min(first.shape[:2]), 100)
+            self.assertTrue(np.array_equal(first, second))
+            self.assertEqual(cache.stats()['hits'], 1)
+        finally:
+            if cv2 is None:
+                sys.modules.pop('cv2', None)
+            else:
+                sys.modules['cv2'] = cv2
+            shutil.rmtree(path)
+
+    def test_decode_size_hint(self):
+        """ test decoding jpeg with reduced size
+        """
+        for op_class in ['pil', 'opencv']:
+            full = np.array(ops.DecodeImage(op_class=op_class)(self.img_data))
+            h, w = full.shape[:2]
+
+            decode = ops.DecodeImage(size_hint=100, op_class=op_class)
+            img = np.array(decode(self.img_data))
+            self.assertLess(img.shape[0], h)
+            self.assertGreaterEqual(min(img.shape[:2]), 100)
+
+            # hint is got from the downstream resize operator
+            img_ops = [
+                ops.DecodeImage(op_class=op_class),
+                ops.RandFlipImage(op_class=op_class),
+                ops.ResizeImage(resize_short=64, op_class=op_class)
+            ]
+            ops.base.propagate_size_hint(img_ops)
+            self.assertEqual(img_ops[0].auto_size_hint, 64)
+            img = np.array(run_ops(img_ops, self.img_data))
+            self.assertEqual(min(img.shape[:2]), 64)
+
+            # not propagated through crop which depends on the size
+            img_ops = [
+                ops.DecodeImage(op_class=op_class),
+                ops.CropImage(64, op_class=op_class),
+                ops.ResizeImage(resize_short=32, op_class=op_class)
+            ]
+            ops.base.propagate_size_hint(img_ops)
+            self.assertIsNone(img_ops[0].auto_size_hint)
+
+    def test_build_python_ops(self):
+        """ test python workers run operators as they are given,
+            without fusing or reduced decoding of native plans
+        """
+        for op_class in ['pil', 'opencv']:
+            img_ops = [
+                ops.DecodeImage(op_class=op_class),
+                ops.ResizeImage(resize_short=64, op_class=op_class)
+            ]
+            expect = run_ops(img_ops, self.img_data)
+            xmapper = ops.build(img_ops, worker_num=1)
+            rd = xmapper(lambda: iter([(self.img_data, 0)]))
+            img, label = next(rd())
+            self.assertIsNone(img_ops[0].auto_size_hint)
+            self.assertTrue(np.array_equal(np.array(expect), np.array(img)))
+
+    def test_decode_rand_crop(self):
+        """ test fused operator of decoding and random cropping
+        """
+        for op_class in ['pil', 'opencv']:
+            img_ops = [
+                ops.DecodeImage(op_class=op_class),
+                ops.RandCropImage(64, op_class=op_class),
+                ops.RandFlipImage(op_class=op_class)
+            ]
+            fused = ops.base.fuse_ops(img_ops)
+            self.assertEqual(len(fused), 2)
+            self.assertEqual(type(fused[0]).__name__, 'DecodeRandCropImage')
+            img = np.array(run_ops(fused, self.img_data))
+            self.assertEqual(img.shape, (64, 64, 3))
+
+            # not fused when size hint is set explicitly
+            img_ops[0] = ops.DecodeImage(size_hint=None, op_class=op_class)
+            self.assertEqual(len(ops.base.fuse_ops(img_ops)), 3)
+
+            # same crop window is picked without reduced decoding
+            size = 1024
+            ops.base.seed_rng(1)
+            expect = run_ops([
+                ops.DecodeImage(size_hint=None, op_class=op_class),
+                ops.RandCropImage(size, op_class=op_class)
+            ], self.img_data)
+            ops.base.seed_rng(1)
+            img = ops.DecodeRandCropImage(
+                size, op_class=op_class)(self.img_data)
+            ops.base.seed_rng(None)
+            self.assertTrue(np.array_equal(np.array(expect), np.array(img)))
+
+    def test_normalize_to_chw(self):
+        """ test fused operator of normalizing and converting to CHW
+        """
+        img = np.random.randint(0, 256, (32, 48, 3)).astype('uint8')
+        img_ops = [ops.ToCHWImage(), ops.NormalizeImage()]
+        expect = run_ops(img_ops, img)
+        self.assertEqual(expect.dtype, np.float32)
+
+        fused = ops.base.fuse_ops(img_ops)
+        self.assertEqual(len(fused), 1)
+        result = fused[0](img)
+        self.assertEqual(result.shape, (3, 32, 48))
+        self.assertTrue(np.allclose(result, expect, atol=1e-5))
+
+        half = ops.NormalizeToCHWImage(dtype='float16')(img)
+        self.assertEqual(half.dtype, np.float16)
+        self.assertTrue(np.allclose(half, expect, atol=1e-2))
+
+        # batched form writes to a pre-allocated buffer
+        out = np.empty((4, 3, 32, 48), dtype='float32')
+        result = fused[0].batch([img] * 4, out=out)
+        self.assertIs(result, out)
+        self.assertTrue(np.allclose(out[3], expect, atol=1e-5))
+
+    def test_native_plan(self):
+        """ test all operators of imagenet training are planned natively
+        """
+        img_ops = get_ops(op_class='pil')
+        img_ops.insert(3, ops.RandDistortColor(op_class='pil'))
+        planner = RecordPlanner()
+        post_mapper = ops.base.make_cpp_plan(img_ops, planner)
+        self.assertIsNone(post_mapper)
+        self.assertEqual(planner.ops, [
+            'decode', 'rotate', 'random_crop', 'distort_color', 'flip',
+            'normalize_to_chw'
+        ])
+
+        planner = RecordPlanner()
+        ops.base.make_cpp_plan([ops.NormalizeImage()], planner)
+        self.assertEqual(planner.ops, ['normalize'])
+
+    def test_distort_hue(self):
+        """ test random distortion of colors with hue
+        """
+        img = ops.DecodeImage(op_class='pil')(self.img_data)
+        same = ops.pil_ops.rotate_hue(img, 0)
+        self.assertLess(
+            np.abs(np.array(same, 'int') - np.array(img, 'int')).mean(), 2)
+
+        distort = ops.RandDistortColor(hue=[-0.1, 0.1], op_class='pil')
+        self.assertEqual(distort(img).size, img.size)
+
+    def test_interpolation(self):
+        """ test resizing with each interpolation and backend
+        """
+        from visreader.operators import resize
+        img = ops.DecodeImage(op_class='pil')(self.img_data)
+        for intp in resize.INTERPOLATIONS:
+            for backend in ['pil', 'opencv', 'auto']:
+                out = resize.resize(img, (64, 48), intp, backend=backend)
+                self.assertIsInstance(out, PIL.Image.Image)
+                self.assertEqual(out.size, (64, 48))
+
+                out = resize.resize(np.asarray(img), (64, 48), intp, backend)
+                self.assertEqual(out.shape, (48, 64, 3))
+
+            self.assertIn(resize.fastest_backend(intp), ['pil', 'opencv'])
+            for op_class in ['pil', 'opencv']:
+                img_ops = [
+                    ops.DecodeImage(op_class=op_class),
+                    ops.RandCropImage(
+                        32, interpolation=intp, op_class=op_class),
+                    ops.ResizeImage(
+                        size=16, interpolation=intp, op_class=op_class)
+                ]
+                out = np.array(run_ops(img_ops, self.img_data))
+                self.assertEqual(out.shape, (16, 16, 3))
+
+        self.assertRaises(ops.OperatorParamError, ops.ResizeImage, size=16, \
+            interpolation='unknown')
+
+        # operators resize with their own library unless opted in
+        expect = img.resize((16, 16), resize.pil_filters['bilinear'])
+        op = ops.ResizeImage(size=16, interpolation='bilinear', \
+            op_class='pil')
+        self.assertTrue(np.array_equal(np.array(op(img)), np.array(expect)))
+        try:
+            resize.set_default_backend('auto')
+            self.assertEqual(op(img).size, (16, 16))
+        finally:
+            resize.set_default_backend(None)
+        self.assertRaises(ops.OperatorParamError, \
+            resize.set_default_backend, 'unknown')
+
+    def test_seed(self):
+        """ test reproducible results of random operators with seed
+        """
+        data_num = 8
+
+        def _data_source():
+            for i in xrange(data_num):
+                yield (self.img_data, i)
+
+        for op_class in ['pil', 'opencv']:
+            results = []
+            for worker_num in [1, 4]:
+                xmapper = ops.build(
+                    get_ops(op_class=op_class, normalize=False),
+                    worker_num=worker_num,
+                    seed=10)
+                rd = xmapper(_data_source)
+                epochs = []
+                for epoch in range(2):
+                    epochs.append({l: img for img, l in rd()})
+                results.append(epochs)
+
+            for i in xrange(data_num):
+                for epoch in range(2):
+                    self.assertTrue(
+                        np.array_equal(results[0][epoch][i], results[1][
+                            epoch][i]))
+            # different epochs have different random numbers
+            self.assertFalse(all([np.array_equal(results[0][0][i], \
+                results[0][1][i]) for i in xrange(data_num)]))
+
 
 if __name__ == '__main__':
     unittest.main()
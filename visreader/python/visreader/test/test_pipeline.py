@@ -4,10 +4,14 @@ import unittest
 import sys
 import logging
 import thread
+import threading
+import shutil
+import tempfile
 
 import set_env
 import visreader
 from visreader.pipeline import Pipeline
+from visreader.source import source
 
 logging.basicConfig(level=logging.INFO)
 
@@ -197,6 +201,185 @@ class TestPipeline(unittest.TestCase):
                 expect = (i - 1) // 2
             self.assertEqual(expect, data)
 
+    def test_multi_consumers(self):
+        """ test reader with multiple consumers
+        """
+        num = 100
+        consumer_num = 4
+        p = Pipeline(make_reader(num))
+        p.map(lambda r: 2 * r)
+
+        for _ in range(2):
+            iters = p.reader(num_consumers=consumer_num)
+            self.assertEqual(consumer_num, len(iters))
+
+            results = [[] for _ in range(consumer_num)]
+
+            def _consume(it, result):
+                for data in it:
+                    time.sleep(0.001)
+                    result.append(data)
+
+            threads = []
+            for it, result in zip(iters, results):
+                t = threading.Thread(target=_consume, args=(it, result))
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+
+            merged = sorted(reduce(lambda x, y: x + y, results))
+            self.assertEqual([2 * i for i in range(num)], merged)
+            for result in results:
+                self.assertGreater(len(result), 0)
+
+    def test_multi_consumers_stop(self):
+        """ test the fanout driver exits when consumers stop early
+        """
+        finished = threading.Event()
+
+        def _endless():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                finished.set()
+
+        iters = Pipeline(_endless).reader(num_consumers=2)
+        for it in iters:
+            for _, data in zip(range(5), it):
+                self.assertGreaterEqual(data, 0)
+            it.close()
+
+        self.assertTrue(finished.wait(5))
+        for it in iters:
+            self.assertEqual([], list(it))
+
+    def test_resume(self):
+        """ test restoring state of pipeline from a checkpoint
+        """
+        data_dir = tempfile.mkdtemp()
+        try:
+            for i in range(3):
+                with open(os.path.join(data_dir, 'part-%d' % i), 'w') as f:
+                    f.write('\n'.join(
+                        ['%d_%d' % (i, j) for j in range(10)]) + '\n')
+
+            def _make_pipeline():
+                sc = source.load(uri=data_dir, filetype='textfile', seed=1)
+                p = Pipeline(seed=2)
+                p.map(lambda r: r)
+                return p, sc.reader()
+
+            p, rd = _make_pipeline()
+            expect = [r for r in p.transform(rd)()]
+            self.assertEqual(30, len(set(expect)))
+
+            p, rd = _make_pipeline()
+            it = p.transform(rd)()
+            consumed = [it.next() for _ in range(12)]
+            state = p.state_dict()
+            self.assertEqual(expect[:12], consumed)
+
+            p, rd = _make_pipeline()
+            p.load_state_dict(state)
+            self.assertEqual(expect[12:], [r for r in p.transform(rd)()])
+
+            # same seeds make same orders with shuffle
+            orders = []
+            for _ in range(2):
+                p, rd = _make_pipeline()
+                p.shuffle(8)
+                orders.append([r for r in p.transform(rd)()])
+            self.assertEqual(orders[0], orders[1])
+            self.assertEqual(sorted(expect), sorted(orders[0]))
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_source_calls(self):
+        """ test each call of a source reader reading a full pass,
+            and only a restored one continuing from its position
+        """
+        data_dir = tempfile.mkdtemp()
+        try:
+            for i in range(3):
+                with open(os.path.join(data_dir, 'part-%d' % i), 'w') as f:
+                    f.write('\n'.join(
+                        ['%d_%d' % (i, j) for j in range(10)]) + '\n')
+
+            sc = source.load(uri=data_dir, filetype='textfile', seed=1)
+            rd = sc.reader()
+            it = rd()
+            consumed = [it.next() for _ in range(5)]
+            state = sc.state_dict()
+            del it
+            self.assertEqual(30, len(set(rd())))
+
+            it1, it2 = rd(), rd()
+            records = [[it1.next(), it2.next()] for _ in range(30)]
+            for got in zip(*records):
+                self.assertEqual(30, len(set(got)))
+
+            sc.load_state_dict(state)
+            rest = list(rd())
+            self.assertEqual(25, len(rest))
+            self.assertEqual(30, len(set(consumed + rest)))
+            self.assertEqual(30, len(list(rd())))
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_resume_shuffle(self):
+        """ test resuming a pipeline with samples buffered in shuffle
+            and workers, and seeds of samples not changed after resuming
+        """
+        from visreader.operators.base import get_rng
+        data_dir = tempfile.mkdtemp()
+        try:
+            for i in range(3):
+                with open(os.path.join(data_dir, 'part-%d' % i), 'w') as f:
+                    f.write('\n'.join(
+                        ['%d_%d' % (i, j) for j in range(20)]) + '\n')
+
+            def _tag(r):
+                return '%s:%d' % (r, get_rng().randint(0, 1 << 30))
+
+            def _make_pipeline(echo=False):
+                sc = source.load(uri=data_dir, filetype='textfile', seed=1)
+                p = Pipeline(seed=2)
+                p.shuffle(8)
+                if echo:
+                    p.echo(2, size=4)
+                p.map_ops([_tag], worker_num=2, seed=3, order=True)
+                p.batch(2)
+                return p, sc.reader()
+
+            for echo in [False, True]:
+                p, rd = _make_pipeline(echo)
+                expect = [r for r in p.transform(rd)()]
+                self.assertEqual(30 * (echo + 1), len(expect))
+
+                for num in [5, 8, 13]:
+                    p, rd = _make_pipeline(echo)
+                    it = p.transform(rd)()
+                    consumed = [it.next() for _ in range(num)]
+                    state = p.state_dict()
+                    self.assertEqual(expect[:num], consumed)
+                    self.assertEqual(num, state['consumed'])
+                    if echo:
+                        # echo is replayed from the start of the pass
+                        self.assertIsNone(state['window'])
+                    else:
+                        self.assertEqual((2 * num - 1) // 8, state['window'])
+
+                    p, rd = _make_pipeline(echo)
+                    p.load_state_dict(state)
+                    self.assertEqual(expect[num:],
+                                     [r for r in p.transform(rd)()])
+        finally:
+            shutil.rmtree(data_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,6 +10,7 @@ import numpy as np
 
 import set_env
 from visreader.transformer.pytransformer import PyProcessor
+from visreader.operators import NormalizeImage
 
 logging.basicConfig(level=logging.INFO)
 lua_ops = {
@@ -40,6 +41,15 @@ lua_ops = {
             return {resizeimg, sample[2]}
         end
     """,
+    'flip': """
+        local cv = require("luac_cv")
+
+        function lua_main(sample)
+            local flipped = cv.Mat()
+            cv.flip(sample[1], flipped, 1)
+            return {flipped, sample[2]}
+        end
+    """,
 }
 
 
@@ -71,6 +81,45 @@ class TestPyTransformer(unittest.TestCase):
         self.assertTrue(type(decoded), np.ndarray)
         self.assertEqual(len(decoded.shape), 3)
 
+    def test_decode_full_size(self):
+        """ test images are decoded with the original size without hint,
+            and the whole image is decoded when not able to decode a crop
+        """
+        import io
+        from PIL import Image
+        w, h = Image.open(self.test_jpg).size
+        p = PyProcessor()
+        p.decode(to_rgb=True)
+        self.assertEqual(p(self.img_data).shape, (h, w, 3))
+
+        buf = io.BytesIO()
+        Image.open(self.test_jpg).save(buf, format='PNG')
+        p = PyProcessor()
+        p.decode_random_crop(64, to_rgb=True)
+        self.assertEqual(p(buf.getvalue()).shape, (64, 64, 3))
+
+    def test_decode_random_crop_orientation(self):
+        """ test decoding and random cropping jpeg images with exif
+            orientation, same as decoding before random cropping
+        """
+        import io
+        from PIL import Image
+        img = Image.new('RGB', (400, 100), (10, 200, 30))
+        exif = img.getexif()
+        exif[0x0112] = 6  # rotated by 90 degrees clockwise
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', exif=exif.tobytes())
+
+        fused = PyProcessor()
+        fused.decode_random_crop(32, scale=[0.08, 1.0], to_rgb=True)
+        unfused = PyProcessor()
+        unfused.decode(to_rgb=True).random_crop(32, scale=[0.08, 1.0])
+        for seed in xrange(20):
+            self.assertEqual(fused(buf.getvalue(), seed=seed).shape,
+                             (32, 32, 3))
+            self.assertEqual(unfused(buf.getvalue(), seed=seed).shape,
+                             (32, 32, 3))
+
     def test_resize(self):
         """ test decode
         """
@@ -108,6 +157,53 @@ class TestPyTransformer(unittest.TestCase):
         self.assertEqual(label, '123')
         self.assertEqual(len(result.shape), 3)
 
+    def test_lua_states(self):
+        """ test lua ops run by multiple threads with a pool of states
+        """
+        from visreader.transformer.pytransformer import Builder
+        img = self.img_data
+        builder = Builder(thread_num=4)
+        builder.lua(lua_code=lua_ops['decode'], state_num=2)
+        self.assertEqual(builder.build_ops_conf()[0]['state_num'], '2')
+
+        transformer = builder.build()
+        transformer.start()
+        for i in xrange(8):
+            transformer.put(img, str(i))
+        labels = [transformer.get()[1] for i in xrange(8)]
+        transformer.stop()
+        self.assertEqual(sorted(labels), [str(i) for i in xrange(8)])
+
+        proc = PyProcessor(thread_num=4)
+        proc.lua(lua_code=lua_ops['decode'])
+        results, labels = proc.process_batch([img] * 8, labels=range(8))
+        self.assertEqual(labels, [str(i) for i in xrange(8)])
+
+    def test_lua_with_native_ops(self):
+        """ test lua op planned between native ops
+        """
+        from visreader import operators as ops
+        from visreader.operators.base import make_cpp_plan
+        from visreader.transformer.pytransformer import Builder
+        planner = Builder()
+        post_mapper = make_cpp_plan([ops.DecodeImage(), ops.CropImage(64), \
+            ops.LuaProcessImage(lua_code=lua_ops['flip'])], planner)
+        self.assertIsNone(post_mapper)
+        self.assertEqual([c['op_name'] for c in planner.build_ops_conf()],
+                         ['decode', 'crop', 'lua_op'])
+
+        img = self.img_data
+        proc = PyProcessor()
+        proc.decode(to_rgb=True).center_crop(64)
+        expect = proc(img)[:, ::-1, :]
+
+        proc = PyProcessor()
+        proc.decode(to_rgb=True).center_crop(64)
+        proc.lua(lua_code=lua_ops['flip']).to_chw()
+        result, label = proc(img, '1')
+        self.assertEqual(label, '1')
+        self.assertTrue(np.array_equal(result, expect.transpose((2, 0, 1))))
+
     def test_decode_diff(self):
         """ test decode diff
         """
@@ -144,6 +240,375 @@ class TestPyTransformer(unittest.TestCase):
         result, _ = proc(img, '')
         self.assertEqual(np.sum(np.abs(lua_result - result)), 0)
 
+    def test_normalize(self):
+        """ test normalize in native ops
+        """
+        img = self.img_data
+        proc = PyProcessor()
+        proc.decode(to_rgb=True)
+        decoded = proc(img)
+
+        proc.reset()
+        proc.decode(to_rgb=True).normalize()
+        result = proc(img)
+        self.assertEqual(result.dtype, np.float32)
+        expect = NormalizeImage(order='hwc')(decoded)
+        self.assertTrue(np.allclose(result, expect, atol=1e-4))
+
+        proc.reset()
+        proc.decode(to_rgb=True).normalize_to_chw(dtype='float16')
+        result = proc(img)
+        self.assertEqual(result.dtype, np.float16)
+        self.assertTrue(
+            np.allclose(result, expect.transpose((2, 0, 1)), atol=1e-2))
+
+    def test_distort_color(self):
+        """ test color jitters in native ops
+        """
+        img = self.img_data
+        proc = PyProcessor()
+        proc.decode(to_rgb=True)
+        decoded = proc(img)
+
+        proc.reset()
+        proc.decode(to_rgb=True).brightness([1.0, 1.0]).contrast(
+            [1.0, 1.0]).saturation([1.0, 1.0]).hue([0.0, 0.0])
+        result = proc(img)
+        self.assertLessEqual(np.abs(result.astype('int') - decoded).max(), 2)
+
+        proc.reset()
+        proc.decode(to_rgb=True).distort_color(
+            brightness=[0.5, 1.5], contrast=[0.5, 1.5], hue=[-0.1, 0.1])
+        result = proc(img, seed=1)
+        self.assertEqual(result.shape, decoded.shape)
+        self.assertTrue(np.array_equal(result, proc(img, seed=1)))
+
+    def test_post_workers(self):
+        """ test python ops left by native plan running in a pool of workers
+        """
+        from visreader import operators as ops
+
+        class ToFloat(object):
+            def __call__(self, img):
+                return img.astype('float32')
+
+            def make_plan(self, planner):
+                raise NotImplementedError('ToFloat.make_plan not implemented')
+
+        data_num = 20
+
+        def _data_source():
+            for i in xrange(data_num):
+                yield (self.img_data, str(i))
+
+        img_ops = [ops.DecodeImage(), ops.ResizeImage(size=64), ToFloat()]
+        for mode in ['python_thread', 'python_process']:
+            mapper = ops.build(
+                img_ops,
+                worker_num=4,
+                worker_mode='native_thread',
+                post_worker_num=2,
+                post_worker_mode=mode)
+            results = list(mapper(_data_source)())
+            self.assertEqual(len(results), data_num)
+            self.assertEqual(
+                sorted([int(l) for _, l in results]), range(data_num))
+            self.assertTrue(all([img.dtype == np.float32 \
+                for img, _ in results]))
+
+    def test_process_batch(self):
+        """ test processing a batch of images in native threads
+        """
+        img = self.img_data
+        proc = PyProcessor(thread_num=4)
+        proc.decode(to_rgb=True).center_crop(224).to_chw()
+        expect = proc(img)
+
+        result, labels = proc.process_batch([img] * 8, labels=range(8))
+        self.assertEqual(result.shape, (8, 3, 224, 224))
+        self.assertEqual(labels, [str(i) for i in range(8)])
+        self.assertTrue(all([np.array_equal(r, expect) for r in result]))
+
+        out = np.zeros((8, 3, 224, 224), dtype='uint8')
+        self.assertTrue(proc.process_batch([img] * 8, out=out) is out)
+        self.assertTrue(np.array_equal(out[-1], expect))
+
+        proc.reset()
+        proc.decode(to_rgb=True).random_crop(64)
+        result = proc.process_batch([img] * 4, seeds=[1, 2, 1, 2])
+        self.assertTrue(np.array_equal(result[0], result[2]))
+        self.assertTrue(np.array_equal(result[0], proc(img, seed=1)))
+
+        with self.assertRaises(Exception):
+            proc.process_batch([img, 'not an image'])
+        with self.assertRaises(Exception):
+            proc.process_batch(['not an image', img])
+
+        # images in any buffers are processed without copying
+        images = [bytearray(img), memoryview(img), np.frombuffer(img, 'uint8')]
+        result = proc.process_batch(images, seeds=[1, 1, 1])
+        self.assertEqual(result.shape, (3, 64, 64, 3))
+        for r in result:
+            self.assertTrue(np.array_equal(r, proc(img, seed=1)))
+
+    def test_zero_copy_get(self):
+        """ test results got from transformer wrap native buffers
+            which are reused after the arrays are freed
+        """
+        from visreader.transformer.pytransformer import Builder
+        builder = Builder(thread_num=2, queue_limit=16)
+        builder.decode(to_rgb=True).center_crop(64).to_chw()
+        transformer = builder.build()
+        transformer.start()
+        expect = PyProcessor().decode(to_rgb=True).center_crop(64).to_chw()(
+            self.img_data)
+
+        transformer.put(self.img_data, '0')
+        ctx = {}
+        img, label = transformer.get(ctx)
+        self.assertFalse(img.flags.owndata)
+        self.assertTrue(np.array_equal(img, expect))
+        self.assertEqual(ctx['shape'], list(expect.shape))
+        self.assertEqual(ctx['dtype'], 'uint8')
+
+        cytransformer = transformer._cytransformer
+        del img
+        self.assertEqual(cytransformer.pool_size(), 1)
+        transformer.put(self.img_data, '1')
+        img, label = transformer.get()
+        self.assertEqual(cytransformer.pool_size(), 0)
+        self.assertEqual(label, '1')
+        self.assertTrue(np.array_equal(img, expect))
+        transformer.stop()
+
+    def test_get_many(self):
+        """ test getting results in batch and without blocking,
+            and getting returns at once after all results are got
+        """
+        from visreader.transformer.pytransformer import Builder
+        builder = Builder(thread_num=2, queue_limit=16)
+        builder.decode(to_rgb=True).center_crop(64)
+        transformer = builder.build()
+        transformer.start()
+
+        ctx = {}
+        img, label = transformer.try_get(ctx)
+        self.assertIsNone(img)
+        self.assertEqual(ctx['retcode'], 2)
+
+        num = 6
+        for i in xrange(num):
+            transformer.put(self.img_data, str(i))
+        transformer.put('not an image', 'bad')
+        transformer.stop()
+
+        labels = []
+        errors = []
+        while True:
+            ctx = {}
+            results = transformer.get_many(4, ctx)
+            if not results:
+                self.assertEqual(ctx['retcode'], 1)
+                break
+            self.assertLessEqual(len(results), 4)
+            self.assertEqual(len(results), len(ctx['ids']))
+            errors += ctx['errors']
+            for img, label in results:
+                if img is None:
+                    self.assertEqual(label, 'bad')
+                    continue
+                labels.append(label)
+                self.assertEqual(img.shape, (64, 64, 3))
+
+        self.assertEqual(sorted(labels), [str(i) for i in xrange(num)])
+        self.assertEqual(len(errors), 1)
+        self.assertNotEqual(errors[0]['err_no'], 0)
+
+        # a batch in which all have failed is not taken as the end
+        transformer = builder.build(with_meta=True)
+        transformer.start()
+        transformer.put('not an image', 'bad', meta='m')
+        transformer.stop()
+        ctx = {}
+        self.assertEqual(transformer.get_many(4, ctx), [(None, 'bad', 'm')])
+        self.assertEqual(len(ctx['errors']), 1)
+        self.assertEqual(transformer.get_many(4), [])
+
+        start_ts = time.time()
+        self.assertEqual(transformer.get(), (None, None))
+        ctx = {}
+        self.assertEqual(transformer.try_get(ctx), (None, None))
+        self.assertEqual(ctx['retcode'], 1)
+        self.assertLess(time.time() - start_ts, 0.05)
+
+    def test_put_buffers(self):
+        """ test putting images in any objects supporting the buffer protocol
+            with labels passed through as they are
+        """
+        import mmap
+        from visreader.transformer.pytransformer import Builder
+        builder = Builder(thread_num=2)
+        builder.decode(to_rgb=True).center_crop(64)
+        transformer = builder.build()
+        transformer.start()
+
+        size = len(self.img_data)
+        mm = mmap.mmap(-1, size + 8)
+        mm[8:] = self.img_data
+        images = [
+            self.img_data, bytearray(self.img_data),
+            memoryview(self.img_data),
+            np.frombuffer(self.img_data, dtype=np.uint8),
+            np.frombuffer(mm, dtype=np.uint8, count=size, offset=8),
+        ]
+        for i, img in enumerate(images):
+            transformer.put(img, (i, 'meta'))
+        del images
+
+        expect = PyProcessor().decode(to_rgb=True).center_crop(64)(
+            self.img_data)
+        labels = []
+        for i in xrange(5):
+            img, label = transformer.get()
+            self.assertTrue(np.array_equal(img, expect))
+            labels.append(label)
+        self.assertEqual(sorted(labels), [(i, 'meta') for i in xrange(5)])
+        mm.close()
+
+        transformer.put(self.img_data, '9')
+        img, label = transformer.get()
+        self.assertEqual(label, '9')
+        transformer.stop()
+
+    def test_put_many(self):
+        """ test putting samples in bulk with metas and seeds
+        """
+        from visreader.transformer.pytransformer import Builder
+        builder = Builder(thread_num=2, queue_limit=16)
+        builder.decode(to_rgb=True).random_crop(32, scale=[0.08, 1.0])
+        transformer = builder.build(with_meta=True)
+        transformer.start()
+
+        num = 8
+        images = [self.img_data] * num
+        labels = range(num)
+        metas = [('meta', i) for i in xrange(num)]
+        seeds = [i % 2 for i in xrange(num)]
+        transformer.put_many(images, labels, metas, seeds)
+        transformer.stop()
+
+        results = {}
+        while True:
+            batch = transformer.get_many(num)
+            if not batch:
+                break
+            for img, label, meta in batch:
+                self.assertEqual(meta, ('meta', label))
+                results[label] = img
+
+        self.assertEqual(sorted(results.keys()), labels)
+        for i in xrange(2, num):
+            self.assertTrue(np.array_equal(results[i], results[i % 2]))
+
+    def test_put_many_over_limit(self):
+        """ test putting batches larger than the queue limit
+        """
+        import threading
+        from visreader.transformer.pytransformer import Builder
+        builder = Builder(thread_num=2, queue_limit=4)
+        builder.decode(to_rgb=True).center_crop(32)
+        transformer = builder.build()
+        transformer.start()
+
+        num = 10
+        rounds = 3
+
+        def _producer():
+            for r in xrange(rounds):
+                labels = [str(r * num + i) for i in xrange(num)]
+                transformer.put_many([self.img_data] * num, labels)
+            transformer.stop()
+
+        producer = threading.Thread(target=_producer)
+        producer.daemon = True
+        producer.start()
+
+        labels = []
+        while True:
+            batch = transformer.get_many(num)
+            if not batch:
+                break
+            labels.extend(label for _, label in batch)
+
+        producer.join(10)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(sorted(labels, key=int),
+                         [str(i) for i in xrange(num * rounds)])
+
+    def test_stats(self):
+        """ test timing stats of native ops
+        """
+        from visreader.transformer.pytransformer import Builder
+        builder = Builder(thread_num=2)
+        builder.decode(to_rgb=True).resize(64, 64).to_chw()
+        transformer = builder.build()
+        transformer.start()
+
+        num = 4
+        for i in xrange(num):
+            transformer.put(self.img_data, str(i))
+        transformer.put('not an image', 'bad')
+        transformer.stop()
+        got = 0
+        while got < num + 1:
+            ctx = {}
+            got += len(transformer.get_many(num + 1, ctx))
+            self.assertEqual(ctx['retcode'], 0)
+        self.assertEqual(transformer.get_many(num + 1), [])
+
+        stats = transformer.stats()
+        self.assertEqual([st['name'] for st in stats],
+                         ['decode', 'resize', 'tochw', 'total'])
+        decode, resize, tochw, total = stats
+        self.assertEqual(decode['count'], num + 1)
+        self.assertEqual(sum(decode['errors'].values()), 1)
+        self.assertEqual(resize['count'], num)
+        self.assertEqual(resize['errors'], {})
+        self.assertEqual(tochw['count'], num)
+        self.assertEqual(total['count'], num + 1)
+        self.assertEqual(sum(n for _, n in total['hist']), num + 1)
+        self.assertGreater(decode['total_ms'], 0)
+        self.assertGreaterEqual(total['total_ms'], decode['total_ms'])
+        self.assertGreaterEqual(decode['max_ms'], decode['avg_ms'])
+
+        self.assertEqual(transformer.stats(reset=True)[0]['count'], num + 1)
+        self.assertEqual(transformer.stats()[0]['count'], 0)
+
+    def test_cpu_affinity(self):
+        """ test binding native workers to cpus
+        """
+        from visreader.transformer.pytransformer import Builder
+        for affinity in ['spread', '0', None]:
+            builder = Builder(thread_num=2)
+            builder.decode(to_rgb=True).center_crop(64)
+            if affinity is not None:
+                builder.set_conf('cpu_affinity', affinity)
+            else:
+                builder.set_conf('cpu_affinity_exclude', '10000')
+            transformer = builder.build()
+            transformer.start()
+            transformer.put(self.img_data, '0')
+            img, label = transformer.get()
+            self.assertEqual(img.shape, (64, 64, 3))
+            transformer.stop()
+
+        for k, v in [('cpu_affinity', '3-1'), ('cpu_affinity', 'all'),
+                     ('cpu_affinity_exclude', '0-10000')]:
+            builder = Builder(thread_num=2)
+            builder.decode(to_rgb=True).set_conf(k, v)
+            with self.assertRaises(Exception):
+                builder.build()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,12 +2,16 @@ import os
 import time
 import unittest
 import sys
+import shutil
+import tempfile
 import logging
 
 import set_env
 import visreader
 from visreader.reader_builder import ReaderBuilder
 from visreader.reader_builder import ReaderSetting
+from visreader.reader_builder import compile_spec
+from visreader.reader_builder import SpecError
 
 logging.basicConfig(level=logging.INFO)
 
@@ -91,6 +95,83 @@ class TestReaderBuilder(unittest.TestCase):
         print('total got %d val samples in %dms' \
             % (ct, 1000 * (time.time() - start_ts)))
 
+    def test_spec(self):
+        """ test pipeline compiled from spec
+        """
+        work_dir = os.path.dirname(os.path.realpath(__file__))
+        with open(os.path.join(work_dir, 'test.jpg'), 'rb') as f:
+            img_data = f.read()
+
+        data_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(data_dir, 'part-0'), 'w') as f:
+                f.write('\n'.join([str(i) for i in range(10)]) + '\n')
+
+            spec = {
+                'source': {'uri': data_dir, 'filetype': 'textfile'},
+                'seed': 1,
+                'stages': [
+                    {'shuffle': {'size': 4}},
+                    {'map': {'record_mapper': lambda l: (img_data, int(l))}},
+                    {'map_ops': {
+                        'ops': [
+                            {'DecodeImage': {}},
+                            {'ResizeImage': {'resize_short': 40}},
+                            {'CropImage': {'size': 32}},
+                            {'ToCHWImage': None},
+                        ],
+                        'worker_num': 2,
+                    }},
+                    {'batch': {'size': 4}},
+                ]
+            }
+
+            compiled = compile_spec(spec)
+            # lambdas can not be cached
+            self.assertIsNot(compiled, compile_spec(spec))
+            self.assertIsNot(compiled.pipeline(), compiled.pipeline())
+            batches = [b for b in compiled.reader()()]
+            self.assertEqual([4, 4, 2], [len(b) for b in batches])
+            labels = sorted([l for b in batches for _, l in b])
+            self.assertEqual(range(10), labels)
+            for img, _ in batches[0]:
+                self.assertEqual(img.shape, (3, 32, 32))
+        finally:
+            shutil.rmtree(data_dir)
+
+        spec = {
+            'seed': 1,
+            'stages': [
+                {'shuffle': {'size': 4}},
+                {'map': {'record_mapper': os.path.basename}},
+                {'map_ops': {'ops': [{'ToCHWImage': None}], 'worker_num': 2}},
+            ]
+        }
+        compiled = compile_spec(spec)
+        self.assertIs(compiled, compile_spec(spec))
+        self.assertIsNot(compiled, compile_spec(dict(spec, seed=2)))
+
+        # settings of readers override params in spec
+        from visreader.reader_builder import spec as spec_mod
+        changed = spec_mod.apply_settings(spec, \
+            {'seed': 3, 'map_ops': {'worker_num': 4}})
+        self.assertEqual(3, changed['seed'])
+        self.assertEqual(4, changed['stages'][2]['map_ops']['worker_num'])
+        self.assertEqual(2, spec['stages'][2]['map_ops']['worker_num'])
+
+        invalids = [
+            {'seed': object()},
+            {'stages': [{'unknown': {}}]},
+            {'stages': [{'shuffle': {'bad_param': 1}}]},
+            {'stages': [{'map_ops': {'ops': [{'NotExistImage': {}}]}}]},
+            {'stages': [{'map_ops': {'ops': [{'CropImage': {}}]}}]},
+            {'stages': [{'map_ops': {'ops': [{'ToCHWImage': {}}], \
+                'worker_mode': 'unknown'}}]},
+            {'stages': [{'map': {'record_mapper': 'not_exist_module:func'}}]},
+        ]
+        for spec in invalids:
+            self.assertRaises(SpecError, compile_spec, spec)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -69,12 +69,53 @@ class PyTransformer(object):
         del self._buffer[id]
         return img, label, meta
 
-    def put(self, image, label, meta=None):
-        """ put a sample to CyTransformer
+    def try_get(self, ctx=None):
+        """ get a transformed data like 'get' without blocking, 'img' is
+            None if no one is ready for now or all have been got after
+            stopped, and 'ctx['retcode']' is 2 or 1 respectively
+        """
+        ctx = {} if ctx is None else ctx
+        img, label = self._cytransformer.try_get(ctx)
+        if img is None or not self._with_meta:
+            return img, label
+
+        id = ctx['id']
+        meta = self._buffer[id]
+        del self._buffer[id]
+        return img, label, meta
+
+    def get_many(self, num, ctx=None):
+        """ get at most 'num' transformed data, which blocks until one
+            is ready, an empty list is returned only after all have been got
+
+        Args:
+            @num (int): max num of data to get
+            @ctx (dict): contexts of failed ones are put
+                into 'ctx['errors']'
+
+        Returns:
+            list of data in the same form as 'get', where the image
+            is None for failed ones
+        """
+        ctx = {} if ctx is None else ctx
+        results = self._cytransformer.get_many(num, ctx)
+        if not self._with_meta:
+            return results
+
+        return [(img, label, self._buffer.pop(id)) \
+            for (img, label), id in zip(results, ctx['ids'])]
+
+    def put(self, image, label, meta=None, seed=None):
+        """ put a sample to CyTransformer, and if 'seed' is not None,
+            random operators on this sample will use a generator seeded by it,
+            'image' can be any object supporting the buffer protocol which is
+            not copied, and 'label' is got back as it is
         """
-        label = str(label) if type(label) is not str else label
         id = self._id
-        self._cytransformer.put(image, label, {'id': id})
+        ctx = {'id': id}
+        if seed is not None:
+            ctx['seed'] = seed
+        self._cytransformer.put(image, label, ctx)
 
         if self._with_meta:
             assert id not in self._buffer
@@ -87,11 +128,45 @@ class PyTransformer(object):
         if self._id >= sys.maxint:
             self._id = 0
 
+    def put_many(self, images, labels, metas=None, seeds=None):
+        """ put samples in bulk like 'put', which crosses into
+            CyTransformer only once
+
+        Args:
+            @images (list): images supporting the buffer protocol
+            @labels (list): labels of 'images'
+            @metas (list): metas of 'images' if not None
+            @seeds (list): seeds for random operators on each image if not None
+        """
+        n = len(images)
+        ids = [(self._id + i) % sys.maxint for i in xrange(n)]
+        self._cytransformer.put_many(images, labels, ids, seeds)
+
+        if self._with_meta:
+            metas = [None] * n if metas is None else metas
+            for id, meta in zip(ids, metas):
+                assert id not in self._buffer
+                self._buffer[id] = meta
+        elif metas is not None and any(m is not None for m in metas):
+            logger.warn('cannot put meta to this pytransformer')
+
+        self._id = (self._id + n) % sys.maxint
+
     def stop(self):
         """ stop CTransformer (just indicate to stop)
         """
         self._cytransformer.stop()
 
+    def stats(self, reset=False):
+        """ timing stats of native ops, see 'CyTransformer.stats'
+        """
+        return self._cytransformer.stats(reset)
+
+    def reset_stats(self):
+        """ clear timing stats of native ops
+        """
+        self._cytransformer.reset_stats()
+
 
 class ImageOpConf(object):
     def __init__(self):
@@ -103,27 +178,43 @@ class ImageOpConf(object):
         self._ops = []
         return self
 
-    def lua(self, lua_fname='', lua_code='', tochw=False):
-        """ add op which is implemented by lua code 'lua_fname' or 'lua_code'
+    def lua(self, lua_fname='', lua_code='', tochw=False, state_num=None):
+        """ add op which is implemented by lua code 'lua_fname' or 'lua_code',
+            'lua_main' in it is called with '{image, label}' and returns
+            '{image, label}' like that, it gets the encoded image if it's
+            the first op, otherwise the one output by the previous op, in
+            which case the label is empty and 'tochw' is ignored
 
         Args:
             @lua_fname(str): file path to a lua script 
             @lua_code(str): a lua code string
             @tochw (bool): whether convert to 'chw' from 'hwc' for final image
+            @state_num (int): num of lua states running the script, default
+                to one for each native thread, eg: 'thread_num' of 'Builder'
         """
         assert type(lua_fname) is str and type(
             lua_code) is str, "invalid type of params for lua op"
         assert len(lua_fname) > 0 or len(lua_code) > 0, 'invalid lua script'
 
-        self._ops.append(("lua_op", {
+        conf = {
             "lua_fname": lua_fname,
             "lua_code": lua_code,
             "tochw": int(tochw)
-        }))
+        }
+        if state_num is not None:
+            assert state_num > 0, 'invalid state_num[%s]' % (state_num)
+            conf['state_num'] = state_num
+        self._ops.append(("lua_op", conf))
         return self
 
-    def decode(self, to_rgb=None):
+    def decode(self, to_rgb=None, size_hint=None):
         """ decode image
+
+        Args:
+            to_rgb (bool): whether to decode to RGB image
+            size_hint (int or tuple): if not None, jpeg images will be decoded
+                with a reduced size which is not smaller than this,
+                int for the short edge, and tuple for (w, h)
         """
         if to_rgb is None or to_rgb is False:
             mode = 'UNCHANGED'
@@ -133,6 +224,11 @@ class ImageOpConf(object):
         #defined in 'opencv2/imgcodecs/imgcodecs_c.h'
         mode2num = {'UNCHANGED': -1, 'GRAY': 0, 'RGB': 1}
         conf = {"mode": mode2num[mode]}
+        if type(size_hint) is int:
+            conf["min_short"] = size_hint
+        elif size_hint is not None:
+            conf["min_w"] = size_hint[0]
+            conf["min_h"] = size_hint[1]
         self._ops.append(("decode", conf))
         return self
 
@@ -178,31 +274,65 @@ class ImageOpConf(object):
         self._ops.append(("crop", conf))
         return self
 
-    def random_crop(self, size, scale=None, ratio=None):
+    def random_crop(self, size, scale=None, ratio=None, interpolation=None):
         """ random crop a sub area in decoded image and resize to 'size'
 
         Args:
             size (int): final size to return for this op
             scale (list of floats): max scale size of w and h
             ratio (list of floats):  
+            interpolation (str or int): flag of interpolation to resize,
+                default to 'INTER_LANCZOS4'
+
+        Return:
+            self
+        """
+        self._ops.append(("random_crop", self._rand_crop_conf(
+            size, scale, ratio, interpolation)))
+        return self
+
+    def decode_random_crop(self, size, scale=None, ratio=None, to_rgb=None, \
+            interpolation=None):
+        """ decode and random crop an image, the crop window is picked with
+            the size in jpeg header if built with turbojpeg, so only the
+            cropped area is decoded, otherwise the whole image is decoded
+
+        Args:
+            size (int): final size to return for this op
+            scale (list of floats): max scale size of w and h
+            ratio (list of floats): range of aspect ratio to crop
+            to_rgb (bool): whether to decode to RGB image
+            interpolation (str or int): flag of interpolation to resize,
+                default to 'INTER_LANCZOS4'
 
         Return:
             self
         """
+        conf = self._rand_crop_conf(size, scale, ratio, interpolation)
+        conf["mode"] = 1 if to_rgb else -1
+        self._ops.append(("decode_random_crop", conf))
+        return self
+
+    def _rand_crop_conf(self, size, scale, ratio, interpolation):
+        """ conf of random crop ops
+        """
         if type(size) is int:
             size = (size, size)
 
+        if interpolation is None:
+            interpolation = interpolation_flags['INTER_LANCZOS4']
+        elif type(interpolation) is str:
+            interpolation = interpolation_flags[interpolation]
+
         scale = [0.08, 1.0] if scale is None else scale
         ratio = [3. / 4., 4. / 3.] if ratio is None else ratio
 
-        conf = {
+        return {
             "scale": ",".join([str(i) for i in scale]),
             "ratio": ",".join([str(i) for i in ratio]),
-            "interpolation": interpolation_flags['INTER_LANCZOS4'],
+            "interpolation": interpolation,
             "final_size": ",".join([str(i) for i in size])
         }
-        self._ops.append(("random_crop", conf))
-        return self
 
     def resize(self, w, h, interpolation=None):
         """ resize the image to target size
@@ -282,6 +412,129 @@ class ImageOpConf(object):
         self._ops.append(("tochw", {"value": 1}))
         return self
 
+    def normalize_to_chw(self, scale=None, mean=None, std=None,
+                         dtype='float32'):
+        """ convert the output to a normalized one in CHW, which is
+            '(img * scale - mean) / std' done in one pass,
+            and it's applied after all other ops
+
+        Args:
+            scale (float): scale of pixels, default to 1/255
+            mean (list of floats): mean of each channel
+            std (list of floats): std of each channel
+            dtype (str): 'float32' or 'float16'
+
+        Return:
+            self
+        """
+        conf = self._normalize_conf(scale, mean, std)
+        conf["dtype"] = dtype
+        self._ops.append(("normalize_to_chw", conf))
+        return self
+
+    def normalize(self, scale=None, mean=None, std=None):
+        """ normalize the image to float32 with '(img * scale - mean) / std'
+
+        Args:
+            scale (float): scale of pixels, default to 1/255
+            mean (list of floats): mean of each channel
+            std (list of floats): std of each channel
+
+        Return:
+            self
+        """
+        self._ops.append(("normalize", self._normalize_conf(scale, mean,
+                                                            std)))
+        return self
+
+    def _normalize_conf(self, scale, mean, std):
+        """ conf of normalize ops which compute 'img * alpha + beta'
+        """
+        scale = 1.0 / 255.0 if scale is None else scale
+        mean = [0.485, 0.456, 0.406] if mean is None else mean
+        std = [0.229, 0.224, 0.225] if std is None else std
+        alpha = [float(scale) / s for s in std]
+        beta = [-float(m) / s for m, s in zip(mean, std)]
+        return {
+            "alpha": ",".join([repr(i) for i in alpha]),
+            "beta": ",".join([repr(i) for i in beta]),
+        }
+
+    def brightness(self, random_range):
+        """ adjust brightness of the image like 'PIL.ImageEnhance.Brightness'
+
+        Args:
+            random_range (list of floats): range of the random factor
+
+        Return:
+            self
+        """
+        return self._color("brightness", random_range)
+
+    def contrast(self, random_range):
+        """ adjust contrast of the image like 'PIL.ImageEnhance.Contrast'
+
+        Args:
+            random_range (list of floats): range of the random factor
+
+        Return:
+            self
+        """
+        return self._color("contrast", random_range)
+
+    def saturation(self, random_range):
+        """ adjust saturation of the image like 'PIL.ImageEnhance.Color'
+
+        Args:
+            random_range (list of floats): range of the random factor
+
+        Return:
+            self
+        """
+        return self._color("saturation", random_range)
+
+    def hue(self, random_range):
+        """ rotate hue of the image
+
+        Args:
+            random_range (list of floats): range of the random delta in turns,
+                eg: [-0.1, 0.1] for at most 36 degrees
+
+        Return:
+            self
+        """
+        return self._color("hue", random_range)
+
+    def _color(self, op_name, random_range):
+        conf = {"range": ",".join([str(i) for i in random_range])}
+        self._ops.append((op_name, conf))
+        return self
+
+    def distort_color(self, brightness=None, contrast=None, saturation=None, \
+            hue=None):
+        """ adjust colors of the image in a random order,
+            jitters with a None range are skipped
+
+        Args:
+            brightness (list of floats): range of the brightness factor
+            contrast (list of floats): range of the contrast factor
+            saturation (list of floats): range of the saturation factor
+            hue (list of floats): range of the hue delta in turns
+
+        Return:
+            self
+        """
+        ranges = {
+            'brightness': brightness,
+            'contrast': contrast,
+            'saturation': saturation,
+            'hue': hue
+        }
+        conf = {k: ",".join([str(i) for i in v]) \
+            for k, v in ranges.items() if v is not None}
+        self._ops.append(("distort_color", conf))
+        return self
+
     def build_ops_conf(self):
         """ build operators conf for creating a image process from C++
         """
@@ -328,7 +581,12 @@ class Builder(ImageOpConf):
         return self
 
     def set_conf(self, k, v):
-        """ set configuration items
+        """ set configuration items, eg:
+            'cpu_affinity': cpus which native workers are bound to, either
+                a list like '0-3,8' which workers are pinned to one by one,
+                or 'spread' to bind workers to numa nodes in turn
+            'cpu_affinity_exclude': cpus never used by native workers,
+                eg: the ones used by a trainer in the same machine
         """
         self._conf[k] = v
         return self
@@ -351,9 +609,19 @@ class Builder(ImageOpConf):
 
 
 class PyProcessor(ImageOpConf):
-    def __init__(self):
+    def __init__(self, thread_num=None):
+        """ init
+
+        Args:
+            @thread_num (int): num of native threads used by 'process_batch',
+                default to the num of cpus
+        """
         super(PyProcessor, self).__init__()
         self._cyprocessor = None
+        if thread_num is None:
+            import multiprocessing
+            thread_num = multiprocessing.cpu_count()
+        self.thread_num = thread_num
 
     def reset(self):
         """ clear all ops
@@ -369,15 +637,38 @@ class PyProcessor(ImageOpConf):
         self._cyprocessor = CyProcessor(ops_conf)
         return self._cyprocessor
 
-    def __call__(self, image, label=None):
+    def __call__(self, image, label=None, seed=None):
         if self._cyprocessor is None:
             self._init()
 
         if label is None:
-            img, _ = self._cyprocessor.process(image, '')
+            img, _ = self._cyprocessor.process(image, '', seed=seed)
             return img
         else:
-            return self._cyprocessor.process(image, str(label))
+            return self._cyprocessor.process(image, str(label), seed=seed)
+
+    def process_batch(self, images, labels=None, seeds=None, out=None):
+        """ process a list of encoded images concurrently by native threads,
+            all results should be in the same shape
+
+        Args:
+            @images (list): encoded images in str or any objects
+                supporting the buffer protocol, which are not copied
+            @labels (list): labels of these images
+            @seeds (list of int): seeds for random ops on each image
+            @out (np.ndarray): array in shape (N, ...) to write the results,
+                eg: (N, C, H, W) for ops ended with 'to_chw', a new one is
+                created if None
+
+        Returns:
+            array of results if 'labels' is None, otherwise (array, labels)
+        """
+        if self._cyprocessor is None:
+            self._init()
+
+        out, out_labels = self._cyprocessor.process_batch(
+            images, labels, seeds=seeds, out=out, thread_num=self.thread_num)
+        return out if labels is None else (out, out_labels)
 
 
 class Keeper(object):
@@ -398,41 +689,93 @@ class Keeper(object):
 
 
 def xmap_reader(reader, planner, buffer_size=1000, \
-        worker_num=16, with_label=True, post_mapper=None, **kwargs):
+        worker_num=16, with_label=True, post_mapper=None, seed=None, \
+        post_worker_num=0, post_use_process=False, post_order=False, \
+        cpu_affinity=None, cpu_affinity_exclude=None, put_batch_size=32, \
+        **kwargs):
+    """ process samples from 'reader' by native operators in 'planner',
+        and then by python operators in 'post_mapper' if not None
+
+    Args:
+        @post_worker_num (int): number of workers to run 'post_mapper', 0 means
+            running it in the consumer thread, otherwise it's run by a pool
+            of workers which overlaps with native processing
+        @post_use_process (bool): whether to use processes for the pool
+        @post_order (bool): whether the pool keeps the order of samples
+            output by native workers
+        @cpu_affinity (str): cpus to bind native workers to,
+            see 'Builder.set_conf' for the format
+        @cpu_affinity_exclude (str): cpus not used by native workers
+        @put_batch_size (int): max num of samples put to native workers
+            in one call
+
+    Returns:
+        the decorated reader
+    """
     logger.debug('not used params in pytransformer.xmap_reader:[%s]' %
                  (str(kwargs)))
+    use_pool = post_mapper is not None and post_worker_num > 0
 
     planner.set_conf('thread_num', worker_num)
     planner.set_conf('worker_queue_limit', buffer_size)
+    if cpu_affinity is not None:
+        planner.set_conf('cpu_affinity', cpu_affinity)
+    if cpu_affinity_exclude is not None:
+        planner.set_conf('cpu_affinity_exclude', cpu_affinity_exclude)
+    if seed is not None:
+        from ..operators.base import sample_seed
+        from ..operators.base import seed_rng
+
+    def _mapper(r, s=None):
+        if post_mapper is None:
+            return r
 
-    def _mapper(r):
-        if post_mapper is not None:
+        if s is None:
             return post_mapper(r)
+
+        # samples come out of order, so seed python ops for each of them
+        seed_rng(s)
+        try:
+            return post_mapper(r)
+        finally:
+            seed_rng(None)
+
+    def _pool_mapper(r):
+        sample, s = r
+        return _mapper(sample, s)
+
+    def _make_sample(img, label, meta):
+        s = None
+        if seed is not None:
+            s, meta = meta[0], meta[1:]
+
+        if len(meta) > 0:
+            sample = tuple([img, label] + list(meta)) if with_label \
+                    else tuple([img] + list(meta))
         else:
-            return r
+            sample = (img, label) if with_label else (img, )
+
+        if use_pool:  # mapped later by the pool
+            return (sample, s)
+        return _mapper(sample, s)
 
-    def _fetch_data(transformer):
+    def _fetch_many(transformer, num):
+        """ fetch at most 'num' results which are ready
+
+        Returns:
+            (num of results got including failed ones, samples)
+        """
         ctx = {}
-        try:
-            img, label, meta = transformer.get(ctx)
-        except TransformerException as exp:
-            logger.warn('failed to fetch result from transformer.get with '\
-                'exception:%s' % (str(exp)))
-            return True
-
-        if img is None:
-            return False
-        elif 'err_no' in ctx and ctx['err_no'] != 0:
+        results = transformer.get_many(num, ctx)
+        for err in ctx['errors']:
             logger.info('faield convert image err_no[%d] and err_msg[%s]',
-                        ctx['err_no'], ctx['err_msg'])
-            return True
-        else:
-            if len(meta) > 0:
-                sample = tuple([img, label] + list(meta)) if with_label \
-                        else tuple([img] + list(meta))
-            else:
-                sample = (img, label) if with_label else (img, )
-            return _mapper(sample)
+                        err['err_no'], err['err_msg'])
+
+        return len(results), \
+            [_make_sample(*r) for r in results if r[0] is not None]
+
+    # epoch and index of the first sample in next pass
+    ctx = {'epoch': 0, 'index': 0}
 
     def _sync_reader():
         cpp_transformer = planner.build(with_meta=True)
@@ -440,7 +783,19 @@ def xmap_reader(reader, planner, buffer_size=1000, \
 
         cpp_transformer.start()
         count = 0
-        for r in reader():
+        epoch, start = ctx['epoch'], ctx['index']
+        ctx['epoch'] += 1
+        ctx['index'] = 0
+        batch = []
+        batch_size = max(1, min(put_batch_size, buffer_size))
+
+        def _put_batch():
+            images, labels, metas, seeds = zip(*batch)
+            cpp_transformer.put_many(list(images), list(labels), list(metas), \
+                list(seeds) if seed is not None else None)
+            del batch[:]
+
+        for i, r in enumerate(reader(), start):
             img = r[0]
             assert (len(img) > 0), "invalid image with lenght[%d]" % (len(img))
 
@@ -449,28 +804,47 @@ def xmap_reader(reader, planner, buffer_size=1000, \
                 label = r[1]
 
             meta = r[2:] if with_label else r[1:]
-            cpp_transformer.put(img, label, meta)
-            count += 1
+            s = None
+            if seed is not None:
+                s = sample_seed(seed, epoch, i)
+                meta = (s, ) + tuple(meta)
+            batch.append((img, label, meta, s))
+            if len(batch) < batch_size and count + len(batch) < buffer_size:
+                continue
+
+            count += len(batch)
+            _put_batch()
             if count >= buffer_size:
-                r = _fetch_data(cpp_transformer)
-                if r is False:
+                got, samples = _fetch_many(cpp_transformer, buffer_size)
+                if got == 0:
                     return
-                elif r is True:
-                    count -= 1
-                else:
-                    count -= 1
-                    yield r
+                count -= got
+                for sample in samples:
+                    yield sample
+
+        if batch:
+            count += len(batch)
+            _put_batch()
         logging.debug('queue count %s buffer_size %s', count, buffer_size)
-        for i in range(count):
-            r = _fetch_data(cpp_transformer)
-            if r is False:
+        while count > 0:
+            got, samples = _fetch_many(cpp_transformer, count)
+            if got == 0:
                 return
-            elif r is True:
-                pass
-            else:
-                yield r
-
-    return _sync_reader
+            count -= got
+            for sample in samples:
+                yield sample
+
+    rd = _sync_reader
+    if use_pool:
+        from ..pipeline.decorator import xmap_reader as pool_reader
+        rd = pool_reader(_sync_reader, mapper=_pool_mapper, \
+            worker_num=post_worker_num, buffer_size=buffer_size, \
+            use_process=post_use_process, order=post_order)
+
+    if seed is not None:
+        from ..operators.base import with_seed_state
+        rd = with_seed_state(rd, ctx)
+    return rd
 
 
 class CppXmap(object):
@@ -150,4 +150,10 @@ setup(
     packages=find_packages(where=pysource),
     package_dir={'': pysource},
     cmdclass={'build_ext': build_ext},
+    entry_points={
+        'console_scripts': [
+            'visreader-bench-ops=visreader.benchmark.bench_ops:main',
+            'visreader-bench-reader=visreader.benchmark.bench_reader:main',
+        ],
+    },
     ext_modules=extensions)